@@ -1,23 +1,44 @@
-# First some AST Node classes we'll use to build the AST with
+import mmap
+import struct
+import sys
+from array import array
+from functools import partialmethod
+
+
+# First some AST Node classes we'll use to build the AST with.
+# Nodes keep their fields in __slots__ and their name on the class, so a node
+# costs its fields and nothing else. `fields` lists them in constructor order
+# with their shape: a child NODE (or None), a list of NODES, or a plain VALUE.
+NODE, NODES, VALUE = "node", "nodes", "value"
+
+
 class ASTNode:
-    def __init__(self):
-        self.name = "ASTNode"
+    __slots__ = ()
+    name = "ASTNode"
+    fields = ()
+
+    def children(self):
+        # Child nodes in source order; leaves have none
+        return ()
 
 
 class ASTStatementNode(ASTNode):
-    def __init__(self):
-        self.name = "ASTStatementNode"
+    __slots__ = ()
+    name = "ASTStatementNode"
 
 
 class ASTExpressionNode(ASTNode):
-    def __init__(self):
-        self.name = "ASTExpressionNode"
+    __slots__ = ()
+    name = "ASTExpressionNode"
 
 
 class ASTBooleanLiteralNode(ASTExpressionNode):
+    __slots__ = ("value",)
+    name = "ASTBooleanLiteralNode"
+    fields = (("value", VALUE),)
+    visit_name = "visit_boolean_literal_node"
+
     def __init__(self, value):
-        super().__init__()
-        self.name = "ASTBooleanLiteralNode"
         self.value = bool(value)  # Ensure the value is a boolean
 
     def accept(self, visitor):
@@ -25,9 +46,12 @@ class ASTBooleanLiteralNode(ASTExpressionNode):
 
 
 class ASTIntegerNode(ASTExpressionNode):
+    __slots__ = ("value",)
+    name = "ASTIntegerNode"
+    fields = (("value", VALUE),)
+    visit_name = "visit_integer_node"
+
     def __init__(self, v):
-        super().__init__()
-        self.name = "ASTIntegerNode"
         self.value = v
 
     def accept(self, visitor):
@@ -35,9 +59,12 @@ class ASTIntegerNode(ASTExpressionNode):
 
 
 class ASTFloatLiteralNode(ASTExpressionNode):
+    __slots__ = ("value",)
+    name = "ASTFloatLiteralNode"
+    fields = (("value", VALUE),)
+    visit_name = "visit_float_literal_node"
+
     def __init__(self, value):
-        super().__init__()
-        self.name = "ASTFloatLiteralNode"
         self.value = float(value)  # Ensure the value is a float
 
     def accept(self, visitor):
@@ -45,9 +72,12 @@ class ASTFloatLiteralNode(ASTExpressionNode):
 
 
 class ASTTypeNode(ASTNode):
+    __slots__ = ("type_name",)
+    name = "ASTTypeNode"
+    fields = (("type_name", VALUE),)
+    visit_name = "visit_type_node"
+
     def __init__(self, type_name):
-        super().__init__()
-        self.name = "ASTTypeNode"
         self.type_name = type_name  # Ensure the type_name is one of 'float', 'int', 'bool', 'colour'
 
     def accept(self, visitor):
@@ -55,30 +85,43 @@ class ASTTypeNode(ASTNode):
 
 
 class ASTVariableNode(ASTExpressionNode):
+    __slots__ = ("lexeme", "depth", "slot")
+    name = "ASTVariableNode"
+    fields = (("lexeme", VALUE),)
+    visit_name = "visit_variable_node"
+
     def __init__(self, lexeme):
-        super().__init__()
-        self.name = "ASTVariableNode"
         self.lexeme = lexeme
+        self.depth = self.slot = None  # the variable's frame and slot, set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_variable_node(self)
 
 
 class ASTAssignmentNode(ASTStatementNode):
+    __slots__ = ("id", "expr")
+    name = "ASTAssignmentNode"
+    fields = (("id", NODE), ("expr", NODE))
+    visit_name = "visit_assignment_node"
+
     def __init__(self, ast_var_node, ast_expression_node):
-        super().__init__()
-        self.name = "ASTStatementNode"
         self.id = ast_var_node
         self.expr = ast_expression_node
 
     def accept(self, visitor):
         visitor.visit_assignment_node(self)
 
+    def children(self):
+        return (self.id, self.expr)
+
 
 class ASTBlockNode(ASTStatementNode):
+    __slots__ = ("statements",)
+    name = "ASTBlockNode"
+    fields = (("statements", NODES),)
+    visit_name = "visit_block_node"
+
     def __init__(self, statements=None):
-        super().__init__()
-        self.name = "ASTBlockNode"
         self.statements = statements if statements else []
 
     def add_statement(self, statement):
@@ -87,11 +130,17 @@ class ASTBlockNode(ASTStatementNode):
     def accept(self, visitor):
         visitor.visit_block_node(self)
 
+    def children(self):
+        return self.statements
+
 
 class ASTColourLiteralNode(ASTExpressionNode):
+    __slots__ = ("value",)
+    name = "ASTColourLiteralNode"
+    fields = (("value", VALUE),)
+    visit_name = "visit_colour_literal_node"
+
     def __init__(self, value):
-        super().__init__()
-        self.name = "ASTColourLiteralNode"
         self.value = value  # The value should be a hex colour code
 
     def accept(self, visitor):
@@ -99,30 +148,43 @@ class ASTColourLiteralNode(ASTExpressionNode):
 
 
 class ASTFunctionInvocationNode(ASTExpressionNode):
+    __slots__ = ("function_name", "arguments")
+    name = "ASTFunctionInvocationNode"
+    fields = (("function_name", VALUE), ("arguments", NODES))
+    visit_name = "visit_function_invocation_node"
+
     def __init__(self, function_name, arguments):
-        super().__init__()
-        self.name = "ASTFunctionInvocationNode"
         self.function_name = function_name
         self.arguments = arguments  # List of ASTExpressionNode
 
     def accept(self, visitor):
         visitor.visit_function_invocation_node(self)
 
+    def children(self):
+        return self.arguments
+
 
 class ASTIdentifierNode(ASTExpressionNode):
+    __slots__ = ("identifier", "depth", "slot")
+    name = "ASTIdentifierNode"
+    fields = (("identifier", VALUE),)
+    visit_name = "visit_identifier_node"
+
     def __init__(self, identifier):
-        super().__init__()
-        self.name = "ASTIdentifierNode"
         self.identifier = identifier
+        self.depth = self.slot = None  # the variable's frame and slot, set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_identifier_node(self)
 
 
 class ASTMultiplicativeOpNode(ASTExpressionNode):
+    __slots__ = ("left", "operator", "right")
+    name = "ASTMultiplicativeOpNode"
+    fields = (("left", NODE), ("operator", VALUE), ("right", NODE))
+    visit_name = "visit_multiplicative_op_node"
+
     def __init__(self, left, operator, right):
-        super().__init__()
-        self.name = "ASTMultiplicativeOpNode"
         self.left = left
         self.operator = operator
         self.right = right
@@ -130,11 +192,17 @@ class ASTMultiplicativeOpNode(ASTExpressionNode):
     def accept(self, visitor):
         visitor.visit_multiplicative_op_node(self)
 
+    def children(self):
+        return (self.left, self.right)
+
 
 class ASTAdditiveOpNode(ASTExpressionNode):
+    __slots__ = ("left", "operator", "right")
+    name = "ASTAdditiveOpNode"
+    fields = (("left", NODE), ("operator", VALUE), ("right", NODE))
+    visit_name = "visit_additive_op_node"
+
     def __init__(self, left, operator, right):
-        super().__init__()
-        self.name = "ASTAdditiveOpNode"
         self.left = left
         self.operator = operator
         self.right = right
@@ -142,11 +210,17 @@ class ASTAdditiveOpNode(ASTExpressionNode):
     def accept(self, visitor):
         visitor.visit_additive_op_node(self)
 
+    def children(self):
+        return (self.left, self.right)
+
 
 class ASTRelationalOpNode(ASTExpressionNode):
+    __slots__ = ("left", "operator", "right")
+    name = "ASTRelationalOpNode"
+    fields = (("left", NODE), ("operator", VALUE), ("right", NODE))
+    visit_name = "visit_relational_op_node"
+
     def __init__(self, left, operator, right):
-        super().__init__()
-        self.name = "ASTRelationalOpNode"
         self.left = left
         self.operator = operator
         self.right = right
@@ -154,65 +228,103 @@ class ASTRelationalOpNode(ASTExpressionNode):
     def accept(self, visitor):
         visitor.visit_relational_op_node(self)
 
+    def children(self):
+        return (self.left, self.right)
+
 
 class ASTActualParamsNode(ASTExpressionNode):
+    __slots__ = ("parameters",)
+    name = "ASTActualParamsNode"
+    fields = (("parameters", NODES),)
+    visit_name = "visit_actual_params_node"
+
     def __init__(self, parameters):
-        super().__init__()
-        self.name = "ASTActualParamsNode"
         self.parameters = parameters  # List of ASTExpressionNode
 
     def accept(self, visitor):
         visitor.visit_actual_params_node(self)
 
+    def children(self):
+        return self.parameters
+
 
 class ASTUnaryNode(ASTExpressionNode):
+    __slots__ = ("operator", "operand")
+    name = "ASTUnaryNode"
+    fields = (("operator", VALUE), ("operand", NODE))
+    visit_name = "visit_unary_node"
+
     def __init__(self, operator, operand):
-        super().__init__()
-        self.name = "ASTUnaryNode"
         self.operator = operator
         self.operand = operand
 
     def accept(self, visitor):
         visitor.visit_unary_node(self)
 
+    def children(self):
+        return (self.operand,)
+
 
 class ASTSubExpressionNode(ASTExpressionNode):
+    __slots__ = ("expression",)
+    name = "ASTSubExpressionNode"
+    fields = (("expression", NODE),)
+    visit_name = "visit_sub_expression_node"
+
     def __init__(self, expression):
-        super().__init__()
-        self.name = "ASTSubExpressionNode"
         self.expression = expression
 
     def accept(self, visitor):
         visitor.visit_sub_expression_node(self)
 
+    def children(self):
+        return (self.expression,)
+
 
 class ASTFunctionCallNode(ASTExpressionNode):
+    __slots__ = ("identifier", "actual_params", "declaration")
+    name = "ASTFunctionCallNode"
+    fields = (("identifier", VALUE), ("actual_params", NODES))
+    visit_name = "visit_function_call_node"
+
     def __init__(self, identifier, actual_params):
-        super().__init__()
-        self.name = "ASTFunctionCallNode"
         self.identifier = identifier
         self.actual_params = actual_params
+        self.declaration = None  # the called ASTFunctionDecNode (None for builtins), set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_function_call_node(self)
 
+    def children(self):
+        return self.actual_params
+
 
 class ASTVariableDeclarationNode(ASTStatementNode):
+    __slots__ = ("identifier", "type", "suffix", "slot")
+    name = "ASTVariableDeclarationNode"
+    fields = (("identifier", VALUE), ("type", VALUE), ("suffix", NODE))
+    visit_name = "visit_variable_declaration_node"
+
     def __init__(self, identifier, type, suffix=None):
-        super().__init__()
-        self.name = "ASTVariableDeclarationNode"
         self.identifier = identifier
         self.type = type
-        self.suffix = suffix
+        self.suffix = suffix  # the initialiser expression of a let statement
+        self.slot = None  # set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_variable_declaration_node(self)
 
+    def children(self):
+        return (self.suffix,) if isinstance(self.suffix, ASTNode) else ()
+
 
 class ASTIfStatementNode(ASTStatementNode):
+    __slots__ = ("condition", "true_block", "false_block")
+    name = "ASTIfStatementNode"
+    fields = (("condition", NODE), ("true_block", NODE), ("false_block", NODE))
+    visit_name = "visit_if_statement_node"
+
     def __init__(self, condition, true_block, false_block=None):
-        super().__init__()
-        self.name = "ASTIfStatementNode"
         self.condition = condition
         self.true_block = true_block
         self.false_block = false_block
@@ -220,22 +332,34 @@ class ASTIfStatementNode(ASTStatementNode):
     def accept(self, visitor):
         visitor.visit_if_statement_node(self)
 
+    def children(self):
+        return [node for node in (self.condition, self.true_block, self.false_block) if node is not None]
+
 
 class ASTWhileStatementNode(ASTStatementNode):
+    __slots__ = ("condition", "block")
+    name = "ASTWhileStatementNode"
+    fields = (("condition", NODE), ("block", NODE))
+    visit_name = "visit_while_statement_node"
+
     def __init__(self, condition, block):
-        super().__init__()
-        self.name = "ASTWhileStatementNode"
         self.condition = condition
         self.block = block
 
     def accept(self, visitor):
         visitor.visit_while_statement_node(self)
 
+    def children(self):
+        return (self.condition, self.block)
+
 
 class ASTForStatementNode(ASTStatementNode):
+    __slots__ = ("initialization", "condition", "increment", "block")
+    name = "ASTForStatementNode"
+    fields = (("initialization", NODE), ("condition", NODE), ("increment", NODE), ("block", NODE))
+    visit_name = "visit_for_statement_node"
+
     def __init__(self, initialization, condition, increment, block):
-        super().__init__()
-        self.name = "ASTForStatementNode"
         self.initialization = initialization
         self.condition = condition
         self.increment = increment
@@ -244,31 +368,49 @@ class ASTForStatementNode(ASTStatementNode):
     def accept(self, visitor):
         visitor.visit_for_statement_node(self)
 
+    def children(self):
+        return [node for node in (self.initialization, self.condition, self.increment, self.block) if node is not None]
+
 
 class ASTReturnStatementNode(ASTStatementNode):
+    __slots__ = ("expression",)
+    name = "ASTReturnStatementNode"
+    fields = (("expression", NODE),)
+    visit_name = "visit_return_statement_node"
+
     def __init__(self, expression):
-        super().__init__()
-        self.name = "ASTReturnStatementNode"
         self.expression = expression
 
     def accept(self, visitor):
         visitor.visit_return_statement_node(self)
 
+    def children(self):
+        return (self.expression,)
+
 
 class ASTPrintStatementNode(ASTStatementNode):
+    __slots__ = ("expression",)
+    name = "ASTPrintStatementNode"
+    fields = (("expression", NODE),)
+    visit_name = "visit_print_statement_node"
+
     def __init__(self, expression):
-        super().__init__()
-        self.name = "ASTPrintStatementNode"
         self.expression = expression
 
     def accept(self, visitor):
         visitor.visit_print_statement_node(self)
 
+    def children(self):
+        return (self.expression,)
+
 
 class ASTFormalParamNode(ASTNode):
+    __slots__ = ("identifier", "type", "size")
+    name = "ASTFormalParamNode"
+    fields = (("identifier", VALUE), ("type", VALUE), ("size", VALUE))
+    visit_name = "visit_formal_param_node"
+
     def __init__(self, identifier, type, size=None):
-        super().__init__()
-        self.name = "ASTFormalParamNode"
         self.identifier = identifier
         self.type = type
         self.size = size  # Optional size for array types, etc.
@@ -278,39 +420,450 @@ class ASTFormalParamNode(ASTNode):
 
 
 class ASTFormalParamsNode(ASTNode):
+    __slots__ = ("params",)
+    name = "ASTFormalParamsNode"
+    fields = (("params", NODES),)
+    visit_name = "visit_formal_params_node"
+
     def __init__(self, params):
-        super().__init__()
-        self.name = "ASTFormalParamsNode"
         self.params = params  # List of ASTFormalParamNode
 
     def accept(self, visitor):
         visitor.visit_formal_params_node(self)
 
+    def children(self):
+        return self.params
+
 
 class ASTFunctionDecNode(ASTNode):
+    __slots__ = ("identifier", "formal_params", "return_type", "block", "frame_size")
+    name = "ASTFunctionDecNode"
+    fields = (("identifier", VALUE), ("formal_params", NODE), ("return_type", VALUE), ("block", NODE))
+    visit_name = "visit_function_dec_node"
+
     def __init__(self, identifier, formal_params, return_type, block):
-        super().__init__()
-        self.name = "ASTFunctionDecNode"
         self.identifier = identifier
         self.formal_params = formal_params
         self.return_type = return_type
         self.block = block
+        self.frame_size = None  # slots in a call's frame, parameters first; set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_function_dec_node(self)
 
+    def children(self):
+        return (self.formal_params, self.block)
+
+
+class ASTErrorNode(ASTStatementNode):
+    __slots__ = ("message",)
+    name = "ASTErrorNode"
+    fields = (("message", VALUE),)
+    visit_name = "visit_error_node"
+
+    def __init__(self, message):
+        self.message = message  # Stands in for a statement that failed to parse
+
+    def accept(self, visitor):
+        visitor.visit_error_node(self)
+
 
 class ASTProgramNode(ASTNode):
+    __slots__ = ("blocks", "frame_size")
+    name = "ASTProgramNode"
+    fields = (("blocks", NODES),)
+    visit_name = "visit_program_node"
+
     def __init__(self, blocks):
-        super().__init__()
-        self.name = "ASTProgramNode"
         self.blocks = blocks
+        self.frame_size = None  # slots in the global frame, set by semantic analysis
 
     def accept(self, visitor):
         visitor.visit_program_node(self)
 
+    def children(self):
+        return self.blocks
+
+
+# Every concrete node class, numbered by its position in this list: its kind
+NODE_CLASSES = [
+    ASTBooleanLiteralNode, ASTIntegerNode, ASTFloatLiteralNode, ASTTypeNode, ASTVariableNode, ASTAssignmentNode,
+    ASTBlockNode, ASTColourLiteralNode, ASTFunctionInvocationNode, ASTIdentifierNode, ASTMultiplicativeOpNode,
+    ASTAdditiveOpNode, ASTRelationalOpNode, ASTActualParamsNode, ASTUnaryNode, ASTSubExpressionNode,
+    ASTFunctionCallNode, ASTVariableDeclarationNode, ASTIfStatementNode, ASTWhileStatementNode,
+    ASTForStatementNode, ASTReturnStatementNode, ASTPrintStatementNode, ASTFormalParamNode, ASTFormalParamsNode,
+    ASTFunctionDecNode, ASTErrorNode, ASTProgramNode,
+]
+for kind, node_class in enumerate(NODE_CLASSES):
+    node_class.kind = kind
+    node_class.shapes = tuple(shape for field, shape in node_class.fields)
+
+
+class ASTStore:
+    # Struct-of-arrays AST: per node, its kind as one byte and where its
+    # operands start in one shared array. A NODE field is one operand, the
+    # child's index (-1 for None); NODES is a count followed by that many
+    # indices; a VALUE is an index into the literal pool, which keeps each
+    # distinct value once. Children are always added before their parent, so
+    # a tree is rebuilt or walked without recursion.
+    # The parser emits into a store through builder methods named and called
+    # like the node classes: store.ASTIntegerNode(3) adds a node and returns
+    # its index.
+    # Save(path) writes the store in a binary file; Load(path) maps such a
+    # file and reads it in place, decoding literals and building node
+    # objects only as they are asked for.
+    __slots__ = ("kinds", "firsts", "operands", "literals", "literal_index", "built")
+
+    def __init__(self):
+        self.kinds = array('B')
+        self.firsts = array('I')
+        self.operands = array('i')
+        self.literals = []
+        self.literal_index = {}
+        self.built = {}  # node objects made by Node(), by index
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def Add(self, node_class, *args):
+        index = len(self.kinds)
+        self.kinds.append(node_class.kind)
+        operands = self.operands
+        self.firsts.append(len(operands))
+        shapes = node_class.shapes
+        if len(args) < len(shapes):
+            args += (None,) * (len(shapes) - len(args))  # constructor defaults are all None
+        for shape, value in zip(shapes, args):
+            if shape is VALUE:
+                # keeps True apart from 1 and 1.0, and -0.0 apart from 0.0
+                key = (float, repr(value)) if value.__class__ is float else (value.__class__, value)
+                literal = self.literal_index.get(key)
+                if literal is None:
+                    literal = self.literal_index[key] = len(self.literals)
+                    self.literals.append(value)
+                operands.append(literal)
+            elif shape is NODE:
+                operands.append(-1 if value is None else value)
+            else:
+                operands.append(len(value) if value else 0)
+                if value:
+                    operands.extend(value)
+        return index
+
+    def AddTree(self, root):
+        # Add a tree of node objects and return the root's index. Nodes are
+        # listed parent before children, then added in reverse, so every
+        # child is in the store before its parent.
+        order = []
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            order.append(node)
+            stack.extend(node.children())
+        indices = {}
+        for node in reversed(order):
+            args = []
+            for field, shape in node.fields:
+                value = getattr(node, field)
+                if shape is NODE:
+                    args.append(None if value is None else indices[id(value)])
+                elif shape is NODES:
+                    args.append([indices[id(child)] for child in value] if value else value)
+                else:
+                    args.append(value)
+            indices[id(node)] = self.Add(node.__class__, *args)
+        return indices[id(root)]
+
+    def NodeClass(self, index):
+        return NODE_CLASSES[self.kinds[index]]
+
+    def Fields(self, index):
+        # The node's field values in constructor order, with child indices
+        # (or None, or lists of indices) in place of child nodes.
+        operands = self.operands
+        position = self.firsts[index]
+        values = []
+        for field, shape in NODE_CLASSES[self.kinds[index]].fields:
+            operand = operands[position]
+            position += 1
+            if shape is NODE:
+                values.append(None if operand < 0 else operand)
+            elif shape is NODES:
+                values.append(operands[position:position + operand].tolist())
+                position += operand
+            else:
+                values.append(self.literals[operand])
+        return values
+
+    def Field(self, index, name):
+        for (field, shape), value in zip(NODE_CLASSES[self.kinds[index]].fields, self.Fields(index)):
+            if field == name:
+                return value
+        raise AttributeError(name)
+
+    def Children(self, index):
+        children = []
+        for (field, shape), value in zip(NODE_CLASSES[self.kinds[index]].fields, self.Fields(index)):
+            if shape is NODE:
+                if value is not None:
+                    children.append(value)
+            elif shape is NODES:
+                children.extend(value)
+        return children
+
+    def Walk(self, root, pre_visit, post_visit=None):
+        # Depth-first walk by index: pre_visit(index) before a node's
+        # children, post_visit(index) after them.
+        stack = [root]
+        while stack:
+            index = stack.pop()
+            if index < 0:
+                post_visit(~index)
+                continue
+            pre_visit(index)
+            if post_visit is not None:
+                stack.append(~index)
+            children = self.Children(index)
+            children.reverse()
+            stack.extend(children)
+
+    def Build(self, index, nodes):
+        # The node object at index, its children looked up in nodes.
+        node_class = NODE_CLASSES[self.kinds[index]]
+        operands = self.operands
+        literals = self.literals
+        position = self.firsts[index]
+        values = []
+        for shape in node_class.shapes:
+            operand = operands[position]
+            position += 1
+            if shape is VALUE:
+                values.append(literals[operand])
+            elif shape is NODE:
+                values.append(None if operand < 0 else nodes[operand])
+            else:
+                values.append([nodes[child] for child in operands[position:position + operand]])
+                position += operand
+        return node_class(*values)
+
+    def Tree(self, root=None):
+        # Rebuild node objects, children first, and return the one at root
+        # (by default the last node added, which the parser leaves as the
+        # program).
+        nodes = []
+        literals = [self.literals[i] for i in range(len(self.literals))]
+        operands = self.operands.tolist()  # faster to index than an array or a mapping
+        firsts = self.firsts.tolist()
+        for index, kind in enumerate(self.kinds[:len(self.kinds) if root is None else root + 1]):
+            node_class = NODE_CLASSES[kind]
+            position = firsts[index]
+            values = []
+            for shape in node_class.shapes:
+                operand = operands[position]
+                position += 1
+                if shape is VALUE:
+                    values.append(literals[operand])
+                elif shape is NODE:
+                    values.append(None if operand < 0 else nodes[operand])
+                else:
+                    values.append([nodes[child] for child in operands[position:position + operand]])
+                    position += operand
+            nodes.append(node_class(*values))
+        return nodes[-1]
+
+    def Node(self, index):
+        # The node object at index with only its own subtree built, children
+        # first. Nodes are kept, so asking again (or for an enclosing node)
+        # reuses them.
+        built = self.built
+        stack = [index]
+        while stack:
+            top = stack[-1]
+            if top in built:
+                stack.pop()
+                continue
+            pending = [child for child in self.Children(top) if child not in built]
+            if pending:
+                stack.extend(pending)
+                continue
+            built[stack.pop()] = self.Build(top, built)
+        return built[index]
+
+    # File layout, all little-endian: the header, then one 4-byte first
+    # operand per node, the operands, literal_count + 1 offsets of each
+    # literal's text in the text blob, one kind byte per node, one type tag
+    # byte per literal, and the UTF-8 text blob itself.
+    HEADER = struct.Struct("<8sIIII")
+    MAGIC = b"PArLAST1"
+    LITERAL_TAGS = {type(None): b"N", bool: b"B", int: b"I", float: b"F", str: b"S"}
+
+    def Save(self, path):
+        tags = bytearray()
+        offsets = array('I', [0])
+        text = bytearray()
+        for value in self.literals:
+            tag = self.LITERAL_TAGS.get(type(value))
+            if tag is None:
+                raise TypeError(f"cannot save a {type(value).__name__} literal")
+            tags += tag
+            if tag != b"N":
+                text += repr(value).encode() if tag != b"S" else value.encode()
+            offsets.append(len(text))
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, len(self.kinds), len(self.operands), len(self.literals), len(text)))
+            for numbers in (array('I', self.firsts), array('i', self.operands), offsets):
+                if sys.byteorder == "big":
+                    numbers.byteswap()
+                file.write(numbers.tobytes())
+            file.write(bytes(self.kinds))
+            file.write(tags)
+            file.write(text)
+
+    @classmethod
+    def Load(cls, path):
+        # A read-only store over a mapping of the file: its arrays are
+        # memoryviews into the file, so nothing is copied or decoded until it
+        # is read. Nodes cannot be added to it.
+        with open(path, "rb") as file:
+            data = memoryview(mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ))
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is not a saved AST")
+        magic, node_count, operand_count, literal_count, text_size = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a saved AST")
+        size = cls.HEADER.size + 4 * (node_count + operand_count + literal_count + 1) + node_count + literal_count + text_size
+        if len(data) != size:
+            raise ValueError(f"{path} is truncated or damaged")
+        position = cls.HEADER.size
+        sections = []
+        for size, code in ((node_count, 'I'), (operand_count, 'i'), (literal_count + 1, 'I'),
+                           (node_count, 'B'), (literal_count, 'B'), (text_size, 'B')):
+            width = 1 if code == 'B' else 4
+            section = data[position:position + size * width]
+            if sys.byteorder == "big" and width == 4:
+                numbers = array(code, bytes(section))
+                numbers.byteswap()
+                section = memoryview(numbers)
+            sections.append(section.cast(code))
+            position += size * width
+        firsts, operands, offsets, kinds, tags, text = sections
+        store = cls.__new__(cls)
+        store.kinds = kinds
+        store.firsts = firsts
+        store.operands = operands
+        store.literals = MappedLiterals(tags, offsets, text)
+        store.literal_index = None
+        store.built = {}
+        return store
+
+
+class MappedLiterals:
+    # The literal pool of a loaded store, each value decoded from the file's
+    # text blob the first time it is read.
+    __slots__ = ("tags", "offsets", "text", "values")
+    UNDECODED = object()
+    DECODERS = {ord("N"): lambda text: None, ord("B"): lambda text: text == "True",
+                ord("I"): int, ord("F"): float, ord("S"): str}
+
+    def __init__(self, tags, offsets, text):
+        self.tags = tags
+        self.offsets = offsets
+        self.text = text
+        self.values = [self.UNDECODED] * len(tags)
+
+    def __len__(self):
+        return len(self.tags)
+
+    def __getitem__(self, index):
+        value = self.values[index]
+        if value is self.UNDECODED:
+            text = str(self.text[self.offsets[index]:self.offsets[index + 1]], "utf-8")
+            value = self.values[index] = self.DECODERS[self.tags[index]](text)
+        return value
+
+
+for node_class in NODE_CLASSES:
+    setattr(ASTStore, node_class.__name__, partialmethod(ASTStore.Add, node_class))
+
+
+class ASTWalker:
+    # Depth-first traversal driven by an explicit work stack instead of
+    # nested accept() calls, so the depth of a tree is limited by memory, not
+    # by the interpreter's recursion limit. walk(root) calls pre_visit on a
+    # node, then runs everything pre_visit scheduled, then post_visit. The
+    # default pre_visit schedules node.children(); a visitor written with
+    # visit_* methods can instead dispatch through node.accept(self) and
+    # schedule from there with Visit(child) and Then(func, *args), which run
+    # in order once the visit_* method has returned.
+    steps = None  # work scheduled by the node being visited, None outside walk
+
+    def pre_visit(self, node):
+        for child in node.children():
+            self.Visit(child)
+
+    def post_visit(self, node):
+        pass
+
+    def Visit(self, node):
+        if self.steps is None:
+            self.walk(node)
+        else:
+            self.steps.append(node)
+
+    def Then(self, func, *args):
+        if self.steps is None:
+            func(*args)
+        else:
+            self.steps.append((func, args))
+
+    def walk(self, root):
+        post_visit = self.post_visit if type(self).post_visit is not ASTWalker.post_visit else None
+        stack = [root]
+        try:
+            while stack:
+                item = stack.pop()
+                self.steps = steps = []
+                if type(item) is tuple:
+                    item[0](*item[1])
+                else:
+                    self.pre_visit(item)
+                    if post_visit is not None:
+                        steps.append((post_visit, (item,)))
+                if steps:
+                    steps.reverse()
+                    stack.extend(steps)
+        finally:
+            self.steps = None
+
 
 class ASTVisitor:
+    # Handlers are compiled once per visitor into a list indexed by node kind:
+    # the visitor's own visit_* method for that node class or, where it has
+    # none, generic_visit, which goes on to the node's children. visit(node)
+    # then costs one list index and call per node instead of accept() and a
+    # method lookup by name, and a visitor only overrides what it needs.
+    # Handlers recurse like accept() does; for trees deeper than the
+    # recursion limit, dispatch from an ASTWalker's pre_visit instead.
+    def __init__(self):
+        self.handlers = self.CompileHandlers()
+
+    def CompileHandlers(self):
+        handlers = []
+        for node_class in NODE_CLASSES:
+            own = getattr(type(self), node_class.visit_name, None)
+            if own is None or own is getattr(ASTVisitor, node_class.visit_name, None):
+                handlers.append(self.generic_visit)
+            else:
+                handlers.append(getattr(self, node_class.visit_name))
+        return handlers
+
+    def visit(self, node):
+        self.handlers[node.kind](node)
+
+    def generic_visit(self, node):
+        handlers = self.handlers
+        for child in node.children():
+            handlers[child.kind](child)
 
     def visit_boolean_literal_node(self, node):
         raise NotImplementedError()
@@ -372,6 +925,9 @@ class ASTVisitor:
     def visit_while_statement_node(self, node):
         raise NotImplementedError()
 
+    def visit_for_statement_node(self, node):
+        raise NotImplementedError()
+
     def visit_return_statement_node(self, node):
         raise NotImplementedError()
 
@@ -390,6 +946,9 @@ class ASTVisitor:
     def visit_program_node(self, node):
         raise NotImplementedError()
 
+    def visit_error_node(self, node):
+        raise NotImplementedError()
+
     def inc_tab_count(self):
         raise NotImplementedError()
 
@@ -397,227 +956,292 @@ class ASTVisitor:
         raise NotImplementedError()
 
 
-class PrintNodesVisitor(ASTVisitor):
-    def __init__(self):
+class PrintNodesVisitor(ASTVisitor, ASTWalker):
+    # Writes to `stream` (sys.stdout when None) in the format print() would
+    # produce. Lines collect in a buffer that is written out every
+    # `buffer_lines` lines and when a walk ends, so a large tree streams out
+    # in chunks rather than one write per node.
+    def __init__(self, stream=None, buffer_lines=4096):
+        super().__init__()
         self.name = "Print Tree Visitor"
         self.node_count = 0
         self.tab_count = 0
+        self.stream = stream
+        self.buffer = []
+        self.buffer_lines = buffer_lines
+        self.indents = [""]  # indentation string per depth, built once
+        self.indent = ""
+
+    # Children are visited through the ASTWalker work stack, and each line is
+    # printed when its step runs, so trees of any depth print without
+    # recursion and in the same order as nested accept() calls would.
+    def pre_visit(self, node):
+        self.handlers[node.kind](node)
+
+    def walk(self, root):
+        try:
+            super().walk(root)
+        finally:
+            self.Flush()
+
+    def Then(self, func, *args):
+        # A line or tab change scheduled ahead of every other step would run
+        # before anything else is printed, so it can run right away.
+        if self.steps:
+            self.steps.append((func, args))
+        else:
+            func(*args)
+
+    def Line(self, *text):
+        if self.steps:
+            self.steps.append((self.PrintLine, text))
+        else:
+            self.PrintLine(*text)
+
+    def PrintLine(self, *text):
+        buffer = self.buffer
+        buffer.append(" ".join([self.indent, *map(str, text)]))
+        if self.steps is None or len(buffer) >= self.buffer_lines:
+            self.Flush()
+
+    def Flush(self):
+        if self.buffer:
+            self.buffer.append("")
+            (self.stream or sys.stdout).write("\n".join(self.buffer))
+            self.buffer.clear()
 
     def visit_boolean_literal_node(self, bool_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Boolean Literal::", bool_node.value)
+        self.Line("Boolean Literal::", bool_node.value)
 
     def visit_float_literal_node(self, float_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Float Literal::", float_node.value)
+        self.Line("Float Literal::", float_node.value)
 
     def visit_type_node(self, type_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Type::", type_node.type_name)
+        self.Line("Type::", type_node.type_name)
 
     def inc_tab_count(self):
         self.tab_count += 1
+        if self.tab_count == len(self.indents):
+            self.indents.append("\t" * self.tab_count)
+        self.indent = self.indents[self.tab_count]
 
     def dec_tab_count(self):
         self.tab_count -= 1
+        self.indent = self.indents[self.tab_count]
 
     def visit_integer_node(self, int_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Integer value::", int_node.value)
+        self.Line("Integer value::", int_node.value)
 
     def visit_assignment_node(self, ass_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Assignment node => ")
-        self.inc_tab_count()
-        ass_node.id.accept(self)
-        ass_node.expr.accept(self)
-        self.dec_tab_count()
+        self.Line("Assignment node => ")
+        self.Then(self.inc_tab_count)
+        self.Visit(ass_node.id)
+        self.Visit(ass_node.expr)
+        self.Then(self.dec_tab_count)
 
     def visit_variable_node(self, var_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Variable => ", var_node.lexeme)
+        self.Line("Variable => ", var_node.lexeme)
 
     def visit_block_node(self, block_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Block Start:")
-        self.inc_tab_count()
+        self.Line("Block Start:")
+        self.Then(self.inc_tab_count)
         for stmt in block_node.statements:
-            stmt.accept(self)
-        self.dec_tab_count()
-        print('\t' * self.tab_count, "Block End")
+            self.Visit(stmt)
+        self.Then(self.dec_tab_count)
+        self.Line("Block End")
 
 
     def visit_colour_literal_node(self, colour_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Colour Literal::", colour_node.value)
+        self.Line("Colour Literal::", colour_node.value)
 
     def visit_function_invocation_node(self, function_node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Function Invocation::{function_node.function_name} with args:")
-        self.inc_tab_count()
+        self.Line(f"Function Invocation::{function_node.function_name} with args:")
+        self.Then(self.inc_tab_count)
         for arg in function_node.arguments:
-            arg.accept(self)
-        self.dec_tab_count()
+            self.Visit(arg)
+        self.Then(self.dec_tab_count)
 
     def visit_identifier_node(self, identifier_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Identifier::", identifier_node.identifier)
+        self.Line("Identifier::", identifier_node.identifier)
 
     def visit_multiplicative_op_node(self, op_node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Multiplicative Operation ({op_node.operator}) between:")
-        self.inc_tab_count()
-        op_node.left.accept(self)
-        op_node.right.accept(self)
-        self.dec_tab_count()
+        self.Line(f"Multiplicative Operation ({op_node.operator}) between:")
+        self.Then(self.inc_tab_count)
+        self.Visit(op_node.left)
+        self.Visit(op_node.right)
+        self.Then(self.dec_tab_count)
 
     def visit_additive_op_node(self, op_node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Additive Operation ({op_node.operator}) between:")
-        self.inc_tab_count()
-        op_node.left.accept(self)
-        op_node.right.accept(self)
-        self.dec_tab_count()
+        self.Line(f"Additive Operation ({op_node.operator}) between:")
+        self.Then(self.inc_tab_count)
+        self.Visit(op_node.left)
+        self.Visit(op_node.right)
+        self.Then(self.dec_tab_count)
 
     def visit_relational_op_node(self, op_node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Relational Operation ({op_node.operator}) between:")
-        self.inc_tab_count()
-        op_node.left.accept(self)
-        op_node.right.accept(self)
-        self.dec_tab_count()
+        self.Line(f"Relational Operation ({op_node.operator}) between:")
+        self.Then(self.inc_tab_count)
+        self.Visit(op_node.left)
+        self.Visit(op_node.right)
+        self.Then(self.dec_tab_count)
 
     def visit_actual_params_node(self, params_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Actual Parameters:")
-        self.inc_tab_count()
+        self.Line("Actual Parameters:")
+        self.Then(self.inc_tab_count)
         for param in params_node.parameters:
-            param.accept(self)
-        self.dec_tab_count()
+            self.Visit(param)
+        self.Then(self.dec_tab_count)
 
     def visit_unary_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Unary Operation: {node.operator} {node.operand.name}")
+        self.Line(f"Unary Operation: {node.operator} {node.operand.name}")
 
     def visit_sub_expression_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "SubExpression:")
-        self.inc_tab_count()
-        node.expression.accept(self)
-        self.dec_tab_count()
+        self.Line("SubExpression:")
+        self.Then(self.inc_tab_count)
+        self.Visit(node.expression)
+        self.Then(self.dec_tab_count)
 
     def visit_function_call_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Function Call: {node.identifier} with params:")
-        self.inc_tab_count()
+        self.Line(f"Function Call: {node.identifier} with params:")
+        self.Then(self.inc_tab_count)
         for param in node.actual_params:
-            param.accept(self)
-        self.dec_tab_count()
+            self.Visit(param)
+        self.Then(self.dec_tab_count)
 
     def visit_variable_declaration_node(self, node):
         self.node_count += 1
+        if isinstance(node.suffix, ASTNode):
+            self.Line(f"Variable Declaration: {node.identifier} as {node.type} =")
+            self.Then(self.inc_tab_count)
+            self.Visit(node.suffix)
+            self.Then(self.dec_tab_count)
+            return
         suffix = f" {node.suffix}" if node.suffix else ""
-        print('\t' * self.tab_count, f"Variable Declaration: {node.identifier} as {node.type}{suffix}")
+        self.Line(f"Variable Declaration: {node.identifier} as {node.type}{suffix}")
 
     def visit_if_statement_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "If Statement:")
-        self.inc_tab_count()
-        print('\t' * self.tab_count, "Condition:")
-        node.condition.accept(self)
-        print('\t' * self.tab_count, "True Block:")
-        node.true_block.accept(self)
+        self.Line("If Statement:")
+        self.Then(self.inc_tab_count)
+        self.Line("Condition:")
+        self.Visit(node.condition)
+        self.Line("True Block:")
+        self.Visit(node.true_block)
         if node.false_block:
-            print('\t' * self.tab_count, "Else Block:")
-            node.false_block.accept(self)
-        self.dec_tab_count()
+            self.Line("Else Block:")
+            self.Visit(node.false_block)
+        self.Then(self.dec_tab_count)
 
     def visit_while_statement_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "While Loop:")
-        self.inc_tab_count()
-        print('\t' * self.tab_count, "Condition:")
-        node.condition.accept(self)
-        print('\t' * self.tab_count, "Loop Block:")
-        node.block.accept(self)
-        self.dec_tab_count()
+        self.Line("While Loop:")
+        self.Then(self.inc_tab_count)
+        self.Line("Condition:")
+        self.Visit(node.condition)
+        self.Line("Loop Block:")
+        self.Visit(node.block)
+        self.Then(self.dec_tab_count)
 
     def visit_for_statement_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "For Loop:")
-        self.inc_tab_count()
-        print('\t' * self.tab_count, "Initialization:")
-        node.initialization.accept(self)
-        print('\t' * self.tab_count, "Condition:")
-        node.condition.accept(self)
-        print('\t' * self.tab_count, "Increment:")
-        node.increment.accept(self)
-        print('\t' * self.tab_count, "Loop Block:")
-        node.block.accept(self)
-        self.dec_tab_count()
+        self.Line("For Loop:")
+        self.Then(self.inc_tab_count)
+        if node.initialization:
+            self.Line("Initialization:")
+            self.Visit(node.initialization)
+        self.Line("Condition:")
+        self.Visit(node.condition)
+        if node.increment:
+            self.Line("Increment:")
+            self.Visit(node.increment)
+        self.Line("Loop Block:")
+        self.Visit(node.block)
+        self.Then(self.dec_tab_count)
 
     def visit_return_statement_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Return Statement:")
-        self.inc_tab_count()
-        node.expression.accept(self)
-        self.dec_tab_count()
+        self.Line("Return Statement:")
+        self.Then(self.inc_tab_count)
+        self.Visit(node.expression)
+        self.Then(self.dec_tab_count)
 
     def visit_print_statement_node(self, node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Print Statement:")
-        self.inc_tab_count()
-        node.expression.accept(self)
-        self.dec_tab_count()
+        self.Line("Print Statement:")
+        self.Then(self.inc_tab_count)
+        self.Visit(node.expression)
+        self.Then(self.dec_tab_count)
 
     def visit_formal_param_node(self, param_node):
         self.node_count += 1
         size_display = f" of size {param_node.size}" if param_node.size else ""
-        print('\t' * self.tab_count, f"Formal Param:: {param_node.identifier} of type {param_node.type}{size_display}")
+        self.Line(f"Formal Param:: {param_node.identifier} of type {param_node.type}{size_display}")
 
     def visit_formal_params_node(self, params_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Formal Parameters:")
-        self.inc_tab_count()
+        self.Line("Formal Parameters:")
+        self.Then(self.inc_tab_count)
         for param in params_node.params:
-            param.accept(self)
-        self.dec_tab_count()
+            self.Visit(param)
+        self.Then(self.dec_tab_count)
 
     def visit_function_dec_node(self, function_node):
         self.node_count += 1
-        print('\t' * self.tab_count, f"Function Declaration:: {function_node.identifier}")
-        self.inc_tab_count()
-        function_node.formal_params.accept(self)
-        print('\t' * self.tab_count, f"Returns:: {function_node.return_type}")
-        function_node.block.accept(self)
-        self.dec_tab_count()
+        self.Line(f"Function Declaration:: {function_node.identifier}")
+        self.Then(self.inc_tab_count)
+        self.Visit(function_node.formal_params)
+        self.Line(f"Returns:: {function_node.return_type}")
+        self.Visit(function_node.block)
+        self.Then(self.dec_tab_count)
 
     def visit_program_node(self, program_node):
         self.node_count += 1
-        print('\t' * self.tab_count, "Program Start:")
-        self.inc_tab_count()
+        self.Line("Program Start:")
+        self.Then(self.inc_tab_count)
         for block in program_node.blocks:
-            block.accept(self)
-        self.dec_tab_count()
-        print('\t' * self.tab_count, "Program End")
-
-
-
-# Create a print visitor instance
-print_visitor = PrintNodesVisitor()
-
-# assume root node the AST assignment node ....
-# x=23
-print("Building AST for assigment statement x=23;")
-assignment_lhs = ASTVariableNode("x")
-assignment_rhs = ASTIntegerNode(23)
-root = ASTAssignmentNode(assignment_lhs, assignment_rhs)
-root.accept(print_visitor)
-print("Node Count => ", print_visitor.node_count)
-print("----")
-# assume root node the AST variable node ....
-# x123
-print("Building AST for variable x123;")
-root = ASTVariableNode("x123")
-root.accept(print_visitor)
-print("Node Count => ", print_visitor.node_count)
+            self.Visit(block)
+        self.Then(self.dec_tab_count)
+        self.Line("Program End")
+
+    def visit_error_node(self, error_node):
+        self.node_count += 1
+        self.Line("Error::", error_node.message)
+
+
+
+if __name__ == "__main__":
+    # Create a print visitor instance
+    print_visitor = PrintNodesVisitor()
+
+    # assume root node the AST assignment node ....
+    # x=23
+    print("Building AST for assigment statement x=23;")
+    assignment_lhs = ASTVariableNode("x")
+    assignment_rhs = ASTIntegerNode(23)
+    root = ASTAssignmentNode(assignment_lhs, assignment_rhs)
+    root.accept(print_visitor)
+    print("Node Count => ", print_visitor.node_count)
+    print("----")
+    # assume root node the AST variable node ....
+    # x123
+    print("Building AST for variable x123;")
+    root = ASTVariableNode("x123")
+    root.accept(print_visitor)
+    print("Node Count => ", print_visitor.node_count)
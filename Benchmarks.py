@@ -0,0 +1,1688 @@
+import io
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import zlib
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import ASTNodes as ast
+import BytecodeTask4 as bytecode
+import CompileCache
+import Framebuffer as framebuffer
+import ConstantFolding as folding
+import LexerTask1 as lex
+import ParserTask2 as parser
+import SemanticTask3 as semantic
+import Transpiler as transpiler
+
+# Usage: python Benchmarks.py [name ...]   (no names runs every benchmark)
+
+
+def SyntheticProgram(statements):
+    # A statement-dense program using every token class the lexer knows about.
+    lines = []
+    for i in range(statements):
+        lines.append(f"let x : int = {i} ;")
+        lines.append(f"    if x >= {i % 7} {{ __print x * 3 + 7 ; }} else {{ y = x - 1.5 / 2 ; }}")
+        lines.append(f"    while ( x != 0 ) {{ x = x - 1 ; __delay 10 ; }} // loop{i}")
+    return "\n".join(lines) + "\n"
+
+
+def TimeIt(func, *args, repeat=3):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def BenchLexer(statements=5000):
+    src = SyntheticProgram(statements)
+    print(f"lexer: {len(src)} characters")
+
+    reference = None
+    for backend in ["table", "compiled", "regex"]:
+        lexer = lex.Lexer(backend)
+        elapsed, tokens = TimeIt(lexer.GenerateTokens, src)
+        stream = [(t.type, t.lexeme) for t in tokens]
+        if reference is None:
+            reference = stream
+        elif stream != reference:
+            raise AssertionError(f"backend '{backend}' disagrees with 'table'")
+        print(f"  {backend:<10} {elapsed:8.3f}s  {len(src) / elapsed:14,.0f} chars/s  ({len(tokens)} tokens)")
+
+
+def CheckLexerBackends(programs=2000, seed=2000):
+    # Differential check: every backend must produce the same
+    # (type, lexeme, start) stream as the table-driven DFA, including where a
+    # lexical error stops the scan (or, with recover, the same diagnostics),
+    # with and without skip_trivia. Programs are slices of the synthetic
+    # program with random characters (stray symbols, non-ASCII
+    # letters/digits/spaces) spliced in.
+    rng = random.Random(seed)
+    base = SyntheticProgram(200)
+    noise = "_!#&.$@\t\r\x0b\xa0\u2003\xb2\u0663\xe9\u03bb\u4e2d"
+    trivia = (lex.TokenType.whitespace, lex.TokenType.comment)
+    reference_lexers = {recover: lex.Lexer("table", recover=recover) for recover in [False, True]}
+    lexers = [lex.Lexer(backend, skip_trivia, recover=recover)
+              for recover in [False, True] for skip_trivia in [False, True] for backend in ["table", "compiled", "regex"]]
+    checked = 0
+
+    def Diagnostics(diagnostics):
+        return [(d.offset, d.text, d.message) for d in diagnostics]
+
+    for _ in range(programs):
+        start = rng.randrange(len(base))
+        src = list(base[start:start + rng.randrange(1, 400)])
+        for _ in range(rng.randrange(4)):
+            src.insert(rng.randrange(len(src) + 1), rng.choice(noise))
+        src = "".join(src)
+
+        references = {}
+        for recover, reference_lexer in reference_lexers.items():
+            references[recover] = ([(t.type, t.lexeme, t.start) for t in reference_lexer.GenerateTokens(src)],
+                                   Diagnostics(reference_lexer.diagnostics))
+        for lexer in lexers:
+            reference, expected_diagnostics = references[lexer.recover]
+            expected = [pair for pair in reference if pair[0] not in trivia] if lexer.skip_trivia else reference
+            actual = [(t.type, t.lexeme, t.start) for t in lexer.GenerateTokens(src)]
+            if actual != expected or Diagnostics(lexer.diagnostics) != expected_diagnostics:
+                raise AssertionError(f"backend '{lexer.backend}' disagrees with 'table' on {src!r}")
+            if lexer.backend != "compiled":
+                continue
+            buffered = lexer.GenerateTokenBuffer(src)
+            if [(t.type, t.lexeme, t.start) for t in buffered] != expected or Diagnostics(buffered.diagnostics) != expected_diagnostics:
+                raise AssertionError(f"GenerateTokenBuffer disagrees with 'table' on {src!r}")
+            # Small chunks force tokens to straddle chunk boundaries.
+            streamed = lexer.iter_tokens(io.StringIO(src), chunk_size=rng.randrange(1, 17))
+            if [(t.type, t.lexeme, t.start) for t in streamed] != expected or Diagnostics(lexer.diagnostics) != expected_diagnostics:
+                raise AssertionError(f"iter_tokens disagrees with 'table' on {src!r}")
+        checked += len(references[False][0])
+
+        source_map = lex.SourceMap(src)
+        for token_type, lexeme, offset in references[True][0]:
+            line = src.count("\n", 0, offset) + 1
+            column = offset - (src.rfind("\n", 0, offset) + 1) + 1
+            if source_map.LineColumn(offset) != (line, column):
+                raise AssertionError(f"SourceMap puts offset {offset} of {src!r} at {source_map.LineColumn(offset)}")
+
+    print(f"lexer backends and iter_tokens agree on {programs} programs ({checked} tokens)")
+
+
+def CheckRelex(programs=2000, seed=8):
+    # RelexTokenBuffer after a chain of random edits must match lexing the
+    # edited source from scratch, trivia side table included.
+    rng = random.Random(seed)
+    base = SyntheticProgram(100)
+    noise = "_!#&.$@ \n=<>/-1af"
+    lexers = [lex.Lexer(), lex.Lexer(skip_trivia=True), lex.Lexer(skip_trivia=True, record_trivia=True),
+              lex.Lexer(skip_trivia=True, record_trivia=True, recover=True)]
+    fields = ["kinds", "starts", "ends", "trivia_starts", "trivia_ends"]
+
+    for _ in range(programs):
+        start = rng.randrange(len(base))
+        original = base[start:start + rng.randrange(1, 300)]
+        for lexer in lexers:
+            src = original
+            tokens = lexer.GenerateTokenBuffer(src)
+            for _ in range(3):
+                edit_idx = rng.randrange(len(src) + 1)
+                deleted = rng.randrange(min(5, len(src) - edit_idx) + 1)
+                inserted = "".join(rng.choice(noise) for _ in range(rng.randrange(5)))
+                tokens = lexer.RelexTokenBuffer(tokens, edit_idx, deleted, inserted)
+                src = src[:edit_idx] + inserted + src[edit_idx + deleted:]
+                expected = lexer.GenerateTokenBuffer(src)
+                for field in fields:
+                    if getattr(tokens, field) != getattr(expected, field):
+                        raise AssertionError(f"RelexTokenBuffer {field} differs after editing {src!r} at {edit_idx}")
+                if [(d.offset, d.text) for d in tokens.diagnostics] != [(d.offset, d.text) for d in expected.diagnostics]:
+                    raise AssertionError(f"RelexTokenBuffer diagnostics differ after editing {src!r} at {edit_idx}")
+
+    print(f"incremental relexing matches full relexing on {programs} programs")
+
+
+def BenchRelex(statements=33334):
+    src = SyntheticProgram(statements)
+    lexer = lex.Lexer(skip_trivia=True)
+    elapsed, tokens = TimeIt(lexer.GenerateTokenBuffer, src, repeat=1)
+    print(f"relex: {src.count(chr(10))} lines, {len(tokens)} tokens")
+    print(f"  full GenerateTokenBuffer       {elapsed * 1000:10.2f} ms")
+
+    middle = src.index("__print", len(src) // 2)
+    for name, edit in [("same-length edit", (middle, 7, "__delay")), ("insertion", (middle, 0, "x = 1 ; "))]:
+        elapsed, _ = TimeIt(lexer.RelexTokenBuffer, tokens, *edit, repeat=5)
+        print(f"  RelexTokenBuffer {name:<14}{elapsed * 1000:10.2f} ms")
+
+
+def CheckParallelLexer(programs=40, seed=9):
+    # The stitched output of GenerateTokenBufferParallel must be identical to
+    # the sequential scan, including programs that stop on a lexical error.
+    rng = random.Random(seed)
+    base = SyntheticProgram(400)
+    lexers = [lex.Lexer(), lex.Lexer(skip_trivia=True, record_trivia=True), lex.Lexer(skip_trivia=True, recover=True)]
+    fields = ["kinds", "starts", "ends", "trivia_starts", "trivia_ends"]
+
+    for i in range(programs):
+        src = base[rng.randrange(len(base) // 2):]
+        if i % 2:
+            error_idx = rng.randrange(len(src))
+            src = src[:error_idx] + rng.choice(["#", "__ ", "! ", "\n__\n"]) + src[error_idx:]
+        for lexer in lexers:
+            expected = lexer.GenerateTokenBuffer(src)
+            actual = lexer.GenerateTokenBufferParallel(src, workers=rng.choice([2, 3, 4]))
+            for field in fields:
+                if getattr(actual, field) != getattr(expected, field):
+                    raise AssertionError(f"parallel {field} differs from the sequential scan")
+            if [(d.offset, d.text) for d in actual.diagnostics] != [(d.offset, d.text) for d in expected.diagnostics]:
+                raise AssertionError("parallel diagnostics differ from the sequential scan")
+
+    print(f"parallel lexing matches sequential lexing on {programs} programs")
+
+
+def BenchParallelLexer(statements=40000):
+    src = SyntheticProgram(statements)
+    lexer = lex.Lexer(skip_trivia=True)
+    elapsed, tokens = TimeIt(lexer.GenerateTokenBuffer, src, repeat=1)
+    print(f"parallel lexer: {len(src)} characters, {len(tokens)} tokens")
+    print(f"  sequential  {elapsed:8.3f}s  {len(src) / elapsed:14,.0f} chars/s")
+    for workers in [1, 2, 4, 8]:
+        elapsed, _ = TimeIt(lexer.GenerateTokenBufferParallel, src, workers, repeat=1)
+        print(f"  {workers} workers   {elapsed:8.3f}s  {len(src) / elapsed:14,.0f} chars/s")
+
+
+def IdentifierProgram(words, seed=6):
+    # Mostly identifiers, with a keyword or builtin every few words.
+    rng = random.Random(seed)
+    keywords = ["int", "float", "bool", "colour", "if", "else", "while", "for", "return", "let", "as", "true", "false"]
+    builtins = ["__print", "__delay", "__write_box", "__width", "__random_int"]
+    letters = "abcdefghijklmnopqrstuvwxyz"
+    pool = ["".join(rng.choice(letters) for _ in range(rng.randint(1, 10))) for _ in range(500)]
+    out = []
+    for i in range(words):
+        roll = rng.random()
+        if roll < 0.15:
+            out.append(rng.choice(keywords))
+        elif roll < 0.2:
+            out.append(rng.choice(builtins))
+        else:
+            out.append(rng.choice(pool))
+    return " ".join(out)
+
+
+def BenchKeywords(words=300000):
+    src = IdentifierProgram(words)
+    lexer = lex.Lexer(skip_trivia=True)
+    tokens = lexer.GenerateTokens(src)
+    final_states = [(4 if not t.lexeme.startswith("__") else 7, t.lexeme) for t in tokens]
+    print(f"keywords: {len(tokens)} identifier/keyword tokens")
+
+    def Classify():
+        for state, lexeme in final_states:
+            lexer.GetTokenTypeByFinalState(state, lexeme)
+
+    elapsed, _ = TimeIt(Classify)
+    print(f"  GetTokenTypeByFinalState {elapsed:8.3f}s  {len(final_states) / elapsed:14,.0f} lexemes/s")
+    elapsed, _ = TimeIt(lexer.GenerateTokens, src)
+    print(f"  GenerateTokens           {elapsed:8.3f}s  {len(src) / elapsed:14,.0f} chars/s")
+
+
+def ExpressionProgram(operands, seed=11):
+    # One long expression mixing every binary operator precedence level.
+    rng = random.Random(seed)
+    operators = ["+", "-", "*", "/", "and", "or", "<", "=="]
+    parts = ["x"]
+    for i in range(1, operands):
+        parts.append(rng.choice(operators))
+        parts.append(rng.choice(["x", "y", str(i), "( z * 2 )", "f ( x , 1 )"]))
+    return " ".join(parts)
+
+
+def BenchExpressions(operands=100000):
+    src = ExpressionProgram(operands)
+    elapsed, tokens = TimeIt(lex.Lexer(skip_trivia=True).GenerateTokenBuffer, src, repeat=1)
+    print(f"expressions: {operands} operands, {len(tokens)} tokens (lexing {elapsed:.3f}s)")
+
+    def Parse():
+        return parser.Parser(tokens).ParseExpression()
+
+    elapsed, _ = TimeIt(Parse)
+    print(f"  ParseExpression  {elapsed:8.3f}s  {len(tokens) / elapsed:14,.0f} tokens/s")
+
+
+def LanguageProgram(functions, seed=14):
+    # A well-typed program using the whole language: function declarations
+    # with parameters, let, assignment, for, while, if/else, return, the
+    # builtin statements and every kind of expression.
+    rng = random.Random(seed)
+    lines = []
+    for i in range(functions):
+        lines.append(f"fun f{i}(a : int, b : float, c : colour) -> int {{")
+        lines.append(f"    let total : int = a * {rng.randint(1, 9)} - f{max(i - 1, 0)}(a - 1, b / 2.0, c);")
+        lines.append(f"    for (let i : int = 0; i < {rng.randint(2, 64)}; i = i + 1) {{")
+        lines.append(f"        if ((i == a) or not (b >= 1.5)) {{ total = total + i; }} else {{ __print total; }}")
+        lines.append("        __write_box i, total, 1, 1, #ff8800;")
+        lines.append("    }")
+        lines.append(f"    while ((total > __width) and (total != {i})) {{ total = total / 2; __delay 1; }}")
+        lines.append(f"    __write __random_int 10, total, __read total, 0;")
+        lines.append("    return total;")
+        lines.append("}")
+    lines.append(f"let result : int = f{functions - 1}(3, 1.0, #000000);")
+    lines.append("__print result;")
+    return "\n".join(lines) + "\n"
+
+
+def BenchParser(functions=5000):
+    src = LanguageProgram(functions)
+    tokens = lex.Lexer(skip_trivia=True).GenerateTokenBuffer(src)
+    elapsed, root = TimeIt(lambda: parser.Parser(tokens).Parse())
+    walker = DepthWalker()
+    walker.walk(root)
+    print(f"parser: {functions} functions, {len(tokens)} tokens, {walker.node_count} nodes")
+    print(f"  Parse  {elapsed:8.3f}s  {len(tokens) / elapsed:14,.0f} tokens/s")
+
+
+def CheckRecovery(functions=2000, seed=15):
+    # Break one statement in every other function of a LanguageProgram.
+    # Parsing with recover must report an error inside each broken function
+    # and none elsewhere, keep the other functions intact, and report first
+    # the error a parser without recover raises.
+    rng = random.Random(seed)
+    lines = LanguageProgram(functions).splitlines(keepends=True)
+    breakages = [(" ;", ";"), ("= ", "== "), ("(", ""), (")", "}"), ("int", "#zz"), (",", " ")]
+    broken = set()
+    for function in range(0, functions, 2):
+        first = function * 10  # every function is ten lines long
+        line = rng.choice([line for line in range(first + 1, first + 9) if ";" in lines[line]])
+        old, new = rng.choice([pair for pair in breakages if pair[0] in lines[line]] + [(";", "")])
+        lines[line] = lines[line].replace(old, new, 1)
+        broken.add(function)
+    src = "".join(lines)
+
+    strict = parser.Parser(src)
+    try:
+        strict.Parse()
+        raise AssertionError("a broken program parsed without errors")
+    except SyntaxError as error:
+        first_error = error.diagnostic
+
+    elapsed, p = TimeIt(lambda: parser.Parser(src, recover=True), repeat=1)
+    elapsed, root = TimeIt(p.Parse, repeat=1)
+    if (first_error.offset, first_error.message) != (p.diagnostics[0].offset, p.diagnostics[0].message):
+        raise AssertionError("the first diagnostic differs from the error a strict parse raises")
+    reported = {(p.source_map.LineColumn(d.offset)[0] - 1) // 10 for d in p.diagnostics}
+    if reported != broken:
+        raise AssertionError("diagnostics do not match the broken functions")
+    clean = [statement for statement in root.blocks if isinstance(statement, ast.ASTFunctionDecNode)
+             and int(statement.identifier[1:]) % 2]
+    if len(clean) != functions // 2:
+        raise AssertionError("recovery lost a function that had no error")
+    print(f"recovery: {len(broken)} broken functions, {len(p.diagnostics)} diagnostics in one pass ({elapsed:.3f}s)")
+
+    # Malformed literals are syntax errors like any other, never a crash.
+    p = parser.Parser("fun f(a : int [ y ]) -> int { return 1; }\nlet x : int = ²;\nlet z : int = 1٣;\n__print 1;\n", recover=True)
+    root = p.Parse()
+    lines = sorted({p.source_map.LineColumn(d.offset)[0] for d in p.diagnostics})
+    if lines != [1, 2, 3] or not isinstance(root.blocks[-1], ast.ASTPrintStatementNode):
+        raise AssertionError(f"malformed literals: {[d.message for d in p.diagnostics]}")
+
+    src = LanguageProgram(functions)
+    strict_elapsed, _ = TimeIt(lambda: parser.Parser(src).Parse())
+    elapsed, _ = TimeIt(lambda: parser.Parser(src, recover=True).Parse())
+    print(f"  error-free program: strict {strict_elapsed:.3f}s, recover {elapsed:.3f}s")
+
+
+def NestedProgram(depth):
+    # if/while statements nested `depth` levels deep, with an else block and a
+    # statement at every level.
+    lines = []
+    for i in range(depth):
+        lines.append(f"if ( x < {i} ) {{" if i % 2 else "while ( y ) {")
+    lines.append("{ }")
+    for i in reversed(range(depth)):
+        lines.append("} else { }" if i % 2 else "}")
+    return "\n".join(lines) + "\n"
+
+
+class DepthWalker(ast.ASTWalker):
+    # Counts nodes and the deepest nesting reached, with the pre/post hooks.
+    def __init__(self):
+        self.node_count = 0
+        self.depth = 0
+        self.max_depth = 0
+
+    def pre_visit(self, node):
+        self.node_count += 1
+        self.depth += 1
+        self.max_depth = max(self.max_depth, self.depth)
+        super().pre_visit(node)
+
+    def post_visit(self, node):
+        self.depth -= 1
+
+
+def CheckNesting(depth=50000):
+    # Programs nested far past the recursion limit must parse, walk and print.
+    # Each level is a statement node holding a block node, plus the else
+    # blocks and the innermost empty block.
+    src = NestedProgram(depth)
+    elapsed, root = TimeIt(lambda: parser.Parser(src).Parse(), repeat=1)
+    walker = DepthWalker()
+    walk_elapsed, _ = TimeIt(walker.walk, root, repeat=1)
+    if walker.max_depth != 2 * depth + 2 or walker.depth != 0:
+        raise AssertionError(f"walked to depth {walker.max_depth} of a program nested {depth} levels")
+    print(f"nesting: {depth} levels, {walker.node_count} nodes, parse {elapsed:.3f}s, walk {walk_elapsed:.3f}s")
+
+    # A 100k operand expression is a left-leaning chain as deep as it is long.
+    expression = parser.Parser(ExpressionProgram(100000)).ParseExpression()
+    walker = DepthWalker()
+    walker.walk(expression)
+    print(f"  expression chain walked to depth {walker.max_depth}")
+
+    # The printer indents every line by its depth, so print a smaller program
+    # (still past the recursion limit) and check its shape.
+    printer_depth = 2 * sys.getrecursionlimit()
+    printer = ast.PrintNodesVisitor()
+    out = io.StringIO()
+    stdout, sys.stdout = sys.stdout, out
+    try:
+        parser.Parser(NestedProgram(printer_depth)).Parse().accept(printer)
+    finally:
+        sys.stdout = stdout
+    lines = out.getvalue().splitlines()
+    if printer.tab_count != 0 or lines[-1] != " Program End" or max(len(line) - len(line.lstrip("\t")) for line in lines) != 2 * printer_depth + 1:
+        raise AssertionError("PrintNodesVisitor output of a deeply nested program is malformed")
+    print(f"  PrintNodesVisitor printed {printer_depth} levels ({len(lines)} lines)")
+
+
+def StatementProgram(statements, seed=13):
+    # Many short statements, mostly assignments, with some if/while blocks.
+    rng = random.Random(seed)
+    lines = []
+    for i in range(statements):
+        roll = rng.random()
+        if roll < 0.7:
+            lines.append(f"x = y + {i} ;")
+        elif roll < 0.85:
+            lines.append(f"if ( x < {i} ) {{ y = x ; }}")
+        else:
+            lines.append("while ( x ) { x = x - 1 ; }")
+    return "\n".join(lines) + "\n"
+
+
+class ChainParser(parser.Parser):
+    # ParseStatement as it was before the dispatch table, for comparison.
+    def ParseStatement(self):
+        if self.crtToken.type == lex.TokenType.Keyword:
+            if self.crtToken.lexeme == "if":
+                return self.ParseIfStatement()
+            elif self.crtToken.lexeme == "while":
+                return self.ParseWhileStatement()
+            elif self.crtToken.lexeme == "for":
+                return self.ParseForStatement()
+            elif self.crtToken.lexeme == "return":
+                return self.ParseReturnStatement()
+            elif self.crtToken.lexeme == "let":
+                return self.ParseVariableDeclaration()
+            else:
+                raise self.Error(f"Syntax Error: Unrecognized keyword '{self.crtToken.lexeme}'")
+        elif self.crtToken.type == lex.TokenType.open_par:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.close_par:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.open_bracket:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.close_bracket:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.open_square_bracket:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.close_square_bracket:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.open_curly:
+            return self.ParseBlock()
+        elif self.crtToken.type == lex.TokenType.close_curly:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.comma:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.colon:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.semicolon:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.AdditiveOp:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.MultiplicativeOp:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.RelationalOp:
+            return self.ParseAssignment()
+        elif self.crtToken.type == lex.TokenType.identifier:
+            return self.ParseAssignment()
+        else:
+            raise self.Error("Syntax Error: Unrecognized statement start")
+
+
+def BenchStatements(statements=100000):
+    src = StatementProgram(statements)
+    tokens = lex.Lexer(skip_trivia=True).GenerateTokenBuffer(src)
+    print(f"statements: {statements} statements, {len(tokens)} tokens")
+    for name, parser_class in [("if/elif chain", ChainParser), ("dispatch table", parser.Parser)]:
+        elapsed, _ = TimeIt(lambda: parser_class(tokens).Parse())
+        print(f"  Parse, {name:<15} {elapsed:8.3f}s  {statements / elapsed:14,.0f} statements/s")
+
+    # ParseStatement alone, on the first token of every statement, with the
+    # statement parsers themselves replaced by a no-op.
+    firsts = [tokens[i] for i in range(len(tokens)) if tokens.type(i) != lex.TokenType.close_curly and (
+        i == 0 or tokens.type(i - 1) in (lex.TokenType.semicolon, lex.TokenType.open_curly, lex.TokenType.close_curly))]
+    for name, parser_class in [("if/elif chain", ChainParser), ("dispatch table", parser.Parser)]:
+        class NoOpParser(parser_class):
+            def ParseIfStatement(self):
+                pass
+            ParseWhileStatement = ParseAssignment = ParseBlock = ParseIfStatement
+        stub = NoOpParser([])
+
+        def Dispatch():
+            for token in firsts:
+                stub.crtToken = token
+                stub.ParseStatement()
+        elapsed, _ = TimeIt(Dispatch)
+        print(f"  ParseStatement, {name:<15} {elapsed / len(firsts) * 1e9:6.0f} ns/statement")
+
+
+class DictToken:
+    # The Token class as it was before __slots__, for comparison.
+    def __init__(self, t, l):
+        self.type = t
+        self.lexeme = l
+
+
+def TracedBytes(func):
+    tracemalloc.start()
+    result = func()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+
+def BenchTokenMemory(statements=5000):
+    src = SyntheticProgram(statements)
+    lexer = lex.Lexer()
+    buffer = lexer.GenerateTokenBuffer(src)
+    spans = list(zip([buffer.type(i) for i in range(len(buffer))], buffer.starts, buffer.ends))
+    print(f"token memory: {len(buffer)} tokens")
+
+    # Each layout slices its own lexemes from the source, as the lexer does.
+    layouts = [
+        ("Token with __dict__", lambda: [DictToken(t, src[start:end]) for t, start, end in spans]),
+        ("Token with __slots__", lambda: [lex.Token(t, src[start:end]) for t, start, end in spans]),
+        ("TokenBuffer", lambda: lexer.GenerateTokenBuffer(src)),
+    ]
+    for name, build in layouts:
+        size, result = TracedBytes(build)
+        print(f"  {name:<22} {size / len(result):8.1f} bytes/token")
+
+
+def BenchASTMemory(functions=2000):
+    src = LanguageProgram(functions)
+    tokens = lex.Lexer(skip_trivia=True).GenerateTokenBuffer(src)
+
+    def ParseIntoStore():
+        store = ast.ASTStore()
+        parser.Parser(tokens, store=store).Parse()
+        return store
+
+    size, root = TracedBytes(lambda: parser.Parser(tokens).Parse())
+    walker = DepthWalker()
+    walker.walk(root)
+    print(f"AST memory: {functions} functions, {walker.node_count} nodes")
+    elapsed, _ = TimeIt(lambda: parser.Parser(tokens).Parse())
+    print(f"  {'__slots__ nodes':<16} {size / walker.node_count:8.1f} bytes/node  build {elapsed:8.3f}s")
+    size, store = TracedBytes(ParseIntoStore)
+    elapsed, _ = TimeIt(ParseIntoStore)
+    print(f"  {'ASTStore':<16} {size / len(store):8.1f} bytes/node  build {elapsed:8.3f}s"
+          f"  ({len(store.literals)} pooled literals)")
+
+
+class AcceptCounter(ast.ASTVisitor):
+    # A pass in the old style: accept() double dispatch, recursing by hand.
+    def __init__(self):
+        self.node_count = 0
+
+    def Count(self, node):
+        self.node_count += 1
+        for child in node.children():
+            child.accept(self)
+
+
+for node_class in ast.NODE_CLASSES:
+    setattr(AcceptCounter, node_class.visit_name, AcceptCounter.Count)
+
+
+class KindCounter(ast.ASTVisitor):
+    # The same pass through the kind-indexed table, recursing by hand.
+    def __init__(self):
+        super().__init__()
+        self.node_count = 0
+        self.handlers = [self.Count] * len(self.handlers)
+
+    def Count(self, node):
+        self.node_count += 1
+        handlers = self.handlers
+        for child in node.children():
+            handlers[child.kind](child)
+
+
+class IdentifierCounter(ast.ASTVisitor):
+    # Overrides a single visit_* method; generic_visit walks everything else.
+    def __init__(self):
+        super().__init__()
+        self.node_count = 0
+
+    def visit_identifier_node(self, node):
+        self.node_count += 1
+
+
+class IdentifierWalker(IdentifierCounter, ast.ASTWalker):
+    # The same override driven by the walker's stack, for any depth.
+    def pre_visit(self, node):
+        self.handlers[node.kind](node)
+
+    def generic_visit(self, node):
+        for child in node.children():
+            self.Visit(child)
+
+
+def RunVisitor(visitor_class, root):
+    visitor = visitor_class()
+    if visitor_class is AcceptCounter:
+        root.accept(visitor)
+    elif issubclass(visitor_class, ast.ASTWalker):
+        visitor.walk(root)
+    else:
+        visitor.visit(root)
+    return visitor.node_count
+
+
+def BenchVisitors(functions=2000):
+    root = parser.Parser(LanguageProgram(functions)).Parse()
+    walker = DepthWalker()
+    walker.walk(root)
+    print(f"Visitors: {functions} functions, {walker.node_count} nodes")
+    for label, visitor_class in [("accept()", AcceptCounter),
+                                 ("kind table", KindCounter),
+                                 ("one override", IdentifierCounter)]:
+        elapsed, count = TimeIt(RunVisitor, visitor_class, root)
+        print(f"  {label:<14} {elapsed:8.3f}s  {elapsed / walker.node_count * 1e9:6.0f} ns/node"
+              f"  ({count} counted)")
+    deep = parser.Parser(NestedProgram(50000)).Parse()
+    for label, visitor_class in [("accept()", AcceptCounter), ("the kind table", IdentifierCounter)]:
+        try:
+            RunVisitor(visitor_class, deep)
+        except RecursionError:
+            print(f"  {label} hit the recursion limit on 50000 nested blocks")
+    print(f"  the walker took 50000 nested blocks ({RunVisitor(IdentifierWalker, deep)} identifiers)")
+
+
+class PrintCallVisitor(ast.PrintNodesVisitor):
+    # The printer as it was: every line and tab change is a scheduled step,
+    # and every line is its own print() call that rebuilds the indentation.
+    Then = ast.ASTWalker.Then
+
+    def Line(self, *text):
+        self.Then(self.PrintLine, *text)
+
+    def PrintLine(self, *text):
+        print('\t' * self.tab_count, *text)
+
+
+class CountingStream(io.StringIO):
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+
+    def write(self, text):
+        self.writes += 1
+        return super().write(text)
+
+
+def BenchPrinter(functions=2000):
+    src = LanguageProgram(functions)
+    elapsed, root = TimeIt(lambda: parser.Parser(src).Parse(), repeat=1)
+    print(f"printer: {functions} functions, parse {elapsed:.3f}s")
+    expected = io.StringIO()
+    stdout, sys.stdout = sys.stdout, expected
+    try:
+        PrintCallVisitor().walk(root)
+    finally:
+        sys.stdout = stdout
+    stream = CountingStream()
+    ast.PrintNodesVisitor(stream).walk(root)
+    if stream.getvalue() != expected.getvalue():
+        raise AssertionError("buffered printer output differs from print()")
+    lines = expected.getvalue().count("\n")
+    print(f"  {lines} lines, {len(expected.getvalue())} characters, identical in {stream.writes} writes")
+    with open(os.devnull, "w") as devnull:
+        def PrintCalls():
+            stdout, sys.stdout = sys.stdout, devnull
+            try:
+                PrintCallVisitor().walk(root)
+            finally:
+                sys.stdout = stdout
+        for label, func in [("print() per line", PrintCalls),
+                            ("buffered stream", lambda: ast.PrintNodesVisitor(devnull).walk(root))]:
+            elapsed, _ = TimeIt(func)
+            print(f"  {label:<18} {elapsed:8.3f}s  {lines / elapsed:12,.0f} lines/s")
+
+
+def EveryNodeTree():
+    # One program using every node class, and every kind of literal value.
+    a = ast
+    expr = a.ASTAdditiveOpNode(a.ASTIntegerNode(-12345678901), "+", a.ASTMultiplicativeOpNode(
+        a.ASTIdentifierNode("x"), "*", a.ASTSubExpressionNode(a.ASTRelationalOpNode(
+            a.ASTFloatLiteralNode(0.1), "<", a.ASTBooleanLiteralNode(True)))))
+    call = a.ASTFunctionCallNode("f", [expr, a.ASTUnaryNode("-", a.ASTIntegerNode(1)), a.ASTColourLiteralNode("#ff00aa")])
+    params = a.ASTActualParamsNode([a.ASTIntegerNode(4), a.ASTFunctionInvocationNode("g", [a.ASTVariableNode("v")])])
+    inner = a.ASTBlockNode([a.ASTAssignmentNode(a.ASTVariableNode("y"), call), a.ASTPrintStatementNode(params),
+                            a.ASTVariableDeclarationNode("z", "float", a.ASTFloatLiteralNode(1e-300)),
+                            a.ASTTypeNode("float"), a.ASTErrorNode("expected ';' after ‘é’")])
+    loop = a.ASTWhileStatementNode(a.ASTBooleanLiteralNode(False), inner)
+    branch = a.ASTIfStatementNode(a.ASTIdentifierNode("c"), a.ASTBlockNode([loop]),
+                                  a.ASTBlockNode([a.ASTReturnStatementNode(a.ASTIntegerNode(0))]))
+    empty = a.ASTIfStatementNode(a.ASTIdentifierNode("d"), a.ASTBlockNode([]))
+    for_loop = a.ASTForStatementNode(a.ASTVariableDeclarationNode("i", "int"),
+                                     a.ASTRelationalOpNode(a.ASTIdentifierNode("i"), "<", a.ASTIntegerNode(9)),
+                                     None, a.ASTBlockNode([branch, empty]))
+    function = a.ASTFunctionDecNode("main", a.ASTFormalParamsNode(
+        [a.ASTFormalParamNode("a", "int"), a.ASTFormalParamNode("b", "colour", 4)]), "bool", a.ASTBlockNode([for_loop]))
+    return a.ASTProgramNode([function, a.ASTBlockNode([a.ASTPrintStatementNode(a.ASTIntegerNode(7))])])
+
+
+def SameTree(first, second):
+    # Same classes, same values (and value types), same shape.
+    stack = [(first, second)]
+    while stack:
+        a, b = stack.pop()
+        if type(a) is not type(b):
+            return False
+        if a is None:
+            continue
+        for field, shape in a.fields:
+            x, y = getattr(a, field), getattr(b, field)
+            if shape is ast.VALUE:
+                if type(x) is not type(y) or x != y:
+                    return False
+            elif shape is ast.NODE:
+                stack.append((x, y))
+            elif len(x or ()) != len(y or ()):
+                return False
+            else:
+                stack.extend(zip(x or (), y or ()))
+    return True
+
+
+def CheckSerialization(functions=300):
+    tree = EveryNodeTree()
+    store = ast.ASTStore()
+    root = store.AddTree(tree)
+    kinds = set(store.kinds)
+    if kinds != set(range(len(ast.NODE_CLASSES))):
+        missing = [ast.NODE_CLASSES[kind].__name__ for kind in range(len(ast.NODE_CLASSES)) if kind not in kinds]
+        raise AssertionError(f"round trip does not cover {missing}")
+    parsed = ast.ASTStore()
+    parser.Parser(LanguageProgram(functions), store=parsed).Parse()
+    with tempfile.TemporaryDirectory() as directory:
+        for label, saved, original in [("every node class", store, tree), ("parsed program", parsed, parsed.Tree())]:
+            path = os.path.join(directory, "tree.ast")
+            saved.Save(path)
+            loaded = ast.ASTStore.Load(path)
+            if len(loaded) != len(saved) or any(loaded.Fields(i) != saved.Fields(i) for i in range(len(saved))):
+                raise AssertionError(f"{label}: loaded fields differ")
+            if not SameTree(loaded.Tree(), original) or not SameTree(ast.ASTStore.Load(path).Node(len(saved) - 1), original):
+                raise AssertionError(f"{label}: loaded tree differs")
+            print(f"  {label}: {len(saved)} nodes, {os.path.getsize(path)} bytes, round trip ok")
+        # Literals that compare equal are still distinct values.
+        signed = ast.ASTStore()
+        signed.AddTree(folding.ConstantFolder().Fold(parser.Parser("let a : float = 0.0; let b : float = -0.0;").Parse()))
+        signed.Save(path)
+        values = [repr(node.suffix.value) for node in ast.ASTStore.Load(path).Tree().blocks]
+        if values != ["0.0", "-0.0"]:
+            raise AssertionError(f"signed zeros round-trip as {values}")
+    print(f"serialization: all {len(ast.NODE_CLASSES)} node classes round-trip")
+
+
+def BenchSerialization(functions=2000):
+    src = LanguageProgram(functions)
+    store = ast.ASTStore()
+    parser.Parser(src, store=store).Parse()
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "program.ast")
+        store.Save(path)
+        print(f"serialization: {functions} functions, {len(store)} nodes, {os.path.getsize(path)} bytes on disk")
+        function = store.Children(store.Children(len(store) - 1)[0])[0]
+        elapsed, _ = TimeIt(lambda: parser.Parser(src).Parse())
+        print(f"  {'lex + parse':<22} {elapsed:8.3f}s")
+        parse = elapsed
+        for label, func in [("save", lambda: store.Save(path)),
+                            ("load (mmap)", lambda: ast.ASTStore.Load(path)),
+                            ("load + Node(function)", lambda: ast.ASTStore.Load(path).Node(function)),
+                            ("load + Tree()", lambda: ast.ASTStore.Load(path).Tree())]:
+            elapsed, _ = TimeIt(func)
+            print(f"  {label:<22} {elapsed:8.3f}s  {parse / elapsed:10.1f}x parse")
+
+
+def ModuleSources(modules, functions=20):
+    return [LanguageProgram(functions, seed=100 + i) for i in range(modules)]
+
+
+def BuildWithCache(directory, sources, max_bytes):
+    # One build process: parse every module through the shared cache and
+    # check each AST against its node count. Process pool worker for
+    # CheckCompileCache.
+    cache = CompileCache.CompileCache(directory, max_bytes)
+    for src, expected in sources:
+        walker = DepthWalker()
+        walker.walk(parser.Parser(src, cache=cache).Parse())
+        if walker.node_count != expected:
+            raise AssertionError(f"cached AST has {walker.node_count} nodes, expected {expected}")
+    return cache.hits, cache.misses
+
+
+def CheckCompileCache(modules=12):
+    sources = ModuleSources(modules)
+    broken = sources[0].replace("return total;", "return total", 1) + "let x : int = 1 $ 2;\n"
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache.CompileCache(directory)
+        for src in sources[:3] + [broken]:
+            for recover in [False, True]:
+                lexer = lex.Lexer(skip_trivia=True, recover=recover)
+                cached_lexer = lex.Lexer(skip_trivia=True, recover=recover, cache=cache)
+                expected = lexer.GenerateTokenBuffer(src)
+                for _ in range(2):  # a miss, then a hit
+                    tokens = cached_lexer.GenerateTokenBuffer(src)
+                    if ([(t.type, t.lexeme, t.start) for t in tokens] != [(t.type, t.lexeme, t.start) for t in expected]
+                            or [(d.offset, d.message) for d in tokens.diagnostics] != [(d.offset, d.message) for d in expected.diagnostics]):
+                        raise AssertionError("cached token buffer differs from a fresh one")
+        if cache.hits["tokens"] != cache.misses["tokens"]:
+            raise AssertionError(f"expected one token hit per miss, got {cache.Report()}")
+        path = os.path.join(directory, "program.parl")
+        with open(path, "w") as file:
+            file.write(sources[1])
+        if ([(t.type, t.lexeme, t.start) for t in lex.Lexer(cache=cache).GenerateTokensFromFile(path)]
+                != [(t.type, t.lexeme, t.start) for t in lex.Lexer().GenerateTokensFromFile(path)]):
+            raise AssertionError("GenerateTokensFromFile differs with a cache")
+        for src in sources[:3]:
+            expected = parser.Parser(src).Parse()
+            for _ in range(2):
+                if not SameTree(parser.Parser(src, cache=cache).Parse(), expected):
+                    raise AssertionError("cached AST differs from a fresh parse")
+        if cache.hits["ast"] != 3 or cache.misses["ast"] != 3:
+            raise AssertionError(f"expected 3 AST hits and 3 misses, got {cache.Report()}")
+        for _ in range(2):
+            recovering = parser.Parser(broken, recover=True, cache=cache)
+            recovering.Parse()
+            if not recovering.diagnostics:
+                raise AssertionError("broken program parsed without diagnostics")
+        if cache.hits["ast"] != 3:
+            raise AssertionError("an AST with errors was cached")
+        # Damaged entries, cut inside the header, inside an item or between
+        # two items, are misses: parsed again and rewritten.
+        src = sources[0]
+        for cut in (10, 101, ast.ASTStore.HEADER.size + 4):
+            for kind in ("tokens", "ast"):
+                with open(cache.Path(kind, src, *((True, False, False) if kind == "tokens" else ())), "r+b") as file:
+                    file.truncate(cut)
+            misses = cache.misses["ast"]
+            if not SameTree(parser.Parser(src, cache=cache).Parse(), parser.Parser(src).Parse()) or cache.misses["ast"] != misses + 1:
+                raise AssertionError(f"an AST entry cut at {cut} bytes was not treated as a miss")
+            lexer = lex.Lexer(skip_trivia=True, cache=cache)
+            misses = cache.misses["tokens"]
+            with open(cache.Path("tokens", src, True, False, False), "r+b") as file:
+                file.truncate(cut)
+            if [t.lexeme for t in lexer.GenerateTokenBuffer(src)] != [t.lexeme for t in lex.Lexer(skip_trivia=True).GenerateTokenBuffer(src)]:
+                raise AssertionError(f"a token entry cut at {cut} bytes was used")
+            if cache.misses["tokens"] != misses + 1:
+                raise AssertionError(f"a token entry cut at {cut} bytes was not a miss")
+
+    # The running total matches a fresh count after new and rewritten
+    # entries, and threads saving the same entry at once each write their
+    # own temporary file.
+    with tempfile.TemporaryDirectory() as directory:
+        cache = CompileCache.CompileCache(directory)
+        store = ast.ASTStore()
+        parser.Parser(sources[4], store=store).Parse()
+        for src in sources[4:7] + sources[4:6]:
+            parser.Parser(src, cache=cache).Parse()
+            cache.SaveAST(sources[4], store)
+        if cache.size != cache.Entries()[1]:
+            raise AssertionError(f"cache counted {cache.size} bytes, the directory holds {cache.Entries()[1]}")
+        with ThreadPoolExecutor(8) as pool:
+            list(pool.map(lambda _: cache.SaveAST(sources[5], store), range(32)))
+        if not SameTree(cache.LoadAST(sources[5]).Tree(), parser.Parser(sources[4]).Parse()):
+            raise AssertionError("an AST saved from several threads at once differs from a fresh parse")
+
+    # Several build processes sharing a cache that is too small for all of
+    # the modules, so they evict each other's entries while reading them.
+    counts = []
+    for src in sources:
+        walker = DepthWalker()
+        walker.walk(parser.Parser(src).Parse())
+        counts.append(walker.node_count)
+    with tempfile.TemporaryDirectory() as directory:
+        sample = CompileCache.CompileCache(directory)
+        parser.Parser(sources[0], cache=sample).Parse()
+        max_bytes = modules // 2 * sample.Entries()[1]  # room for half of the modules
+        os.remove(sample.Path("ast", sources[0]))
+        jobs = list(zip(sources, counts))
+        with ProcessPoolExecutor(4) as pool:
+            builds = [pool.submit(BuildWithCache, directory, jobs[i:] + jobs[:i], max_bytes) for i in range(0, 8, 2)]
+            results = [build.result() for build in builds]
+        size = sum(entry.stat().st_size for entry in os.scandir(directory) if entry.name.endswith((".tokens", ".ast")))
+        if size > max_bytes:
+            raise AssertionError(f"cache holds {size} bytes, more than its {max_bytes} limit")
+        hits = sum(hits["ast"] for hits, misses in results)
+        print(f"  {len(builds)} concurrent builds of {modules} modules, {hits} AST hits, cache kept to {size} <= {max_bytes} bytes")
+    print("compile cache: token buffers, ASTs and GenerateTokensFromFile match uncached results")
+
+
+def BenchCompileCache(modules=40):
+    sources = ModuleSources(modules)
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"compile cache: {modules} modules, {sum(map(len, sources))} characters")
+        elapsed, _ = TimeIt(lambda: [parser.Parser(src).Parse() for src in sources], repeat=1)
+        print(f"  {'no cache':<16} {elapsed:8.3f}s")
+        for label in ["cold cache", "warm cache"]:
+            cache = CompileCache.CompileCache(directory)
+            elapsed, _ = TimeIt(lambda: [parser.Parser(src, cache=cache).Parse() for src in sources], repeat=1)
+            print(f"  {label:<16} {elapsed:8.3f}s  " + cache.Report().replace("\n", ", "))
+        cache = CompileCache.CompileCache(directory)
+        edited = sources[:]
+        edited[0] = edited[0].replace("return total;", "return total + 1;", 1)
+        elapsed, _ = TimeIt(lambda: [parser.Parser(src, cache=cache).Parse() for src in edited], repeat=1)
+        print(f"  {'one module edited':<16} {elapsed:8.3f}s  " + cache.Report().replace("\n", ", "))
+
+
+SEMANTIC_ERRORS = [
+    ("let x : int = 1.5;", "Cannot initialise 'x' of type int with float"),
+    ("let x : int = 1; let x : int = 2;", "'x' is already declared in this scope"),
+    ("let x : int = y;", "Undeclared variable 'y'"),
+    ("let x : bool = 1 < true;", "Operator '<' cannot be applied to int and bool"),
+    ("let x : bool = (1 < 2) and 3;", "Operator 'and' cannot be applied to bool and int"),
+    ("let x : bool = true < false;", "Operator '<' cannot be applied to bool and bool"),
+    ("let x : colour = #000000 * #ffffff;", "Operator '*' cannot be applied to colour and colour"),
+    ("let x : int = -true;", "Operator '-' cannot be applied to bool"),
+    ("let x : int = 1; x = 2.0;", "Cannot assign float to 'x' of type int"),
+    ("if (1) { }", "The 'if' condition must be bool, not int"),
+    ("while (1.0) { }", "The 'while' condition must be bool, not float"),
+    ("for (let i : int = 0; i; i = i + 1) { }", "The 'for' condition must be bool, not int"),
+    ("return 1;", "'return' outside a function"),
+    ("fun f() -> int { return true; }", "Cannot return bool from a function returning int in function 'f'"),
+    ("fun f(a : int) -> int { return a; } let x : int = f(1, 2);", "'f' takes 1 arguments, not 2"),
+    ("fun f(a : int) -> int { return a; } let x : int = f(1.0);", "Argument 1 of 'f' must be int, not float"),
+    ("fun f(a : int[4]) -> int { return 0; } let x : int = f(1);", "Argument 1 of 'f' must be int[4], not int"),
+    ("let x : int = g(1);", "Undeclared function 'g'"),
+    ("fun f() -> int { return 0; } fun f() -> int { return 1; }", "Function 'f' is declared twice"),
+    ("fun f(a : int, a : int) -> int { return a; }", "Parameter 'a' is declared twice in function 'f'"),
+    ("fun f() -> int { fun g() -> int { return 0; } return 0; }", "Function 'g' must be declared at the top level in function 'f'"),
+    ("{ let x : int = 1; } x = 2;", "Undeclared variable 'x'"),
+    ("__write_box 1, 2, 3, 4, 5;", "Argument 5 of '__write_box' must be colour, not int"),
+    ("let c : colour = __read 1, true;", "Argument 2 of '__read' must be int, not bool"),
+    ("let x : int = y * 2.0 + 1;", "Undeclared variable 'y'"),
+    ("{ let t : int = 7; __print f(); } let x : int = 1; fun f() -> int { return x; }",
+     "Function 'f' is called before global 'x' it uses is declared"),
+    ("fun a() -> int { return b(); } __print a(); let y : int = 2; fun b() -> int { y = y + 1; return y; }",
+     "Function 'a' is called before global 'y' it uses is declared"),
+]
+
+
+class ResolutionWalker(ast.ASTWalker):
+    # (name, depth, slot) of every variable use, in walk order.
+    def __init__(self):
+        self.found = []
+
+    def pre_visit(self, node):
+        if type(node) is ast.ASTIdentifierNode:
+            self.found.append((node.identifier, node.depth, node.slot))
+        elif type(node) is ast.ASTVariableNode:
+            self.found.append((node.lexeme, node.depth, node.slot))
+        super().pre_visit(node)
+
+
+def Resolutions(root):
+    walker = ResolutionWalker()
+    walker.walk(root)
+    return walker.found
+
+
+def CheckSemantics(functions=500):
+    for src, expected in SEMANTIC_ERRORS:
+        diagnostics = [d.message for d in semantic.SemanticVisitor().Check(parser.Parser(src).Parse())]
+        if diagnostics != [expected]:
+            raise AssertionError(f"{src!r}: expected [{expected!r}], got {diagnostics!r}")
+    # Shadowing, sibling blocks sharing slots, and globals seen from a
+    # function (depth 1) next to its own parameters and locals (depth 0).
+    root = parser.Parser("""
+let g : int = 1;
+fun f(a : int, b : int) -> int {
+    let c : int = a + g;
+    { let a : float = 2.0; let d : float = a; }
+    { let e : int = c; }
+    return b + f(c, g);
+}
+let h : int = f(g, 2);
+{ let g : bool = true; let k : bool = g; }
+let m : int = g + h;
+""").Parse()
+    diagnostics = semantic.SemanticVisitor().Check(root)
+    expected = [("a", 0, 0), ("g", 1, 0), ("a", 0, 3), ("c", 0, 2), ("b", 0, 1), ("c", 0, 2), ("g", 1, 0),
+                ("g", 0, 0), ("g", 0, 2), ("g", 0, 0), ("h", 0, 1)]
+    if diagnostics or Resolutions(root) != expected:
+        raise AssertionError(f"unexpected resolution {Resolutions(root)} {[d.message for d in diagnostics]}")
+    function, declaration = root.blocks[1], root.blocks[2]
+    if function.frame_size != 5 or root.frame_size != 4 or declaration.suffix.declaration is not function:
+        raise AssertionError(f"frame sizes {function.frame_size}, {root.frame_size} or call target are wrong")
+    root = parser.Parser(LanguageProgram(functions)).Parse()
+    diagnostics = semantic.SemanticVisitor().Check(root)
+    unresolved = [use for use in Resolutions(root) if use[2] is None]
+    if diagnostics or unresolved:
+        raise AssertionError(f"LanguageProgram does not check: {[d.message for d in diagnostics[:3]]} {unresolved[:3]}")
+    print(f"semantics: {len(SEMANTIC_ERRORS)} error cases, scoping and {functions} generated functions check")
+
+
+def BenchSemantics():
+    print("semantic analysis:")
+    for functions in [5000, 10000, 20000]:
+        root = parser.Parser(LanguageProgram(functions)).Parse()
+        walker = DepthWalker()
+        walker.walk(root)
+        elapsed, diagnostics = TimeIt(lambda: semantic.SemanticVisitor().Check(root), repeat=1)
+        if diagnostics:
+            raise AssertionError(diagnostics[0].message)
+        print(f"  {functions:6} functions  {walker.node_count:8} nodes  {elapsed:7.3f}s  {elapsed / walker.node_count * 1e9:6.0f} ns/node")
+
+
+FOLDS = [
+    ("(10 - 4) * 2 + 1", "Integer value:: 13"),
+    ("7 / -2", "Integer value:: -3"),
+    ("7.0 / 2.0 - 0.5", "Float Literal:: 3.0"),
+    ("(1 < 2) and not (3 >= 4)", "Boolean Literal:: True"),
+    ("-(2 * 3)", "Integer value:: -6"),
+    ("x * 1 + 0", "Identifier:: x"),
+    ("0 + (1 * x) / 1 - 0", "Identifier:: x"),
+    ("(x > 1) and true", "Relational Operation (>) between:"),
+    ("(x > 1) and false", "Boolean Literal:: False"),
+    ("true or (x > 1)", "Boolean Literal:: True"),
+    ("(f(x) > 1) and false", "Multiplicative Operation (and) between:"),
+    ("(1 / x == 1) and false", "Multiplicative Operation (and) between:"),
+    ("(x / 0 > 1) or true", "Additive Operation (or) between:"),
+    ("(x / 2 > -x * 3) and false", "Boolean Literal:: False"),
+    ("x / 0", "Multiplicative Operation (/) between:"),
+    ("x + 0.0", "Additive Operation (+) between:"),
+    ("x == false", "Relational Operation (==) between:"),
+    ("true != x", "Relational Operation (!=) between:"),
+    ("x != true", "Relational Operation (!=) between:"),
+]
+
+
+def FoldedLines(src):
+    root = folding.ConstantFolder().Fold(parser.Parser(src).Parse())
+    out = io.StringIO()
+    ast.PrintNodesVisitor(out).walk(root)
+    return [line.strip() for line in out.getvalue().splitlines()]
+
+
+def RandomConstant(rng, depth):
+    # A random well-typed int, float or bool expression with literal operands.
+    kind = rng.choice(["int", "float", "bool"])
+    def Operand(kind, depth):
+        if depth == 0 or rng.random() < 0.3:
+            if kind == "int":
+                return str(rng.randint(0, 20))
+            if kind == "float":
+                return rng.choice(["0.5", "1.25", "3.0", "10.0"])
+            return rng.choice(["true", "false"])
+        if kind == "bool":
+            if rng.random() < 0.5:
+                return f"({Operand('bool', depth - 1)} {rng.choice(['and', 'or', '==', '!='])} {Operand('bool', depth - 1)})"
+            number = rng.choice(["int", "float"])
+            return f"({Operand(number, depth - 1)} {rng.choice(['<', '>', '<=', '>=', '==', '!='])} {Operand(number, depth - 1)})"
+        if rng.random() < 0.2:
+            return f"(-{Operand(kind, depth - 1)})"
+        return f"({Operand(kind, depth - 1)} {rng.choice('+-*/')} {Operand(kind, depth - 1)})"
+    return kind, Operand(kind, depth)
+
+
+def Evaluate(node):
+    # Reference evaluation of an unfolded literal expression.
+    if type(node) in (ast.ASTIntegerNode, ast.ASTFloatLiteralNode, ast.ASTBooleanLiteralNode):
+        return node.value
+    if type(node) is ast.ASTSubExpressionNode:
+        return Evaluate(node.expression)
+    if type(node) is ast.ASTUnaryNode:
+        return folding.UNARY_OPERATIONS[node.operator](Evaluate(node.operand))
+    return folding.BINARY_OPERATIONS[node.operator](Evaluate(node.left), Evaluate(node.right))
+
+
+def CheckFolding(expressions=3000, seed=22):
+    for src, expected in FOLDS:
+        lines = FoldedLines(f"let v : int = {src};")
+        if lines[2] != expected:
+            raise AssertionError(f"{src!r} folded to {lines[2:-1]}, expected {expected!r}")
+    for src, kept in [("if (1 > 2) { __print 1; } else { __print 2; }", ["Block Start:", "Print Statement:", "Integer value:: 2", "Block End"]),
+                      ("if (false) { __print 1; }", []),
+                      ("while (false and (x > 0)) { x = x - 1; }", []),
+                      ("while (true) { __delay 1; }", ["While Loop:", "Condition:", "Boolean Literal:: True", "Loop Block:",
+                                                       "Block Start:", "Function Call: __delay with params:", "Integer value:: 1", "Block End"])]:
+        lines = FoldedLines(src)
+        if lines[1:-1] != kept:
+            raise AssertionError(f"{src!r} folded to {lines[1:-1]}")
+    # A division that fails must still fail after folding.
+    root = CheckedTree("let z : int = 0; __print (1 / z == 1) and false;", fold=True)
+    try:
+        bytecode.VM().Run(bytecode.BytecodeCompiler().Compile(root), bytecode.Display())
+        raise AssertionError("folding dropped a division by zero")
+    except ZeroDivisionError:
+        pass
+    rng = random.Random(seed)
+    folded = 0
+    for _ in range(expressions):
+        kind, src = RandomConstant(rng, 4)
+        declaration = parser.Parser(f"let v : {kind} = {src};").Parse().blocks[0]
+        try:
+            expected = Evaluate(declaration.suffix)
+        except ZeroDivisionError:
+            continue
+        value = folding.ConstantFolder().Fold(declaration).suffix
+        if type(value) not in folding.LITERAL_CLASSES.values() or type(value.value) is not type(expected) or value.value != expected:
+            raise AssertionError(f"{src} folded to {getattr(value, 'value', value)!r}, expected {expected!r}")
+        folded += 1
+    print(f"constant folding: {len(FOLDS)} identities, dead branches and {folded} random constant expressions agree")
+
+
+def FoldingProgram(functions, seed=22):
+    # Generated code full of constant arithmetic, identities and branches that
+    # can never run, around a loop that does real work.
+    rng = random.Random(seed)
+    lines = []
+    for i in range(functions):
+        lines.append(f"fun g{i}(a : int, b : float) -> int {{")
+        lines.append(f"    let scale : int = ({rng.randint(2, 9)} * 8 - 2) / 3 + a * 1;")
+        lines.append("    let offset : float = b * (2.0 / 4.0) + 0.5 * 2.0;")
+        lines.append("    if ((1 > 2) and (a > 0)) { __print scale; __print offset; }")
+        lines.append("    while (false and (a > 0)) { a = a - 1; }")
+        lines.append(f"    for (let i : int = 0; i < 4 * 4; i = i + 1 * 1) {{ scale = scale + (2 + 3 - 5) + i * (10 / 5 - 1); }}")
+        lines.append("    if ((offset > 1.0) or true) { scale = scale * (7 - 6); } else { scale = 0; }")
+        lines.append("    return scale * (10 / 5 - 1) + 0;")
+        lines.append("}")
+    lines.append(f"__print g{functions - 1}(3, 1.5);")
+    return "\n".join(lines) + "\n"
+
+
+def BenchFolding(functions=5000):
+    src = FoldingProgram(functions)
+    counter = DepthWalker()
+    counter.walk(parser.Parser(src).Parse())
+    before = counter.node_count
+    folder = folding.ConstantFolder()
+    root = parser.Parser(src).Parse()
+    semantic.SemanticVisitor().Check(root)
+    elapsed, root = TimeIt(folder.Fold, root, repeat=1)
+    counter = DepthWalker()
+    counter.walk(root)
+    after = counter.node_count
+    if folder.removed != before - after:
+        raise AssertionError(f"the folder reports {folder.removed} nodes removed, not {before - after}")
+    print(f"constant folding: {functions} functions, {before} -> {after} nodes "
+          f"({folder.removed} removed, {100 * folder.removed / before:.0f}%), {folder.folded} folds in {elapsed:.3f}s")
+    unfolded = parser.Parser(src).Parse()
+    for label, run in [("semantic analysis", lambda tree: semantic.SemanticVisitor().Check(tree)),
+                       ("print", lambda tree: ast.PrintNodesVisitor(io.StringIO()).walk(tree))]:
+        slow, _ = TimeIt(run, unfolded)
+        fast, _ = TimeIt(run, root)
+        print(f"  {label:<18} unfolded {slow:7.3f}s  folded {fast:7.3f}s  ({100 * (slow - fast) / slow:.0f}% faster)")
+
+
+
+class ReturnValue(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+class TreeInterpreter:
+    # The straightforward way to run a checked tree, as a baseline for the
+    # VM: statements and expressions are evaluated by recursing over the
+    # nodes, dispatching on each node's class, with return unwinding as an
+    # exception. Variables use the slots SemanticVisitor resolved.
+    def __init__(self, display):
+        self.display = display
+
+    def Run(self, root):
+        self.functions = {statement.identifier: statement for statement in root.blocks
+                          if type(statement) is ast.ASTFunctionDecNode}
+        self.globals = self.frame = [None] * root.frame_size
+        for statement in root.blocks:
+            if type(statement) is not ast.ASTFunctionDecNode:
+                self.Execute(statement)
+        return self.display
+
+    def Execute(self, node):
+        self.executors[type(node)](self, node)
+
+    def Evaluate(self, node):
+        return self.evaluators[type(node)](self, node)
+
+    def Frame(self, depth):
+        return self.frame if depth == 0 else self.globals
+
+    def ExecuteBlock(self, node):
+        for statement in node.statements:
+            self.Execute(statement)
+
+    def ExecuteDeclaration(self, node):
+        self.frame[node.slot] = self.Evaluate(node.suffix)
+
+    def ExecuteAssignment(self, node):
+        self.Frame(node.id.depth)[node.id.slot] = self.Evaluate(node.expr)
+
+    def ExecuteIf(self, node):
+        if self.Evaluate(node.condition):
+            self.Execute(node.true_block)
+        elif node.false_block:
+            self.Execute(node.false_block)
+
+    def ExecuteWhile(self, node):
+        while self.Evaluate(node.condition):
+            self.Execute(node.block)
+
+    def ExecuteFor(self, node):
+        if node.initialization:
+            self.Execute(node.initialization)
+        while self.Evaluate(node.condition):
+            self.Execute(node.block)
+            if node.increment:
+                self.Execute(node.increment)
+
+    def ExecutePrint(self, node):
+        self.display.Print(self.Evaluate(node.expression))
+
+    def ExecuteReturn(self, node):
+        raise ReturnValue(self.Evaluate(node.expression))
+
+    def EvaluateLiteral(self, node):
+        return node.value
+
+    def EvaluateColour(self, node):
+        return int(node.value[1:], 16)
+
+    def EvaluateVariable(self, node):
+        return self.Frame(node.depth)[node.slot]
+
+    def EvaluateSubExpression(self, node):
+        return self.Evaluate(node.expression)
+
+    def EvaluateUnary(self, node):
+        return folding.UNARY_OPERATIONS[node.operator](self.Evaluate(node.operand))
+
+    def EvaluateBinary(self, node):
+        return folding.BINARY_OPERATIONS[node.operator](self.Evaluate(node.left), self.Evaluate(node.right))
+
+    def EvaluateCall(self, node):
+        values = [self.Evaluate(param) for param in node.actual_params]
+        display = self.display
+        name = node.identifier
+        if name == "__width":
+            return display.width
+        if name == "__height":
+            return display.height
+        if name == "__random_int":
+            return display.RandomInt(*values)
+        if name == "__read":
+            return display.Read(*values)
+        if name == "__delay":
+            return display.Delay(*values)
+        if name == "__write":
+            return display.Write(*values)
+        if name == "__write_box":
+            return display.WriteBox(*values)
+        function = self.functions[name]
+        caller = self.frame
+        self.frame = values + [None] * (function.frame_size - len(values))
+        try:
+            self.Execute(function.block)
+        except ReturnValue as returned:
+            return returned.value
+        finally:
+            self.frame = caller
+        return bytecode.DEFAULT_VALUES[function.return_type]
+
+    executors = {
+        ast.ASTBlockNode: ExecuteBlock,
+        ast.ASTVariableDeclarationNode: ExecuteDeclaration,
+        ast.ASTAssignmentNode: ExecuteAssignment,
+        ast.ASTIfStatementNode: ExecuteIf,
+        ast.ASTWhileStatementNode: ExecuteWhile,
+        ast.ASTForStatementNode: ExecuteFor,
+        ast.ASTPrintStatementNode: ExecutePrint,
+        ast.ASTReturnStatementNode: ExecuteReturn,
+        ast.ASTFunctionCallNode: EvaluateCall,
+    }
+    evaluators = {
+        ast.ASTIntegerNode: EvaluateLiteral,
+        ast.ASTFloatLiteralNode: EvaluateLiteral,
+        ast.ASTBooleanLiteralNode: EvaluateLiteral,
+        ast.ASTColourLiteralNode: EvaluateColour,
+        ast.ASTIdentifierNode: EvaluateVariable,
+        ast.ASTVariableNode: EvaluateVariable,
+        ast.ASTSubExpressionNode: EvaluateSubExpression,
+        ast.ASTUnaryNode: EvaluateUnary,
+        ast.ASTAdditiveOpNode: EvaluateBinary,
+        ast.ASTMultiplicativeOpNode: EvaluateBinary,
+        ast.ASTRelationalOpNode: EvaluateBinary,
+        ast.ASTFunctionCallNode: EvaluateCall,
+    }
+
+
+def CheckedTree(src, fold=False):
+    root = parser.Parser(src).Parse()
+    diagnostics = semantic.SemanticVisitor().Check(root)
+    if diagnostics:
+        raise AssertionError(f"{diagnostics[0].message} in {src[:60]!r}")
+    return folding.ConstantFolder().Fold(root) if fold else root
+
+
+# Loop-heavy programs for running: nested pixel loops, float arithmetic in
+# a while loop, recursion, and globals updated from a function.
+LOOP_PROGRAMS = {
+    "pixels": """
+let w : int = __width;
+let h : int = __height;
+for (let frame : int = 0; frame < 12; frame = frame + 1) {
+    for (let y : int = 0; y < h; y = y + 1) {
+        for (let x : int = 0; x < w; x = x + 1) {
+            let s : int = x + y + frame;
+            if (s / 4 * 4 == s) { __write x, y, #ff0000; } else { __write x, y, #000000 + #000001; }
+        }
+    }
+    __delay 16;
+}
+__print __read 4, 0;
+""",
+    "mandelbrot": """
+fun mandel(cx : float, cy : float) -> int {
+    let zx : float = 0.0;
+    let zy : float = 0.0;
+    let i : int = 0;
+    while ((i < 40) and (zx * zx + zy * zy < 4.0)) {
+        let t : float = zx * zx - zy * zy + cx;
+        zy = 2.0 * zx * zy + cy;
+        zx = t;
+        i = i + 1;
+    }
+    return i;
+}
+let total : int = 0;
+let cy : float = -1.2;
+for (let y : int = 0; y < 24; y = y + 1) {
+    let cx : float = -2.0;
+    for (let x : int = 0; x < 32; x = x + 1) {
+        let n : int = mandel(cx, cy);
+        total = total + n;
+        if (n == 40) { __write x, y, #ffffff; }
+        cx = cx + 0.09375;
+    }
+    cy = cy + 0.1;
+}
+__print total;
+""",
+    "fib": """
+fun fib(n : int) -> int {
+    if (n < 2) { return n; }
+    return fib(n - 1) + fib(n - 2);
+}
+__print fib(18);
+""",
+    "globals": """
+let hits : int = 0;
+let seen : bool = false;
+fun step(x : int) -> bool {
+    if ((x / 3 * 3 == x) or (x / 5 * 5 == x)) { hits = hits + x; return true; }
+    return false;
+}
+let i : int = 0;
+while (i < 20000) {
+    seen = step(i) and (i > 10) or seen;
+    i = i + 1;
+}
+__print hits;
+__print seen;
+__print -7 / 2;
+__print not (7.5 / 2.0 >= 3.75);
+__write_box __random_int 30, __random_int 30, 6, 6, #102030;
+__print __read 0, 0;
+""",
+}
+
+
+def RunBoth(root, code, seed=0):
+    expected = TreeInterpreter(bytecode.Display(seed=seed)).Run(root)
+    actual = bytecode.VM().Run(code, bytecode.Display(seed=seed))
+    for field in ("printed", "pixels", "delayed"):
+        if getattr(actual, field) != getattr(expected, field):
+            return field, getattr(expected, field), getattr(actual, field)
+    return None
+
+
+def CheckBytecode(seed=23):
+    # The VM must print, draw and delay exactly as the tree interpreter does,
+    # with and without folding; and for expressions, compute exactly the
+    # values the reference evaluation does.
+    for name, src in LOOP_PROGRAMS.items():
+        for fold in (False, True):
+            root = CheckedTree(src, fold)
+            difference = RunBoth(root, bytecode.BytecodeCompiler().Compile(root))
+            if difference:
+                raise AssertionError(f"{name} (fold={fold}): {difference[0]} differ, {difference[1][:8]} != {difference[2][:8]}")
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(1000):
+        kind, src = RandomConstant(rng, 4)
+        declaration = parser.Parser(f"let v : {kind} = {src};").Parse().blocks[0]
+        try:
+            Evaluate(declaration.suffix)
+        except ZeroDivisionError:
+            continue
+        lines.append(f"__print {src};")
+    root = CheckedTree("\n".join(lines))
+    difference = RunBoth(root, bytecode.BytecodeCompiler().Compile(root))
+    if difference:
+        raise AssertionError(f"random expressions: {difference[0]} differ")
+    root = CheckedTree("let a : float = 0.0; let b : float = -0.0; __print b; __print a + b;", fold=True)
+    if RunBoth(root, bytecode.BytecodeCompiler().Compile(root)):
+        raise AssertionError("the VM loses the sign of -0.0")
+    # More constants than fused instructions can address fall back to
+    # unfused code.
+    src = "".join(f"__print {i};\n" for i in range(33000)) + "let x : int = 0;\nx = x + 40000;\n__print x * 40001;\n"
+    root = CheckedTree(src)
+    if RunBoth(root, bytecode.BytecodeCompiler().Compile(root)):
+        raise AssertionError("a program with 33000 constants runs differently")
+    print(f"bytecode: {len(LOOP_PROGRAMS)} programs and {len(lines)} random expressions run the same as the tree interpreter")
+
+
+def BenchBytecode():
+    print("running programs (tree interpreter vs bytecode VM):")
+    for name, src in LOOP_PROGRAMS.items():
+        root = CheckedTree(src, fold=True)
+        compile_time, code = TimeIt(bytecode.BytecodeCompiler().Compile, root)
+        tree, _ = TimeIt(lambda: TreeInterpreter(bytecode.Display()).Run(root), repeat=5)
+        vm, _ = TimeIt(lambda: bytecode.VM().Run(code, bytecode.Display()), repeat=5)
+        print(f"  {name:<11} tree {tree:7.3f}s  vm {vm:7.3f}s  ({tree / vm:4.1f}x)  "
+              f"{len(code):4} instructions compiled in {compile_time * 1e3:5.2f}ms")
+    src = FoldingProgram(2000) + "".join(f"__print g{n}({n}, 1.5);\n" for n in range(2000))
+    unfolded, folded = CheckedTree(src), CheckedTree(src, fold=True)
+    for label, root in [("unfolded", unfolded), ("folded", folded)]:
+        code = bytecode.BytecodeCompiler().Compile(root)
+        tree, _ = TimeIt(lambda: TreeInterpreter(bytecode.Display()).Run(root), repeat=5)
+        vm, _ = TimeIt(lambda: bytecode.VM().Run(code, bytecode.Display()), repeat=5)
+        print(f"  folding program, {label:<8} tree {tree:7.3f}s  vm {vm:7.3f}s  ({len(code)} instructions)")
+
+
+def RunPython(src, root, fold, seed=0):
+    expected = TreeInterpreter(bytecode.Display(seed=seed)).Run(root)
+    actual = transpiler.Run(transpiler.CompileProgram(src, fold), bytecode.Display(seed=seed))
+    for field in ("printed", "pixels", "delayed"):
+        if getattr(actual, field) != getattr(expected, field):
+            return field
+    return None
+
+
+def CheckTranspiler(seed=24):
+    # Generated Python must print, draw and delay exactly as the tree
+    # interpreter does; compiled code must come back from memory and from
+    # disk, and a damaged entry must be recompiled.
+    programs = dict(LOOP_PROGRAMS)
+    programs["empty blocks"] = """
+let n : int = 0;
+fun bump(k : int) -> int { n = n + k; { } if (k > 100) { } else { } return n; }
+while (n < 10) { { { } } let unused : int = bump(3); }
+for (let i : int = 0; i < 3; i = i + 1) { }
+fun fallthrough(x : float) -> float { if (x > 1.0) { return x / 2.0; } }
+__print fallthrough(0.5) + fallthrough(3.0);
+__print n;
+"""
+    rng = random.Random(seed)
+    lines = []
+    while len(lines) < 500:
+        kind, expression = RandomConstant(rng, 4)
+        declaration = parser.Parser(f"let v : {kind} = {expression};").Parse().blocks[0]
+        try:
+            Evaluate(declaration.suffix)
+        except ZeroDivisionError:
+            continue
+        lines.append(f"__print {expression};")
+    programs["random expressions"] = "\n".join(lines)
+    for name, src in programs.items():
+        for fold in (False, True):
+            difference = RunPython(src, CheckedTree(src, fold), fold)
+            if difference:
+                raise AssertionError(f"{name} (fold={fold}): {difference} differ from the tree interpreter")
+    src = LOOP_PROGRAMS["fib"]
+    if transpiler.CompileProgram(src) is not transpiler.CompileProgram(src):
+        raise AssertionError("code object was compiled twice")
+    with tempfile.TemporaryDirectory() as directory:
+        transpiler.code_objects.clear()
+        cache = CompileCache.CompileCache(directory)
+        transpiler.CompileProgram(src, cache=cache)
+        transpiler.code_objects.clear()
+        code = transpiler.CompileProgram(src, cache=cache)
+        if cache.hits["code"] != 1 or cache.misses["code"] != 1:
+            raise AssertionError(f"expected one code hit and one miss, got {cache.Report()}")
+        if transpiler.Run(code, bytecode.Display()).printed != ["2584"]:
+            raise AssertionError("cached code runs differently")
+        for entry in os.listdir(directory):
+            if entry.endswith(".code"):
+                with open(os.path.join(directory, entry), "r+b") as file:
+                    file.truncate(10)
+        transpiler.code_objects.clear()
+        transpiler.CompileProgram(src, cache=cache)
+        if cache.misses["code"] != 2:
+            raise AssertionError(f"damaged code entry was used, {cache.Report()}")
+    nested = "let x : int = 0;\n" + "while (x < 1) { " * 30 + "x = 1;" + " }" * 30
+    try:
+        transpiler.CompileProgram(nested)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("30 nested loops compiled, beyond CPython's limit of 20")
+    print(f"transpiler: {len(programs)} programs run the same as the tree interpreter, code cached in memory and on disk")
+
+
+def BenchTranspiler():
+    print("running programs (tree interpreter, bytecode VM, transpiled Python):")
+    for name, src in LOOP_PROGRAMS.items():
+        root = CheckedTree(src, fold=True)
+        code = bytecode.BytecodeCompiler().Compile(root)
+        python = transpiler.CompileProgram(src)
+        tree, _ = TimeIt(lambda: TreeInterpreter(bytecode.Display()).Run(root), repeat=5)
+        vm, _ = TimeIt(lambda: bytecode.VM().Run(code, bytecode.Display()), repeat=5)
+        native, _ = TimeIt(lambda: transpiler.Run(python, bytecode.Display()), repeat=5)
+        print(f"  {name:<11} tree {tree:7.3f}s  vm {vm:7.3f}s  python {native:7.3f}s  "
+              f"({tree / native:4.1f}x tree, {vm / native:4.1f}x vm)")
+    src = FoldingProgram(2000) + "".join(f"__print g{n}({n}, 1.5);\n" for n in range(2000))
+    with tempfile.TemporaryDirectory() as directory:
+        def Compile(cache=None, clear=True):
+            if clear:
+                transpiler.code_objects.clear()
+            return transpiler.CompileProgram(src, cache=cache)
+        cold, _ = TimeIt(Compile, repeat=1)
+        cache = CompileCache.CompileCache(directory)
+        Compile(cache)
+        disk, _ = TimeIt(Compile, cache)
+        memory, python = TimeIt(Compile, None, False)
+        native, _ = TimeIt(lambda: transpiler.Run(python, bytecode.Display()))
+    print(f"  folding program (2000 functions): compile {cold:.3f}s, from disk {disk * 1e3:.1f}ms, "
+          f"from memory {memory * 1e6:.0f}us, run {native:.3f}s")
+
+
+BOX_PROGRAM = """
+let w : int = __width;
+let h : int = __height;
+for (let frame : int = 0; frame < 60; frame = frame + 1) {
+    __write_box 0, 0, w, h, #102040;
+    __write_box frame * 4 - 40, frame * 2 - 20, w / 2, h / 2, #ffcc00 - #ffcd00;
+    __write_box w - frame * 5, h / 3, 200, 100, #00ff00 + #ff0180;
+    __write frame, frame, #ff0000;
+    __delay 16;
+}
+__print __read 1, 1;
+__print __read w - 1, h - 1;
+"""
+
+
+class PixelDisplay(bytecode.Display):
+    # Boxes drawn one pixel at a time, the loop the framebuffer replaces.
+    def WriteBox(self, x, y, width, height, colour):
+        for row in range(y, y + height):
+            for column in range(x, x + width):
+                self.Write(column, row, colour)
+
+
+def DecodePNG(data):
+    # The RGB rows of a PNG written by Framebuffer.EncodePNG (filter type 0).
+    position = 8
+    header, compressed = None, b""
+    while position < len(data):
+        length = int.from_bytes(data[position:position + 4], "big")
+        kind = data[position + 4:position + 8]
+        body = data[position + 8:position + 8 + length]
+        if int.from_bytes(data[position + 8 + length:position + 12 + length], "big") != zlib.crc32(kind + body):
+            raise AssertionError(f"bad CRC on the {kind.decode()} chunk")
+        if kind == b"IHDR":
+            header = body
+        elif kind == b"IDAT":
+            compressed += body
+        position += length + 12
+    width, height = int.from_bytes(header[:4], "big"), int.from_bytes(header[4:8], "big")
+    raw = zlib.decompress(compressed)
+    stride = width * 3 + 1
+    rows = [raw[row * stride:(row + 1) * stride] for row in range(height)]
+    if any(row[0] != 0 for row in rows):
+        raise AssertionError("unexpected PNG filter type")
+    return width, height, [row[1:] for row in rows]
+
+
+def CheckFramebuffer():
+    # What a Display draws must encode to a PPM and a PNG that read back
+    # unchanged, and a PPM whose pixels fall short of or run past its size
+    # is rejected; none of that needs numpy. A Framebuffer must then draw
+    # exactly what a Display does, run by the VM or by transpiled Python,
+    # including boxes clipped on every side and colour arithmetic that
+    # wraps, and save the same files.
+    image = transpiler.Run(transpiler.CompileProgram(BOX_PROGRAM), bytecode.Display(97, 61))
+    rgb = framebuffer.RGBBytes(image.pixels)
+    ppm = framebuffer.EncodePPM(97, 61, rgb)
+    if framebuffer.DecodePPM(ppm) != (97, 61, rgb):
+        raise AssertionError("PPM does not decode to the display")
+    for damaged in [ppm[:-1], ppm + b"\n", ppm.replace(b"255\n", b"255\n\n", 1),
+                    ppm.replace(b"255\n", b"255\n# boxes\n", 1), ppm.replace(b"P6", b"P3", 1), b"P6\n97 61\n"]:
+        try:
+            framebuffer.DecodePPM(damaged)
+        except ValueError:
+            continue
+        raise AssertionError(f"damaged PPM decoded: {damaged[:24]!r}...")
+    expected_rows = [rgb[start:start + 97 * 3] for start in range(0, len(rgb), 97 * 3)]
+    if DecodePNG(framebuffer.EncodePNG(97, 61, rgb)) != (97, 61, expected_rows):
+        raise AssertionError("PNG does not decode to the display")
+    if framebuffer.np is None:
+        print("framebuffer: PPM and PNG encode and read back; Framebuffer skipped, numpy is not installed")
+        return
+    sizes = [(36, 36), (97, 61)]
+    for name, src in list(LOOP_PROGRAMS.items()) + [("boxes", BOX_PROGRAM)]:
+        for width, height in sizes:
+            expected = transpiler.Run(transpiler.CompileProgram(src), bytecode.Display(width, height))
+            for label, display in [("vm", bytecode.VM().Run(bytecode.CompileSource(src), framebuffer.Framebuffer(width, height))),
+                                   ("python", transpiler.Run(transpiler.CompileProgram(src), framebuffer.Framebuffer(width, height)))]:
+                if display.pixels.ravel().tolist() != expected.pixels or display.printed != expected.printed:
+                    raise AssertionError(f"{name} at {width}x{height} on the {label} draws differently")
+    drawn = transpiler.Run(transpiler.CompileProgram(BOX_PROGRAM), framebuffer.Framebuffer(97, 61))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "boxes.ppm")
+        drawn.SavePPM(path)
+        with open(path, "rb") as file:
+            if file.read() != ppm:
+                raise AssertionError("Framebuffer saves a different PPM from the display's")
+        loaded = framebuffer.Framebuffer.LoadPPM(path)
+        if (loaded.width, loaded.height) != (97, 61) or loaded.pixels.ravel().tolist() != image.pixels:
+            raise AssertionError("PPM does not read back")
+        with open(path, "ab") as file:
+            file.write(b"\0")
+        try:
+            framebuffer.Framebuffer.LoadPPM(path)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError("a PPM with a byte past its pixels was loaded")
+        path = os.path.join(directory, "boxes.png")
+        drawn.SavePNG(path)
+        with open(path, "rb") as file:
+            if DecodePNG(file.read()) != (97, 61, expected_rows):
+                raise AssertionError("PNG does not decode to the framebuffer")
+    print(f"framebuffer: {len(LOOP_PROGRAMS) + 1} programs at {len(sizes)} sizes draw as Display does; PPM and PNG read back")
+
+
+def BenchFramebuffer():
+    if framebuffer.np is None:
+        print("framebuffer: skipped, numpy is not installed")
+        return
+    print("box-filling program, 60 frames (transpiled):")
+    code = transpiler.CompileProgram(BOX_PROGRAM)
+    for width, height in [(320, 240), (1280, 720)]:
+        times = []
+        for display_class in (PixelDisplay, bytecode.Display, framebuffer.Framebuffer):
+            if display_class is PixelDisplay and width > 320:
+                times.append(None)
+                continue
+            elapsed, _ = TimeIt(lambda: transpiler.Run(code, display_class(width, height)))
+            times.append(elapsed)
+        pixel, rows, array = times
+        print(f"  {width:5}x{height:<4} per pixel {'       -' if pixel is None else f'{pixel:7.3f}s'}  "
+              f"per row {rows:7.3f}s  numpy {array:7.3f}s  ({rows / array:5.1f}x per row)")
+
+BENCHMARKS = {
+    "lexer": BenchLexer,
+    "lexer-check": CheckLexerBackends,
+    "token-memory": BenchTokenMemory,
+    "keywords": BenchKeywords,
+    "relex-check": CheckRelex,
+    "relex": BenchRelex,
+    "parallel-check": CheckParallelLexer,
+    "parallel": BenchParallelLexer,
+    "expressions": BenchExpressions,
+    "nesting-check": CheckNesting,
+    "statements": BenchStatements,
+    "parser": BenchParser,
+    "recovery-check": CheckRecovery,
+    "ast-memory": BenchASTMemory,
+    "visitors": BenchVisitors,
+    "printer": BenchPrinter,
+    "serial-check": CheckSerialization,
+    "serial": BenchSerialization,
+    "cache-check": CheckCompileCache,
+    "cache": BenchCompileCache,
+    "semantic-check": CheckSemantics,
+    "semantic": BenchSemantics,
+    "fold-check": CheckFolding,
+    "fold": BenchFolding,
+    "bytecode-check": CheckBytecode,
+    "bytecode": BenchBytecode,
+    "python-check": CheckTranspiler,
+    "python": BenchTranspiler,
+    "framebuffer-check": CheckFramebuffer,
+    "framebuffer": BenchFramebuffer,
+}
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or list(BENCHMARKS):
+        BENCHMARKS[name]()
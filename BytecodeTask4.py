@@ -0,0 +1,508 @@
+import random
+import sys
+from array import array
+
+import ASTNodes as ast
+import ConstantFolding as folding
+import ParserTask2 as parser
+import SemanticTask3 as semantic
+
+# Opcodes. Every instruction is one opcode byte and one integer argument;
+# the ones that need no argument have 0.
+(LOAD_LOCAL, LOAD_CONST, STORE_LOCAL, JUMP_IF_FALSE, JUMP, ADD, SUB, MUL, DIV, LT, GT, LE, GE, EQ, NE,
+ AND, OR, LOAD_GLOBAL, STORE_GLOBAL, CALL, RETURN, NEG, NOT, PRINT, WIDTH, HEIGHT, RANDOM_INT, READ,
+ DELAY, WRITE, WRITE_BOX, HALT, INC_LOCAL, JUMP_IF_NOT_LT, BINARY_LOCAL, BINARY_CONST) = range(36)
+OPCODE_NAMES = ["LOAD_LOCAL", "LOAD_CONST", "STORE_LOCAL", "JUMP_IF_FALSE", "JUMP", "ADD", "SUB", "MUL", "DIV",
+                "LT", "GT", "LE", "GE", "EQ", "NE", "AND", "OR", "LOAD_GLOBAL", "STORE_GLOBAL", "CALL", "RETURN",
+                "NEG", "NOT", "PRINT", "WIDTH", "HEIGHT", "RANDOM_INT", "READ", "DELAY", "WRITE", "WRITE_BOX",
+                "HALT", "INC_LOCAL", "JUMP_IF_NOT_LT", "BINARY_LOCAL", "BINARY_CONST"]
+BINARY_OPCODES = {"+": ADD, "-": SUB, "*": MUL, "/": DIV, "<": LT, ">": GT, "<=": LE, ">=": GE,
+                  "==": EQ, "!=": NE, "and": AND, "or": OR}
+BUILTIN_OPCODES = {"__width": WIDTH, "__height": HEIGHT, "__random_int": RANDOM_INT, "__read": READ,
+                   "__delay": DELAY, "__write": WRITE, "__write_box": WRITE_BOX}
+# BINARY_LOCAL and BINARY_CONST apply OPERATIONS[arg & 15], the operation of
+# binary opcode ADD + (arg & 15), to the top of the stack and a local slot or
+# constant arg >> 4.
+OPERATIONS = [folding.BINARY_OPERATIONS[operator]
+              for operator, opcode in sorted(BINARY_OPCODES.items(), key=lambda item: item[1])]
+# Fused instructions pack two operands into one signed 32-bit argument:
+# INC_LOCAL a constant index in the top 15 bits over a slot in the low 16,
+# BINARY_LOCAL and BINARY_CONST a slot or constant index over 4 bits. Larger
+# operands are compiled unfused.
+INC_LOCAL_LIMIT = 1 << 15
+BINARY_OPERAND_LIMIT = 1 << 27
+DEFAULT_VALUES = {"int": 0, "float": 0.0, "bool": False, "colour": 0}
+
+
+class Display:
+    # What a program draws on, reads from and prints to. Pixels are colours
+    # as 0xRRGGBB integers, row by row (colour arithmetic that leaves 24 bits
+    # wraps); writes outside the display are dropped and reads outside it
+    # are black. __delay only adds up the time asked for, and __random_int
+    # draws from a generator seeded per display, so runs are repeatable.
+    def __init__(self, width=36, height=36, seed=0, stream=None):
+        self.width = width
+        self.height = height
+        self.pixels = [0] * (width * height)
+        self.random = random.Random(seed)
+        self.stream = stream
+        self.printed = []
+        self.delayed = 0
+
+    def Print(self, value):
+        text = ("true" if value else "false") if type(value) is bool else str(value)
+        self.printed.append(text)
+        if self.stream is not None:
+            self.stream.write(text + "\n")
+
+    def RandomInt(self, limit):
+        return self.random.randrange(limit) if limit > 0 else 0
+
+    def Read(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.pixels[y * self.width + x]
+        return 0
+
+    def Write(self, x, y, colour):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y * self.width + x] = colour & 0xFFFFFF
+
+    def WriteBox(self, x, y, width, height, colour):
+        left, right = max(x, 0), min(x + width, self.width)
+        for row in range(max(y, 0), min(y + height, self.height)):
+            start = row * self.width
+            self.pixels[start + left:start + right] = [colour & 0xFFFFFF] * max(right - left, 0)
+
+    def Delay(self, milliseconds):
+        self.delayed += milliseconds
+
+
+class Bytecode:
+    # Struct-of-arrays code: per instruction its opcode as one byte and its
+    # argument in a parallel array, plus a pool of constants (each distinct
+    # value once) and, per function, where its code starts, its frame size
+    # and how many parameters it takes. The program's own code starts at 0.
+    __slots__ = ("ops", "args", "constants", "constant_index", "functions", "global_size")
+
+    def __init__(self):
+        self.ops = array('B')
+        self.args = array('i')
+        self.constants = []
+        self.constant_index = {}
+        self.functions = []  # [entry, frame_size, param_count, name]
+        self.global_size = 0
+
+    def __len__(self):
+        return len(self.ops)
+
+    def Emit(self, opcode, arg=0):
+        self.ops.append(opcode)
+        self.args.append(arg)
+        return len(self.ops) - 1
+
+    def Constant(self, value):
+        # keeps True apart from 1 and 1.0, and -0.0 apart from 0.0
+        key = (float, repr(value)) if value.__class__ is float else (value.__class__, value)
+        index = self.constant_index.get(key)
+        if index is None:
+            index = self.constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def Disassemble(self):
+        entries = {function[0]: function[3] for function in self.functions}
+        lines = []
+        for pc, (opcode, arg) in enumerate(zip(self.ops, self.args)):
+            if pc in entries:
+                lines.append(f"{entries[pc]}:")
+            text = f"{pc:6}  {OPCODE_NAMES[opcode]:<15}"
+            if opcode == LOAD_CONST:
+                text += f" {self.constants[arg]!r}"
+            elif opcode == CALL:
+                text += f" {self.functions[arg][3]}"
+            elif opcode == INC_LOCAL:
+                text += f" {arg & 0xffff} += {self.constants[arg >> 16]!r}"
+            elif opcode == BINARY_LOCAL:
+                text += f" {OPCODE_NAMES[ADD + (arg & 15)]} {arg >> 4}"
+            elif opcode == BINARY_CONST:
+                text += f" {OPCODE_NAMES[ADD + (arg & 15)]} {self.constants[arg >> 4]!r}"
+            elif opcode not in (RETURN, HALT) and (arg or opcode in (LOAD_LOCAL, STORE_LOCAL, LOAD_GLOBAL, STORE_GLOBAL)):
+                text += f" {arg}"
+            lines.append(text.rstrip())
+        return "\n".join(lines)
+
+
+class BytecodeCompiler(ast.ASTVisitor, ast.ASTWalker):
+    # Compiles a tree that SemanticVisitor has checked, using the frames and
+    # slots it resolved: a variable is LOAD_LOCAL/STORE_LOCAL of a slot in
+    # the current frame (depth 0) or LOAD_GLOBAL/STORE_GLOBAL of a global
+    # read from a function (depth 1), and calls name their function by
+    # index. Code is emitted as the ASTWalker reaches it, so jumps are
+    # emitted with no target and patched once the target is known; the
+    # patch stack follows the nesting of the statements. The program's own
+    # statements come first and end in HALT, then each function, which
+    # returns its type's default value if it ends without a return.
+    # Dispatching an instruction costs far more than the work most of them
+    # do, so common sequences are fused: `x = x + c` for a local x and a
+    # numeric constant c becomes INC_LOCAL, a `<` condition ahead of its jump
+    # becomes JUMP_IF_NOT_LT, and an operator whose right operand is a local
+    # or a literal becomes BINARY_LOCAL or BINARY_CONST.
+    def __init__(self):
+        super().__init__()
+        self.name = "Bytecode Compiler"
+
+    def Compile(self, root):
+        if root.frame_size is None:
+            raise ValueError("compile a tree after SemanticVisitor has checked it")
+        self.code = Bytecode()
+        self.function_index = {}
+        self.patches = []
+        self.walk(root)
+        return self.code
+
+    def pre_visit(self, node):
+        self.handlers[node.kind](node)
+
+    def Emit(self, opcode, arg=0):
+        self.code.Emit(opcode, arg)
+
+    def EmitJump(self, opcode):
+        # A jump whose target is patched later.
+        self.patches.append(self.code.Emit(opcode, -1))
+
+    def Patch(self):
+        self.code.args[self.patches.pop()] = len(self.code)
+
+    def visit_program_node(self, node):
+        self.code.global_size = node.frame_size
+        functions = [statement for statement in node.blocks if type(statement) is ast.ASTFunctionDecNode]
+        for function in functions:
+            self.function_index[function.identifier] = len(self.code.functions)
+            self.code.functions.append([-1, function.frame_size, len(function.formal_params.params), function.identifier])
+        for statement in node.blocks:
+            if type(statement) is not ast.ASTFunctionDecNode:
+                self.Visit(statement)
+        self.Then(self.Emit, HALT)
+        for function in functions:
+            self.Visit(function)
+
+    def visit_function_dec_node(self, node):
+        self.Then(self.Enter, node)
+        self.Visit(node.block)
+        self.Then(self.Emit, LOAD_CONST, self.code.Constant(DEFAULT_VALUES[node.return_type]))
+        self.Then(self.Emit, RETURN)
+
+    def Enter(self, node):
+        self.code.functions[self.function_index[node.identifier]][0] = len(self.code)
+
+    def visit_block_node(self, node):
+        for statement in node.statements:
+            self.Visit(statement)
+
+    def visit_variable_declaration_node(self, node):
+        self.Visit(node.suffix)
+        self.Then(self.Emit, STORE_LOCAL, node.slot)
+
+    def visit_assignment_node(self, node):
+        target = node.id
+        expr = node.expr
+        if (target.depth == 0 and type(expr) is ast.ASTAdditiveOpNode and expr.operator in ("+", "-")
+                and type(expr.left) is ast.ASTIdentifierNode and expr.left.depth == 0 and expr.left.slot == target.slot
+                and type(expr.right) in (ast.ASTIntegerNode, ast.ASTFloatLiteralNode) and target.slot < 0x10000):
+            step = self.code.Constant(expr.right.value if expr.operator == "+" else -expr.right.value)
+            if step < INC_LOCAL_LIMIT:
+                self.Emit(INC_LOCAL, step << 16 | target.slot)
+                return
+        self.Visit(expr)
+        self.Then(self.Emit, STORE_LOCAL if target.depth == 0 else STORE_GLOBAL, target.slot)
+
+    def visit_print_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.Emit, PRINT)
+
+    def visit_return_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.Emit, RETURN)
+
+    def Condition(self, condition):
+        # Code that jumps to a patched target when condition is false.
+        if type(condition) is ast.ASTRelationalOpNode and condition.operator == "<":
+            self.Visit(condition.left)
+            self.Visit(condition.right)
+            self.Then(self.EmitJump, JUMP_IF_NOT_LT)
+        else:
+            self.Visit(condition)
+            self.Then(self.EmitJump, JUMP_IF_FALSE)
+
+    def visit_if_statement_node(self, node):
+        self.Condition(node.condition)
+        self.Visit(node.true_block)
+        if node.false_block:
+            self.Then(self.Else)
+            self.Visit(node.false_block)
+        self.Then(self.Patch)
+
+    def Else(self):
+        self.EmitJump(JUMP)  # out of the true block, over the else block
+        self.patches[-2], self.patches[-1] = self.patches[-1], self.patches[-2]
+        self.Patch()  # the condition jumps to the else block
+
+    def visit_while_statement_node(self, node):
+        self.Then(self.LoopStart)
+        self.Condition(node.condition)
+        self.Visit(node.block)
+        self.Then(self.LoopEnd)
+
+    def visit_for_statement_node(self, node):
+        if node.initialization:
+            self.Visit(node.initialization)
+        self.Then(self.LoopStart)
+        self.Condition(node.condition)
+        self.Visit(node.block)
+        if node.increment:
+            self.Visit(node.increment)
+        self.Then(self.LoopEnd)
+
+    def LoopStart(self):
+        self.patches.append(len(self.code))
+
+    def LoopEnd(self):
+        exit_jump = self.patches.pop()
+        self.Emit(JUMP, self.patches.pop())
+        self.patches.append(exit_jump)
+        self.Patch()
+
+    def visit_boolean_literal_node(self, node):
+        self.Emit(LOAD_CONST, self.code.Constant(node.value))
+
+    visit_integer_node = visit_boolean_literal_node
+    visit_float_literal_node = visit_boolean_literal_node
+
+    def visit_colour_literal_node(self, node):
+        self.Emit(LOAD_CONST, self.code.Constant(int(node.value[1:], 16)))
+
+    def visit_identifier_node(self, node):
+        self.Emit(LOAD_LOCAL if node.depth == 0 else LOAD_GLOBAL, node.slot)
+
+    def visit_variable_node(self, node):
+        self.Emit(LOAD_LOCAL if node.depth == 0 else LOAD_GLOBAL, node.slot)
+
+    def visit_sub_expression_node(self, node):
+        self.Visit(node.expression)
+
+    def visit_unary_node(self, node):
+        self.Visit(node.operand)
+        self.Then(self.Emit, NEG if node.operator == "-" else NOT)
+
+    def visit_binary_op_node(self, node):
+        self.Visit(node.left)
+        right = node.right
+        operation = BINARY_OPCODES[node.operator] - ADD
+        constant = None
+        if type(right) in (ast.ASTIntegerNode, ast.ASTFloatLiteralNode, ast.ASTBooleanLiteralNode):
+            constant = self.code.Constant(right.value)
+        elif type(right) is ast.ASTColourLiteralNode:
+            constant = self.code.Constant(int(right.value[1:], 16))
+        if constant is not None and constant < BINARY_OPERAND_LIMIT:
+            self.Then(self.Emit, BINARY_CONST, constant << 4 | operation)
+        elif (type(right) in (ast.ASTIdentifierNode, ast.ASTVariableNode) and right.depth == 0
+                and right.slot < BINARY_OPERAND_LIMIT):
+            self.Then(self.Emit, BINARY_LOCAL, right.slot << 4 | operation)
+        else:
+            self.Visit(right)
+            self.Then(self.Emit, ADD + operation)
+
+    visit_additive_op_node = visit_binary_op_node
+    visit_multiplicative_op_node = visit_binary_op_node
+    visit_relational_op_node = visit_binary_op_node
+
+    def visit_function_call_node(self, node):
+        for param in node.actual_params:
+            self.Visit(param)
+        if node.identifier in BUILTIN_OPCODES:
+            self.Then(self.Emit, BUILTIN_OPCODES[node.identifier])
+        else:
+            self.Then(self.Emit, CALL, self.function_index[node.identifier])
+
+    def visit_error_node(self, node):
+        raise ValueError("cannot compile a tree with syntax errors")
+
+
+class VM:
+    # Runs Bytecode in one dispatch loop: an operand stack, the frame of the
+    # running function (a list of its slots, the globals for the program's
+    # own code) and a stack of (return address, frame) for the calls in
+    # progress. The instructions that loops and calls spend their time in
+    # are tested inline, most frequent first; every other opcode indexes a
+    # list of handlers, so none is more than a dozen tests away.
+    def Run(self, code, display):
+        ops = code.ops
+        args = code.args
+        constants = code.constants
+        functions = code.functions
+        operations = OPERATIONS
+        global_frame = frame = [None] * code.global_size
+        stack = []
+        push = stack.append
+        pop = stack.pop
+        calls = []
+        handlers = self.Handlers(code, stack, global_frame, display)
+        pc = 0
+        while True:
+            op = ops[pc]
+            arg = args[pc]
+            pc += 1
+            if op == LOAD_LOCAL:
+                push(frame[arg])
+            elif op == BINARY_LOCAL:
+                stack[-1] = operations[arg & 15](stack[-1], frame[arg >> 4])
+            elif op == BINARY_CONST:
+                stack[-1] = operations[arg & 15](stack[-1], constants[arg >> 4])
+            elif op == LOAD_CONST:
+                push(constants[arg])
+            elif op == STORE_LOCAL:
+                frame[arg] = pop()
+            elif op == JUMP_IF_NOT_LT:
+                right = pop()
+                if not pop() < right:
+                    pc = arg
+            elif op == INC_LOCAL:
+                frame[arg & 0xffff] += constants[arg >> 16]
+            elif op == JUMP_IF_FALSE:
+                if not pop():
+                    pc = arg
+            elif op == JUMP:
+                pc = arg
+            elif op == CALL:
+                entry, size, count, name = functions[arg]
+                callee = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                if size > count:
+                    callee += [None] * (size - count)
+                calls.append((pc, frame))
+                frame = callee
+                pc = entry
+            elif op == RETURN:
+                pc, frame = calls.pop()
+            elif ADD <= op <= OR:
+                right = pop()
+                stack[-1] = operations[op - ADD](stack[-1], right)
+            else:
+                pc = handlers[op](arg, pc)
+                if pc < 0:
+                    return display
+
+    def Handlers(self, code, stack, global_frame, display):
+        # A function (arg, pc) -> next pc per opcode, for the ones Run does
+        # not test inline; HALT returns -1. They share Run's operand stack
+        # and never touch the frame, which calls and returns replace.
+        push = stack.append
+        pop = stack.pop
+
+        def LoadGlobal(arg, pc):
+            push(global_frame[arg])
+            return pc
+
+        def StoreGlobal(arg, pc):
+            global_frame[arg] = pop()
+            return pc
+
+        def Neg(arg, pc):
+            stack[-1] = -stack[-1]
+            return pc
+
+        def Not(arg, pc):
+            stack[-1] = not stack[-1]
+            return pc
+
+        def Write(arg, pc):
+            colour = pop()
+            y = pop()
+            display.Write(pop(), y, colour)
+            return pc
+
+        def WriteBox(arg, pc):
+            colour = pop()
+            height = pop()
+            width = pop()
+            y = pop()
+            display.WriteBox(pop(), y, width, height, colour)
+            return pc
+
+        def Read(arg, pc):
+            y = pop()
+            stack[-1] = display.Read(stack[-1], y)
+            return pc
+
+        def Width(arg, pc):
+            push(display.width)
+            return pc
+
+        def Height(arg, pc):
+            push(display.height)
+            return pc
+
+        def RandomInt(arg, pc):
+            stack[-1] = display.RandomInt(stack[-1])
+            return pc
+
+        def Delay(arg, pc):
+            display.Delay(pop())
+            return pc
+
+        def Print(arg, pc):
+            display.Print(pop())
+            return pc
+
+        def Halt(arg, pc):
+            return -1
+
+        def Bad(arg, pc):
+            raise ValueError(f"bad opcode {code.ops[pc - 1]} at {pc - 1}")
+
+        handlers = [Bad] * 256
+        handlers[LOAD_GLOBAL] = LoadGlobal
+        handlers[STORE_GLOBAL] = StoreGlobal
+        handlers[NEG] = Neg
+        handlers[NOT] = Not
+        handlers[WRITE] = Write
+        handlers[WRITE_BOX] = WriteBox
+        handlers[READ] = Read
+        handlers[WIDTH] = Width
+        handlers[HEIGHT] = Height
+        handlers[RANDOM_INT] = RandomInt
+        handlers[DELAY] = Delay
+        handlers[PRINT] = Print
+        handlers[HALT] = Halt
+        return handlers
+
+
+def CheckedTree(src_program_str, fold=True):
+    # Parse, check and fold a program for a backend; syntax errors raise
+    # SyntaxError, semantic errors a SyntaxError listing them all.
+    root = parser.Parser(src_program_str).Parse()
+    diagnostics = semantic.SemanticVisitor().Check(root)
+    if diagnostics:
+        raise SyntaxError("\n".join(diagnostic.message for diagnostic in diagnostics))
+    return folding.ConstantFolder().Fold(root) if fold else root
+
+
+def CompileSource(src_program_str, fold=True):
+    return BytecodeCompiler().Compile(CheckedTree(src_program_str, fold))
+
+
+if __name__ == "__main__":
+    code = CompileSource("""
+fun max(a : int, b : int) -> int {
+    if (a > b) { return a; } else { return b; }
+}
+let c : colour = #00ff7f;
+for (let i : int = 0; i < 10; i = i + 1) {
+    __write_box i, max(i, 3), 1, 1, c;
+    __delay 16;
+}
+__print max(__width, 7 * 6);
+""")
+    print(code.Disassemble())
+    display = VM().Run(code, Display(stream=sys.stdout))
+    print(f"delayed {display.delayed} ms")
@@ -0,0 +1,178 @@
+import hashlib
+import marshal
+import os
+import sys
+import threading
+
+import ASTNodes as ast
+import LexerTask1 as lex
+import ParserTask2 as parser
+
+try:
+    import fcntl
+except ImportError:  # no advisory locks; eviction is then best effort
+    fcntl = None
+
+
+def CompilerFingerprint():
+    # Hash of the lexer, parser and node sources, so entries written by any
+    # other version of the compiler are never read back.
+    digest = hashlib.sha256()
+    for module in (lex, parser, ast):
+        with open(module.__file__, "rb") as file:
+            digest.update(file.read())
+    return digest.hexdigest()
+
+
+def LoadMarshal(path):
+    with open(path, "rb") as file:
+        try:
+            return marshal.load(file)
+        except (EOFError, TypeError) as error:  # truncated or not marshal data
+            raise ValueError(f"{path}: {error}") from error
+
+
+def SaveMarshal(path, value):
+    with open(path, "wb") as file:
+        marshal.dump(value, file)
+
+
+class CompileCache:
+    # On-disk cache of token buffers, parsed ASTs and compiled code, shared by every build
+    # process using the same directory. An entry is named by the hash of the
+    # compiler fingerprint, what it holds (with the settings it was made with)
+    # and the source text, so a changed source or compiler simply misses.
+    # Entries are written to a temporary file and renamed into place, so a
+    # reader only ever sees complete files. Reading an entry touches its
+    # mtime, and when the directory grows past max_bytes the entries used
+    # least recently are deleted, under a lock so that concurrent builds do
+    # not evict twice. A process that has an AST mapped keeps it readable
+    # after deletion. Each cache keeps a running total of the directory's
+    # size and only counts it again when the directory has changed since it
+    # last looked, which other builds sharing it do.
+    fingerprint = None
+
+    def __init__(self, directory, max_bytes=256 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        if CompileCache.fingerprint is None:
+            CompileCache.fingerprint = CompilerFingerprint()
+        self.size = None  # bytes of entries in the directory, None until counted
+        self.stamp = None  # the directory's mtime when size was last right
+        self.hits = {"tokens": 0, "ast": 0, "code": 0}
+        self.misses = {"tokens": 0, "ast": 0, "code": 0}
+
+    def Path(self, kind, src_program_str, *settings):
+        digest = hashlib.sha256(f"{self.fingerprint}\0{kind}\0{settings!r}\0".encode())
+        digest.update(src_program_str.encode("utf-8", "surrogatepass"))
+        return os.path.join(self.directory, f"{digest.hexdigest()}.{kind}")
+
+    def Read(self, kind, path, load):
+        try:
+            value = load(path)
+        except (FileNotFoundError, ValueError):  # never written, evicted, or unreadable
+            self.misses[kind] += 1
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            pass
+        self.hits[kind] += 1
+        return value
+
+    def Write(self, path, save):
+        changed = os.stat(self.directory).st_mtime_ns != self.stamp  # by another build
+        try:
+            replaced = os.stat(path).st_size
+        except FileNotFoundError:
+            replaced = 0
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            save(temporary)
+            os.replace(temporary, path)
+        finally:
+            if os.path.exists(temporary):
+                os.remove(temporary)
+        if changed:
+            self.size = self.Entries()[1]
+        else:
+            self.size += os.stat(path).st_size - replaced
+        self.stamp = os.stat(self.directory).st_mtime_ns
+        if self.size > self.max_bytes:
+            self.Evict()
+
+    def Tokens(self, lexer, src_program_str):
+        # Lexer.GenerateTokenBuffer for a Lexer with this cache.
+        path = self.Path("tokens", src_program_str, lexer.skip_trivia, lexer.record_trivia, lexer.recover)
+        tokens = self.Read("tokens", path, lambda path: lex.TokenBuffer.Load(path, src_program_str))
+        if tokens is None:
+            tokens = lex.TokenBuffer(src_program_str)
+            lexer.ScanIntoBuffer(tokens, 0)
+            self.Write(path, tokens.Save)
+        return tokens
+
+    def LoadAST(self, src_program_str):
+        # The AST of a source parsed before, as a read-only ASTStore mapped
+        # from the cache (its last node is the program), or None.
+        return self.Read("ast", self.Path("ast", src_program_str), ast.ASTStore.Load)
+
+    def SaveAST(self, src_program_str, store):
+        # The store's last node must be the program. Parser only saves ASTs of
+        # sources that parsed without errors, so a cached AST never needs
+        # diagnostics to go with it.
+        self.Write(self.Path("ast", src_program_str), store.Save)
+
+    def LoadCode(self, src_program_str, *settings):
+        # A Python code object a backend compiled from this source before, or
+        # None. marshal's format belongs to the interpreter version, which is
+        # part of the entry's name; settings must name the backend and
+        # everything it depends on beyond the fingerprint.
+        path = self.Path("code", src_program_str, sys.implementation.cache_tag, *settings)
+        return self.Read("code", path, LoadMarshal)
+
+    def SaveCode(self, src_program_str, code, *settings):
+        path = self.Path("code", src_program_str, sys.implementation.cache_tag, *settings)
+        self.Write(path, lambda path: SaveMarshal(path, code))
+
+    def Entries(self):
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as scan:
+            for entry in scan:
+                if entry.name.endswith((".tokens", ".ast", ".code")):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+        return entries, total
+
+    def Evict(self):
+        with open(os.path.join(self.directory, "lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            entries, total = self.Entries()  # again, now that no other build is evicting
+            entries.sort()
+            for mtime, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            self.size = total
+            self.stamp = os.stat(self.directory).st_mtime_ns
+
+    def Report(self):
+        # Hits and misses per kind of entry since this cache was opened.
+        lines = []
+        for kind in self.hits:
+            lookups = self.hits[kind] + self.misses[kind]
+            if not lookups:
+                continue
+            rate = 100 * self.hits[kind] / lookups if lookups else 0
+            lines.append(f"{kind}: {self.hits[kind]} hits, {self.misses[kind]} misses ({rate:.0f}% from cache)")
+        return "\n".join(lines)
@@ -0,0 +1,197 @@
+import operator
+
+import ASTNodes as ast
+import ParserTask2 as parser
+
+
+def Divide(left, right):
+    # Integer division truncates towards zero; float division is IEEE.
+    if type(left) is int:
+        quotient = abs(left) // abs(right)
+        return quotient if (left < 0) == (right < 0) else -quotient
+    return left / right
+
+
+# What every binary operator computes on the values of its operands, for
+# anything that evaluates PArL expressions.
+BINARY_OPERATIONS = {
+    "+": operator.add, "-": operator.sub, "*": operator.mul, "/": Divide,
+    "and": lambda left, right: left and right, "or": lambda left, right: left or right,
+    "<": operator.lt, ">": operator.gt, "<=": operator.le, ">=": operator.ge,
+    "==": operator.eq, "!=": operator.ne,
+}
+UNARY_OPERATIONS = {"-": operator.neg, "not": operator.not_}
+LITERAL_CLASSES = {int: ast.ASTIntegerNode, float: ast.ASTFloatLiteralNode, bool: ast.ASTBooleanLiteralNode}
+# The fields of each node class that hold children, by kind.
+CHILD_FIELDS = [tuple((field, shape) for field, shape in node_class.fields if shape is not ast.VALUE)
+                for node_class in ast.NODE_CLASSES]
+
+
+class ConstantFolder(ast.ASTWalker):
+    # Rewrites a type-checked tree in place, children before parents:
+    # - operators whose operands are int, float or bool literals become the
+    #   literal they compute (never a division by zero, which is left to
+    #   fail at run time), and brackets are dropped
+    # - x + 0, x - 0, 0 + x (ints), x * 1, 1 * x, x / 1 become x; x and true,
+    #   true and x, x or false, false or x become x; x and false,
+    #   false and x become false, and x or true, true or x become true, when
+    #   evaluating x can neither have an effect nor fail (see Pure)
+    # - if statements with a literal condition become the block that runs
+    #   (or nothing), and while loops that never run are removed
+    # Variable nodes are kept as they are, with their resolved slots.
+    def __init__(self):
+        self.folded = 0  # operators and statements replaced
+        self.removed = 0  # nodes in the tree before folding less those after
+
+    def Fold(self, root):
+        self.walk(root)
+        return self.Simplify(root)
+
+    def post_visit(self, node):
+        # The node's children are simplified already; now replace each by
+        # its simplified form. Statements that simplify to nothing are
+        # dropped from their list.
+        for field, shape in CHILD_FIELDS[node.kind]:
+            if shape is ast.NODE:
+                child = getattr(node, field)
+                if child is not None:
+                    setattr(node, field, self.Simplify(child))
+            else:
+                children = getattr(node, field)
+                if children:
+                    simplified = [self.Simplify(child) for child in children]
+                    setattr(node, field, [child for child in simplified if child is not None])
+
+    def Simplify(self, node):
+        simplify = self.simplifiers.get(type(node))
+        return node if simplify is None else simplify(self, node)
+
+    def Size(self, node):
+        # Nodes in the subtree under node, for counting what a rewrite drops.
+        count = 0
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children())
+        return count
+
+    def Literal(self, node):
+        # The node itself if it is an int, float or bool literal, else None.
+        if type(node) in (ast.ASTIntegerNode, ast.ASTFloatLiteralNode, ast.ASTBooleanLiteralNode):
+            return node
+        return None
+
+    def Pure(self, node):
+        # Whether evaluating node can be skipped without anyone noticing: it
+        # reads only literals and variables, calls nothing, and cannot fail,
+        # so every division in it is by a non-zero literal.
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            node_class = type(node)
+            if node_class in self.pure_classes:
+                if node_class is ast.ASTMultiplicativeOpNode and node.operator == "/":
+                    divisor = self.Literal(node.right)
+                    if divisor is None or not divisor.value:
+                        return False
+                stack.extend(node.children())
+            elif node_class not in self.value_classes:
+                return False
+        return True
+
+    value_classes = frozenset([ast.ASTIntegerNode, ast.ASTFloatLiteralNode, ast.ASTBooleanLiteralNode,
+                               ast.ASTColourLiteralNode, ast.ASTIdentifierNode, ast.ASTVariableNode])
+    pure_classes = frozenset([ast.ASTSubExpressionNode, ast.ASTUnaryNode, ast.ASTAdditiveOpNode,
+                              ast.ASTMultiplicativeOpNode, ast.ASTRelationalOpNode])
+
+    def SimplifySubExpression(self, node):
+        self.folded += 1
+        self.removed += 1
+        return node.expression
+
+    def SimplifyUnary(self, node):
+        operand = self.Literal(node.operand)
+        if operand is None:
+            return node
+        self.folded += 1
+        self.removed += 1  # the operator and its operand become one literal
+        value = UNARY_OPERATIONS[node.operator](operand.value)
+        return LITERAL_CLASSES[type(value)](value)
+
+    def SimplifyBinary(self, node):
+        left, right = self.Literal(node.left), self.Literal(node.right)
+        operator = node.operator
+        if left is not None and right is not None:
+            if type(left.value) is not type(right.value) or (operator == "/" and not right.value):
+                return node
+            self.folded += 1
+            self.removed += 2
+            value = BINARY_OPERATIONS[operator](left.value, right.value)
+            return LITERAL_CLASSES[type(value)](value)
+        literal, other = (left, node.right) if left is not None else (right, node.left)
+        if literal is None:
+            return node
+        value = literal.value
+        if type(value) is bool:
+            if operator not in ("and", "or"):
+                return node
+            if (operator == "and") == value:  # x and true, x or false
+                self.folded += 1
+                self.removed += 2
+                return other
+            if self.Pure(other):  # x and false, x or true
+                self.folded += 1
+                self.removed += 1 + self.Size(other)
+                return literal
+            return node
+        if value == 0 and type(value) is int and (operator == "+" or (operator == "-" and literal is right)):
+            self.folded += 1
+            self.removed += 2
+            return other
+        if value == 1 and (operator == "*" or (operator == "/" and literal is right)):
+            self.folded += 1
+            self.removed += 2
+            return other
+        return node
+
+    def SimplifyIf(self, node):
+        condition = self.Literal(node.condition)
+        if condition is None:
+            return node
+        self.folded += 1
+        kept, dropped = (node.true_block, node.false_block) if condition.value else (node.false_block, node.true_block)
+        self.removed += 2 + (self.Size(dropped) if dropped is not None else 0)
+        return kept
+
+    def SimplifyWhile(self, node):
+        condition = self.Literal(node.condition)
+        if condition is None or condition.value:
+            return node
+        self.folded += 1
+        self.removed += self.Size(node)
+        return None
+
+    simplifiers = {
+        ast.ASTSubExpressionNode: SimplifySubExpression,
+        ast.ASTUnaryNode: SimplifyUnary,
+        ast.ASTAdditiveOpNode: SimplifyBinary,
+        ast.ASTMultiplicativeOpNode: SimplifyBinary,
+        ast.ASTRelationalOpNode: SimplifyBinary,
+        ast.ASTIfStatementNode: SimplifyIf,
+        ast.ASTWhileStatementNode: SimplifyWhile,
+    }
+
+
+if __name__ == "__main__":
+    program = parser.Parser("""
+let w : int = __width / 2 * 3;
+let x : int = (10 - 4) * 2 + w * 1 + 0;
+let debug : bool = not true;
+if ((1 < 2) and debug) { __print 0; } else { __print x / 1; }
+while (false) { __delay 1000; }
+""").Parse()
+    folder = ConstantFolder()
+    program = folder.Fold(program)
+    program.accept(ast.PrintNodesVisitor())
+    print(f"{folder.folded} operators and statements folded, {folder.removed} nodes removed")
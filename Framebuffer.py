@@ -0,0 +1,127 @@
+import re
+import struct
+import sys
+import zlib
+
+import BytecodeTask4 as bytecode
+import Transpiler as transpiler
+
+try:
+    import numpy as np
+except ImportError:  # Framebuffer needs numpy; bytecode.Display and the encoders do not
+    np = None
+
+# A binary 8-bit PPM header as EncodePPM writes it: no comments, and exactly
+# one whitespace byte between the maxval and the pixels.
+PPM_HEADER = re.compile(rb"P6\s+(\d+)\s+(\d+)\s+255\s")
+
+
+def RGBBytes(pixels):
+    # Packed 0xRRGGBB colours, as a Display holds them, as RGB bytes.
+    return b"".join(colour.to_bytes(3, "big") for colour in pixels)
+
+
+def EncodePPM(width, height, rgb):
+    return f"P6\n{width} {height}\n255\n".encode("ascii") + rgb
+
+
+def DecodePPM(data):
+    # The width, height and RGB bytes of a PPM EncodePPM wrote; anything else,
+    # including pixels short of or beyond width x height, is a ValueError.
+    header = PPM_HEADER.match(data)
+    if header is None:
+        raise ValueError("not a binary 8-bit PPM")
+    width, height = int(header[1]), int(header[2])
+    rgb = data[header.end():]
+    if len(rgb) != width * height * 3:
+        raise ValueError(f"{width}x{height} PPM with {len(rgb)} bytes of pixels, not {width * height * 3}")
+    return width, height, rgb
+
+
+def EncodePNG(width, height, rgb):
+    # 8-bit RGB, every row with filter type 0, in a single IDAT chunk.
+    def Chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    stride = width * 3
+    rows = b"".join(b"\0" + rgb[start:start + stride] for start in range(0, height * stride, stride))
+    return (b"\x89PNG\r\n\x1a\n" + Chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + Chunk(b"IDAT", zlib.compress(rows, 6)) + Chunk(b"IEND", b""))
+
+
+class Framebuffer(bytecode.Display):
+    # A Display whose pixels are a height x width numpy uint32 array of
+    # packed 0xRRGGBB colours, so that __write_box is one slice assignment
+    # however large the box. Colour literals reach it already packed: the
+    # bytecode compiler and the transpiler decode them once, at compile
+    # time. Printing, delays and random numbers are Display's.
+    def __init__(self, width=36, height=36, seed=0, stream=None):
+        if np is None:
+            raise ImportError("Framebuffer needs numpy")
+        super().__init__(width, height, seed, stream)
+        self.pixels = np.zeros((height, width), dtype=np.uint32)
+
+    def Read(self, x, y):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return int(self.pixels[y, x])
+        return 0
+
+    def Write(self, x, y, colour):
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.pixels[y, x] = colour & 0xFFFFFF
+
+    def WriteBox(self, x, y, width, height, colour):
+        # Negative starts would wrap around in a slice, so clip first.
+        if width > 0 and height > 0:
+            self.pixels[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)] = colour & 0xFFFFFF
+
+    def Clear(self, colour=0):
+        self.pixels.fill(colour & 0xFFFFFF)
+
+    def RGB(self):
+        # The pixels as a height x width x 3 array of bytes.
+        rgb = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        rgb[..., 0] = self.pixels >> 16
+        rgb[..., 1] = self.pixels >> 8
+        rgb[..., 2] = self.pixels
+        return rgb
+
+    def SavePPM(self, path):
+        with open(path, "wb") as file:
+            file.write(EncodePPM(self.width, self.height, self.RGB().tobytes()))
+
+    @classmethod
+    def LoadPPM(cls, path):
+        # A Framebuffer holding an image SavePPM wrote, for comparing a
+        # program's output with a saved one.
+        with open(path, "rb") as file:
+            data = file.read()
+        try:
+            width, height, pixels = DecodePPM(data)
+        except ValueError as error:
+            raise ValueError(f"{path}: {error}") from error
+        rgb = np.frombuffer(pixels, dtype=np.uint8).reshape(height, width, 3).astype(np.uint32)
+        framebuffer = cls(width, height)
+        framebuffer.pixels[...] = rgb[..., 0] << 16 | rgb[..., 1] << 8 | rgb[..., 2]
+        return framebuffer
+
+    def SavePNG(self, path):
+        with open(path, "wb") as file:
+            file.write(EncodePNG(self.width, self.height, self.RGB().tobytes()))
+
+
+if __name__ == "__main__":
+    src = """
+let w : int = __width;
+let h : int = __height;
+for (let frame : int = 0; frame < 8; frame = frame + 1) {
+    __write_box 0, 0, w, h, #202040;
+    __write_box frame * 8, frame * 4, w / 2, h / 2, #ffcc00;
+    __write w - 1, h - 1, #ff0000;
+    __delay 16;
+}
+__print __read w - 1, h - 1;
+"""
+    framebuffer = transpiler.Run(transpiler.CompileProgram(src), Framebuffer(320, 240, stream=sys.stdout))
+    framebuffer.SavePNG("framebuffer.png")
+    framebuffer.SavePPM("framebuffer.ppm")
+    print(f"320x240 written to framebuffer.png and framebuffer.ppm, delayed {framebuffer.delayed} ms")
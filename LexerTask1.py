@@ -1,3 +1,11 @@
+import json
+import re
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from enum import Enum
 
 class TokenType(Enum):
@@ -35,28 +43,162 @@ class TokenType(Enum):
     else_keyword = 32
     void = 33
     end = 34
+    arrow = 35
+    colour_literal = 36
+
+TOKEN_TYPES = {token_type.value: token_type for token_type in TokenType}
+# Kinds whose lexemes are names; these are interned when read back
+NAME_KINDS = frozenset([TokenType.identifier.value, TokenType.Keyword.value, TokenType.type.value])
 
 class Token:
-    def __init__(self, t, l):
+    __slots__ = ("type", "lexeme", "start")
+
+    def __init__(self, t, l, start=-1):
         self.type = t
         self.lexeme = l
+        self.start = start  # offset of the first character in the source, -1 if unknown
+
+class Diagnostic:
+    # A recoverable error: where it starts in the source, the offending text
+    # and a readable message.
+    __slots__ = ("offset", "text", "message")
+
+    def __init__(self, offset, text, message):
+        self.offset = offset
+        self.text = text
+        self.message = message
+
+class SourceMap:
+    # Offsets of every newline in a source, collected once per file. Token
+    # offsets are turned into 1-based (line, column) pairs only when asked,
+    # by binary search, so the lexer itself never counts lines.
+    __slots__ = ("newlines",)
+
+    def __init__(self, src_program_str):
+        self.newlines = array('I', [match.start() for match in re.finditer("\n", src_program_str)])
+
+    def LineColumn(self, offset):
+        line = bisect_left(self.newlines, offset)
+        line_start = self.newlines[line - 1] + 1 if line > 0 else 0
+        return line + 1, offset - line_start + 1
+
+class TokenBuffer:
+    # Struct-of-arrays token storage: per token, the TokenType value as one
+    # byte plus start/end offsets into the source. Token objects and lexeme
+    # strings are only created when a token is read back.
+    __slots__ = ("src_program_str", "kinds", "starts", "ends", "trivia_starts", "trivia_ends", "diagnostics")
+
+    def __init__(self, src_program_str):
+        self.src_program_str = src_program_str
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        # Offsets of the whitespace and comments dropped by a Lexer with
+        # skip_trivia and record_trivia set, for exact source reconstruction.
+        self.trivia_starts = array('I')
+        self.trivia_ends = array('I')
+        self.diagnostics = []  # lexical errors skipped by a Lexer with recover set
+
+    def append(self, token_type, start, end):
+        self.kinds.append(token_type.value)
+        self.starts.append(start)
+        self.ends.append(end)
+
+    def append_trivia(self, start, end):
+        self.trivia_starts.append(start)
+        self.trivia_ends.append(end)
+
+    def type(self, index):
+        return TOKEN_TYPES[self.kinds[index]]
+
+    def lexeme(self, index):
+        lexeme = self.src_program_str[self.starts[index]:self.ends[index]]
+        if self.kinds[index] in NAME_KINDS:
+            lexeme = sys.intern(lexeme)
+        return lexeme
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def __getitem__(self, index):
+        return Token(TOKEN_TYPES[self.kinds[index]], self.lexeme(index), self.starts[index])
+
+    # File layout, little-endian: the header, the start and end offsets of
+    # every token, the trivia offsets, one kind byte per token and the
+    # diagnostics as JSON. The source itself is not saved.
+    HEADER = struct.Struct("<8sIII")
+    MAGIC = b"PArLTOK1"
+
+    def Save(self, path):
+        diagnostics = json.dumps([(d.offset, d.text, d.message) for d in self.diagnostics]).encode()
+        with open(path, "wb") as file:
+            file.write(self.HEADER.pack(self.MAGIC, len(self.kinds), len(self.trivia_starts), len(diagnostics)))
+            for offsets in (self.starts, self.ends, self.trivia_starts, self.trivia_ends):
+                if sys.byteorder == "big":
+                    offsets = array('I', offsets)
+                    offsets.byteswap()
+                file.write(offsets.tobytes())
+            file.write(self.kinds.tobytes())
+            file.write(diagnostics)
+
+    @classmethod
+    def Load(cls, path, src_program_str):
+        # The buffer saved in path, over the source it was lexed from.
+        with open(path, "rb") as file:
+            data = file.read()
+        if len(data) < cls.HEADER.size:
+            raise ValueError(f"{path} is not a saved token buffer")
+        magic, token_count, trivia_count, diagnostics_size = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC:
+            raise ValueError(f"{path} is not a saved token buffer")
+        if len(data) != cls.HEADER.size + 9 * token_count + 8 * trivia_count + diagnostics_size:
+            raise ValueError(f"{path} is truncated or damaged")
+        tokens = cls(src_program_str)
+        position = cls.HEADER.size
+        for offsets, count in ((tokens.starts, token_count), (tokens.ends, token_count),
+                               (tokens.trivia_starts, trivia_count), (tokens.trivia_ends, trivia_count)):
+            offsets.frombytes(data[position:position + 4 * count])
+            if sys.byteorder == "big":
+                offsets.byteswap()
+            position += 4 * count
+        tokens.kinds.frombytes(data[position:position + token_count])
+        position += token_count
+        tokens.diagnostics = [Diagnostic(*fields) for fields in json.loads(data[position:position + diagnostics_size])]
+        return tokens
 
 class Lexer:
-    def __init__(self):
+    def __init__(self, backend="compiled", skip_trivia=False, record_trivia=False, recover=False, cache=None):
+        # "table" walks Tx through CatChar, "compiled" uses the flat tables,
+        # "regex" scans the whole source with one master regular expression
+        self.backend = backend
+        # Drop whitespace and comment tokens while scanning; with record_trivia
+        # GenerateTokenBuffer keeps their offsets in a side table instead.
+        self.skip_trivia = skip_trivia
+        self.record_trivia = record_trivia
+        # Keep scanning after a lexical error instead of stopping on a void
+        # token; the skipped text is reported in self.diagnostics (or in
+        # TokenBuffer.diagnostics for the buffer-producing methods).
+        self.recover = recover
+        self.diagnostics = []
+        # A CompileCache: token buffers of sources lexed before with the same
+        # settings are read back from it instead of scanned again.
+        self.cache = cache
         self.lexeme_list = ["letter", "digit", "ws", "bool", "int", "float", "char", "fun", "equal", "true", "false", "colour", "hex", "close_curly", "open_curly", "colon", "semicolon", "comma",
                             "open_bracket", "close_bracket", "open_par", "fullstop", "close_par", "else", "for", "if", "return",
                             "while", "let", "line_comment", "__height", "__width", "__read", "__print", "__delay", "__random_int", "greater_then",
                             "smaller_then", "greater_or_equal_to", "smaller_or_equal_to", "not_equal_to", "equal_to", "plus", "minus", "or", "multiplication",
-                            "division", "and", ".", "Underscore", "Double_Underscore", "open_square_bracket", "close_square_bracket", "type", "exclamation_mark", "as", "equals", "hashtag"]
+                            "division", "and", ".", "Underscore", "Double_Underscore", "open_square_bracket", "close_square_bracket", "type", "exclamation_mark", "as", "equals", "hashtag", "other", "newline"]
 
-        self.states_list = [0, 1, 2, 3, 4, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35]
-        self.states_accp = [1, 3, 4, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 28, 27, 29, 30, 31, 32, 33, 34, 35]
+        self.states_list = [0, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 26, 27, 28, 29, 30, 31, 32, 33, 34, 35]
+        self.states_accp = [1, 3, 4, 7, 8, 9, 10, 11, 12, 13, 14, 15, 16, 17, 18, 19, 20, 21, 22, 23, 24, 25, 28, 27, 29, 30, 31, 32, 33, 35]
 
         self.rows = len(self.states_list)
         self.cols = len(self.lexeme_list)
 
         self.Tx = [[-1 for j in range(self.cols)] for i in range(self.rows)]
         self.InitializeTxTable()
+        self.CompileTables()
+        self.CompileScanner()
 
     def InitializeTxTable(self):
         # Update Tx to represent the state transition function of the DFA
@@ -76,6 +218,8 @@ class Lexer:
         # State 4
         self.Tx[0][self.lexeme_list.index("letter")] = 4
         self.Tx[4][self.lexeme_list.index("letter")] = 4
+        self.Tx[4][self.lexeme_list.index("digit")] = 4
+        self.Tx[4][self.lexeme_list.index("Underscore")] = 4
 
         # State 5
         self.Tx[0][self.lexeme_list.index("Underscore")] = 5
@@ -124,62 +268,141 @@ class Lexer:
         # State 19
         self.Tx[0][self.lexeme_list.index("ws")] = 19
         self.Tx[19][self.lexeme_list.index("ws")] = 19
+        self.Tx[0][self.lexeme_list.index("newline")] = 19
+        self.Tx[19][self.lexeme_list.index("newline")] = 19
 
         # State 20
         self.Tx[0][self.lexeme_list.index("multiplication")] = 20
 
         # State 21
         self.Tx[0][self.lexeme_list.index("division")] = 21
-        self.Tx[21][self.lexeme_list.index("digit")] = 21
 
-        # State 33
+        # State 33: a // comment runs up to the end of the line
         self.Tx[21][self.lexeme_list.index("division")] = 33
-        self.Tx[33][self.lexeme_list.index("digit")] = 33
-        self.Tx[33][self.lexeme_list.index("letter")] = 33
+        for cat in self.lexeme_list:
+            if cat != "newline":
+                self.Tx[33][self.lexeme_list.index(cat)] = 33
 
         # State 22
         self.Tx[0][self.lexeme_list.index("plus")] = 22
 
         # State 23
         self.Tx[0][self.lexeme_list.index("minus")] = 23
-        self.Tx[23][self.lexeme_list.index("digit")] = 23
 
         # State 32
         self.Tx[23][self.lexeme_list.index("greater_then")] = 32
-        self.Tx[32][self.lexeme_list.index("digit")] = 32
 
         # State 24
         self.Tx[0][self.lexeme_list.index("greater_then")] = 24
-        self.Tx[24][self.lexeme_list.index("digit")] = 24
 
         # State 30
         self.Tx[24][self.lexeme_list.index("equals")] = 30
-        self.Tx[30][self.lexeme_list.index("digit")] = 30
 
         # State 25
         self.Tx[0][self.lexeme_list.index("smaller_then")] = 25
-        self.Tx[25][self.lexeme_list.index("digit")] = 25
 
         # State 31
         self.Tx[25][self.lexeme_list.index("equals")] = 31
-        self.Tx[31][self.lexeme_list.index("digit")] = 31
 
         # State 26
         self.Tx[0][self.lexeme_list.index("exclamation_mark")] = 26
 
         # State 29
         self.Tx[26][self.lexeme_list.index("equals")] = 29
-        self.Tx[29][self.lexeme_list.index("digit")] = 29
 
         # State 27
         self.Tx[0][self.lexeme_list.index("equals")] = 27
-        self.Tx[27][self.lexeme_list.index("digit")] = 27
 
         #State 28
         self.Tx[27][self.lexeme_list.index("equals")] = 28
-        self.Tx[28][self.lexeme_list.index("digit")] = 28
-
 
+        # State 34
+        self.Tx[0][self.lexeme_list.index("hashtag")] = 34
+
+        # State 35: TokenTypeByFinalState checks for exactly six hex digits
+        self.Tx[34][self.lexeme_list.index("letter")] = 35
+        self.Tx[34][self.lexeme_list.index("digit")] = 35
+        self.Tx[35][self.lexeme_list.index("letter")] = 35
+        self.Tx[35][self.lexeme_list.index("digit")] = 35
+
+    def CompileTables(self):
+        # Flatten Tx into one list indexed by state * cols + column and
+        # precompute the column of every Latin-1 character, so the compiled
+        # NextToken path does no CatChar chain or list scan per character.
+        self.tx_flat = [next_state for row in self.Tx for next_state in row]
+        self.char_class = [self.lexeme_list.index(self.CatChar(chr(code))) for code in range(256)]
+        self.unicode_class = {}  # filled lazily for characters above U+00FF
+        self.accepting = bytearray(max(self.states_accp) + 1)
+        for state in self.states_accp:
+            self.accepting[state] = 1
+        self.trivia_states = frozenset([19, 33])  # whitespace and // comments
+        self.InitializeTokenTypes()
+
+    def CharClass(self, character):
+        code = ord(character)
+        if code < 256:
+            return self.char_class[code]
+        column = self.unicode_class.get(character)
+        if column is None:
+            column = self.lexeme_list.index(self.CatChar(character))
+            self.unicode_class[character] = column
+        return column
+
+    def ClassPattern(self, *categories):
+        # Regex character class for the ASCII characters CatChar puts in any of
+        # the given categories, read off the compiled char_class table.
+        columns = [self.lexeme_list.index(cat) for cat in categories]
+        chars = [chr(code) for code in range(128) if self.char_class[code] in columns]
+        return "[" + "".join(re.escape(ch) for ch in chars) + "]"
+
+    def CompileScanner(self):
+        # One named group per accepting state of the DFA. A state is listed
+        # before the shorter state it extends (float before int, comment
+        # before division, ...), so leftmost-first alternation picks the
+        # same longest match as the DFA.
+        C = self.ClassPattern
+        L, D, EQ = C("letter"), C("digit"), C("equals")
+        rules = [
+            (3, f"{D}+{C('fullstop')}{D}+"),
+            (1, f"{D}+"),
+            (4, f"{L}{C('letter', 'digit', 'Underscore')}*"),
+            (35, f"{C('hashtag')}{C('letter', 'digit')}+"),
+            (7, f"{C('Underscore')}{{2}}{L}{C('letter', 'Underscore')}*"),
+            (8, C("open_curly")),
+            (9, C("close_curly")),
+            (10, C("colon")),
+            (11, C("semicolon")),
+            (12, C("comma")),
+            (13, C("open_bracket")),
+            (14, C("close_bracket")),
+            (17, C("open_square_bracket")),
+            (18, C("close_square_bracket")),
+            (19, f"{C('ws', 'newline')}+"),
+            (20, C("multiplication")),
+            (33, f"{C('division')}{{2}}[^\\n]*"),
+            (21, C("division")),
+            (22, C("plus")),
+            (32, f"{C('minus')}{C('greater_then')}"),
+            (23, C("minus")),
+            (30, f"{C('greater_then')}{EQ}"),
+            (24, C("greater_then")),
+            (31, f"{C('smaller_then')}{EQ}"),
+            (25, C("smaller_then")),
+            (29, f"{C('exclamation_mark')}{EQ}"),
+            (28, f"{EQ}{EQ}"),
+            (27, EQ),
+        ]
+        self.scanner_re = re.compile("|".join(f"(?P<s{state}>{pattern})" for state, pattern in rules))
+        self.scanner_states = {f"s{state}": state for state, pattern in rules}
+        # The prefixes the DFA can consume from state 0 without ever reaching
+        # an accepting state ("_", "__", "!" and "#"); a lexical error is
+        # reported on the character that follows them, as in NextToken.
+        self.scanner_error_re = re.compile(f"{C('Underscore')}{{1,2}}|{C('exclamation_mark')}|{C('hashtag')}")
+        # The regex only sees ASCII; every other character is replaced by an
+        # ASCII character of the same category before scanning.
+        self.scanner_stand_in = {}
+        for code in range(127, -1, -1):
+            self.scanner_stand_in[self.char_class[code]] = chr(code)
 
     def AcceptingStates(self, state):
         try:
@@ -188,107 +411,75 @@ class Lexer:
         except ValueError:
             return False
 
-    def GetTokenTypeByFinalState(self, state, lexeme):
-        if state == 1:
-            return Token(TokenType.integer_literal, lexeme)
-        elif state == 3:
-            return Token(TokenType.float_literal, lexeme)
-        elif state == 4:
-            if lexeme == "int" : return Token(TokenType.type, lexeme)
-            if lexeme in ["bool"]: return Token(TokenType.type, lexeme)
-            if lexeme in ["char"]: return Token(TokenType.type, lexeme)
-            if lexeme in ["fun"]: return Token(TokenType.type, lexeme)
-            if lexeme in ["float"]: return Token(TokenType.type, lexeme)
-            if lexeme in ["colour"]: return Token(TokenType.type, lexeme)
-            if lexeme in ["or"]: return Token(TokenType.MultiplicativeOp, lexeme)
-            if lexeme in ["for"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["if"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["while"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["for"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["return"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["else"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["let"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["as"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["true"]: return Token(TokenType.bool, lexeme)
-            if lexeme in ["false"]: return Token(TokenType.bool, lexeme)
-            return Token(TokenType.identifier, lexeme)
-        elif state == 7:
-            if lexeme in ["__width"] : return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__height"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__read"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__random_int"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__print"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__delay"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__write_box"]: return Token(TokenType.Keyword, lexeme)
-            if lexeme in ["__write"]: return Token(TokenType.Keyword, lexeme)
-            return Token(TokenType.void, lexeme)
-        elif state == 8:
-            return Token(TokenType.open_curly, lexeme)
-        elif state == 9:
-            return Token(TokenType.close_curly, lexeme)
-        elif state == 10:
-            return Token(TokenType.colon, lexeme)
-        elif state == 11:
-            return Token(TokenType.semicolon, lexeme)
-        elif state == 12:
-            return Token(TokenType.comma, lexeme)
-        elif state == 13:
-            return Token(TokenType.open_bracket, lexeme)
-        elif state == 14:
-            return Token(TokenType.close_bracket, lexeme)
-        elif state == 15:
-            return Token(TokenType.open_par, lexeme)
-        elif state == 16:
-            return Token(TokenType.close_par, lexeme)
-        elif state == 17:
-            return Token(TokenType.open_square_bracket, lexeme)
-        elif state == 18:
-            return Token(TokenType.close_square_bracket, lexeme)
-        elif state == 19:
-            return Token(TokenType.whitespace, lexeme)
-        elif state == 20:
-            return Token(TokenType.MultiplicativeOp, lexeme)
-        elif state == 21:
-            return Token(TokenType.MultiplicativeOp, lexeme)
-        elif state == 22:
-            return Token(TokenType.AdditiveOp, lexeme)
-        elif state == 23:
-            return Token(TokenType.AdditiveOp, lexeme)
-        elif state == 24:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 25:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 28:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 27:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 29:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 30:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 31:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 32:
-            return Token(TokenType.RelationalOp, lexeme)
-        elif state == 33:
-            return Token(TokenType.comment, lexeme)
-        elif state == 34:
-            return Token(TokenType.RelationalOp, lexeme)
-        else:
-            return Token(TokenType.void, lexeme)
+    def InitializeTokenTypes(self):
+        # TokenType of every accepting state, plus the reserved words that
+        # turn an identifier (state 4) or a double-underscore name (state 7)
+        # into something else. Built once so classifying a lexeme is a list
+        # index or a single dict lookup.
+        self.state_types = [TokenType.void] * len(self.accepting)
+        for state, token_type in [
+                (1, TokenType.integer_literal), (3, TokenType.float_literal), (4, TokenType.identifier),
+                (8, TokenType.open_curly), (9, TokenType.close_curly), (10, TokenType.colon),
+                (11, TokenType.semicolon), (12, TokenType.comma), (13, TokenType.open_bracket),
+                (14, TokenType.close_bracket), (15, TokenType.open_par), (16, TokenType.close_par),
+                (17, TokenType.open_square_bracket), (18, TokenType.close_square_bracket),
+                (19, TokenType.whitespace), (20, TokenType.MultiplicativeOp), (21, TokenType.MultiplicativeOp),
+                (22, TokenType.AdditiveOp), (23, TokenType.AdditiveOp), (24, TokenType.RelationalOp),
+                (25, TokenType.RelationalOp), (27, TokenType.equal), (28, TokenType.RelationalOp),
+                (29, TokenType.RelationalOp), (30, TokenType.RelationalOp), (31, TokenType.RelationalOp),
+                (32, TokenType.arrow), (33, TokenType.comment)]:
+            self.state_types[state] = token_type
+
+        self.keyword_types = {}
+        for lexeme in ["int", "bool", "char", "float", "colour"]:
+            self.keyword_types[sys.intern(lexeme)] = TokenType.type
+        for lexeme in ["for", "if", "while", "return", "else", "let", "as", "fun", "not"]:
+            self.keyword_types[sys.intern(lexeme)] = TokenType.Keyword
+        self.keyword_types[sys.intern("and")] = TokenType.MultiplicativeOp
+        self.keyword_types[sys.intern("or")] = TokenType.AdditiveOp
+        self.keyword_types[sys.intern("true")] = TokenType.bool
+        self.keyword_types[sys.intern("false")] = TokenType.bool
+
+        self.colour_re = re.compile("#[0-9a-fA-F]{6}")
+
+        self.builtin_types = {}
+        for lexeme in ["__width", "__height", "__read", "__random_int", "__print", "__delay", "__write_box", "__write"]:
+            self.builtin_types[sys.intern(lexeme)] = TokenType.Keyword
+
+    def TokenTypeByFinalState(self, state, lexeme):
+        if state == 4:
+            return self.keyword_types.get(lexeme, TokenType.identifier)
+        if state == 7:
+            return self.builtin_types.get(lexeme, TokenType.void)
+        if state == 35:
+            return TokenType.colour_literal if self.colour_re.fullmatch(lexeme) else TokenType.void
+        return self.state_types[state]
+
+    def GetTokenTypeByFinalState(self, state, lexeme, start=-1):
+        if state == 4 or state == 7:
+            # Names are interned so later passes can compare them by identity
+            lexeme = sys.intern(lexeme)
+            if state == 4:
+                return Token(self.keyword_types.get(lexeme, TokenType.identifier), lexeme, start)
+            return Token(self.builtin_types.get(lexeme, TokenType.void), lexeme, start)
+        if state == 35:
+            return Token(self.TokenTypeByFinalState(state, lexeme), lexeme, start)
+        return Token(self.state_types[state], lexeme, start)
 
     def CatChar(self, character, state=None):
         cat = "other"
         if character.isalpha():
             cat = "letter"
-        if character.isdigit():
+        if "0" <= character <= "9":  # not isdigit(), which takes "²" and "٣" that int() rejects
             cat = "digit"
         if character == ".":
             cat = "fullstop"
         if character == "_":
             cat = "Underscore"
-        if character == " ":
+        if character.isspace():
             cat = "ws"
+        if character == "\n":
+            cat = "newline"
         if character == ";":
             cat = "semicolon"
         if character == ":":
@@ -323,6 +514,8 @@ class Lexer:
             cat = "close_square_bracket"
         if character == "!":
             cat = "exclamation_mark"
+        if character == "#":
+            cat = "hashtag"
         return cat
 
     def EndOfInput(self, src_program_str, src_program_idx):
@@ -338,6 +531,7 @@ class Lexer:
             return False, "."
 
     def NextToken(self, src_program_str, src_program_idx):
+        start = src_program_idx
         state = 0  # initial state is 0 - check Tx
         stack = []
         lexeme = ""
@@ -379,41 +573,389 @@ class Lexer:
                 break
 
         if syntax_error:
-            return Token(TokenType.void, lexeme), "error"
+            return Token(TokenType.void, lexeme, src_program_idx - 1), "error"
 
         if self.AcceptingStates(state):
-            return self.GetTokenTypeByFinalState(state, lexeme), lexeme
+            return self.GetTokenTypeByFinalState(state, lexeme, start), lexeme
         else:
-            return Token(TokenType.void, lexeme), "Lexical Error"
+            return Token(TokenType.void, lexeme, start), "Lexical Error"
+
+    def ScanCompiled(self, src_program_str, src_program_idx):
+        # Run the compiled DFA from src_program_idx. Returns the last accepting
+        # state (-1 if none was reached), the index just past the lexeme it
+        # accepted, and the index at which the DFA stopped - either on the
+        # character that had no transition or at the end of the input.
+        tx = self.tx_flat
+        cols = self.cols
+        char_class = self.char_class
+        accepting = self.accepting
+        end = len(src_program_str)
+        state = 0
+        last_state = -1
+        last_idx = src_program_idx
+
+        while src_program_idx < end:
+            character = src_program_str[src_program_idx]
+            code = ord(character)
+            column = char_class[code] if code < 256 else self.CharClass(character)
+            state = tx[state * cols + column]
+            if state == -1:
+                break
+            src_program_idx += 1
+            if accepting[state]:
+                last_state = state
+                last_idx = src_program_idx
+
+        return last_state, last_idx, src_program_idx
+
+    def NextTokenCompiled(self, src_program_str, src_program_idx):
+        # Same maximal munch as NextToken, but instead of a rollback stack the
+        # scan remembers the last accepting state and where it ended.
+        state, last_idx, stop_idx = self.ScanCompiled(src_program_str, src_program_idx)
+
+        if state == -1:
+            # No accepting state was reached: report the character that
+            # stopped the DFA (or the final character at end of input).
+            error_idx = min(stop_idx, len(src_program_str) - 1)
+            return Token(TokenType.void, src_program_str[error_idx], error_idx), "error"
+
+        lexeme = src_program_str[src_program_idx:last_idx]
+        return self.GetTokenTypeByFinalState(state, lexeme, src_program_idx), lexeme
+
+    def Recover(self, src_program_str, src_program_idx, base_offset=0):
+        # Error recovery for a scan starting at src_program_idx that produced
+        # no valid token: skip what the DFA consumed (or the one character it
+        # could not start on), then every following character that cannot
+        # start a token either. Returns where scanning resumes and a
+        # Diagnostic for the skipped text; base_offset is added to its offset
+        # when the string is a piece of a larger source.
+        state, last_idx, stop_idx = self.ScanCompiled(src_program_str, src_program_idx)
+        if state == -1:
+            resume_idx = max(stop_idx, src_program_idx + 1)
+            message = "Lexical Error: unexpected"
+        else:
+            resume_idx = last_idx  # a "__" name that is not a builtin, or a bad colour
+            message = "Lexical Error: invalid colour literal" if state == 35 else "Lexical Error: unknown builtin"
+
+        end = len(src_program_str)
+        while resume_idx < end and self.tx_flat[self.CharClass(src_program_str[resume_idx])] == -1:
+            resume_idx += 1
+
+        text = src_program_str[src_program_idx:resume_idx]
+        return resume_idx, Diagnostic(base_offset + src_program_idx, text, f"{message} '{text}'")
+
+    def GenerateTokensRegex(self, src_program_str):
+        scan_str = src_program_str
+        if not scan_str.isascii():
+            stand_in = {ord(ch): self.scanner_stand_in[self.CharClass(ch)] for ch in set(scan_str) if ord(ch) > 127}
+            scan_str = scan_str.translate(stand_in)
 
-    def GenerateTokens(self, src_program_str):
         tokens_list = []
+        states = self.scanner_states
+        trivia_states = self.trivia_states if self.skip_trivia else ()
+        scanner = self.scanner_re.scanner(scan_str)
         src_program_idx = 0
-        token, lexeme = self.NextToken(src_program_str, src_program_idx)
-        tokens_list.append(token)
+        end = len(src_program_str)
+
+        while src_program_idx < end:
+            match = scanner.match()
+            if match is None:
+                if self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    self.diagnostics.append(diagnostic)
+                    scanner = self.scanner_re.scanner(scan_str, src_program_idx)
+                    continue
+                partial = self.scanner_error_re.match(scan_str, src_program_idx)
+                error_idx = min(partial.end() if partial else src_program_idx, end - 1)
+                tokens_list.append(Token(TokenType.void, src_program_str[error_idx], error_idx))
+                break  # A lexical error was encountered
+            state = states[match.lastgroup]
+            if state not in trivia_states:
+                token = self.GetTokenTypeByFinalState(state, src_program_str[src_program_idx:match.end()], src_program_idx)
+                if token.type == TokenType.void and self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    self.diagnostics.append(diagnostic)
+                    scanner = self.scanner_re.scanner(scan_str, src_program_idx)
+                    continue
+                tokens_list.append(token)
+                if token.type == TokenType.void:
+                    break  # A lexical error was encountered
+            src_program_idx = match.end()
 
-        while token != -1:
-            src_program_idx += len(lexeme)
-            if not self.EndOfInput(src_program_str, src_program_idx):
-                token, lexeme = self.NextToken(src_program_str, src_program_idx)
+        return tokens_list
+
+    def GenerateTokensCompiled(self, src_program_str):
+        tokens_list = []
+        trivia_states = self.trivia_states if self.skip_trivia else ()
+        src_program_idx = 0
+        end = len(src_program_str)
+
+        while src_program_idx < end:
+            state, last_idx, stop_idx = self.ScanCompiled(src_program_str, src_program_idx)
+            if state == -1:
+                if self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    self.diagnostics.append(diagnostic)
+                    continue
+                error_idx = min(stop_idx, end - 1)
+                tokens_list.append(Token(TokenType.void, src_program_str[error_idx], error_idx))
+                break  # A lexical error was encountered
+            if state not in trivia_states:
+                token = self.GetTokenTypeByFinalState(state, src_program_str[src_program_idx:last_idx], src_program_idx)
+                if token.type == TokenType.void and self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    self.diagnostics.append(diagnostic)
+                    continue
                 tokens_list.append(token)
                 if token.type == TokenType.void:
                     break  # A lexical error was encountered
-            else:
-                break  # The end of the source program
+            src_program_idx = last_idx
 
         return tokens_list
 
-    def GenerateTokensFromFile(self, file_path):
-        with open(file_path, 'r') as file:
-            src_program_str = file.read()
-        return self.GenerateTokens(src_program_str)
+    def GenerateTokens(self, src_program_str):
+        self.diagnostics = []
+        if self.backend == "regex":
+            return self.GenerateTokensRegex(src_program_str)
+        if self.backend == "compiled":
+            return self.GenerateTokensCompiled(src_program_str)
 
-lex = Lexer()
-toks = lex.GenerateTokensFromFile("ExampleForTasks")
-for t in toks:
-    print(t.type, t.lexeme)
+        tokens_list = []
+        src_program_idx = 0
 
+        while not self.EndOfInput(src_program_str, src_program_idx):
+            token, lexeme = self.NextToken(src_program_str, src_program_idx)
+            if token.type == TokenType.void and self.recover:
+                src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                self.diagnostics.append(diagnostic)
+                continue
+            if not (self.skip_trivia and token.type in (TokenType.whitespace, TokenType.comment)):
+                tokens_list.append(token)
+            if token.type == TokenType.void:
+                break  # A lexical error was encountered
+            src_program_idx += len(lexeme)
 
+        return tokens_list
 
+    def GenerateTokenBuffer(self, src_program_str):
+        # GenerateTokens recorded into a TokenBuffer instead of Token objects.
+        if self.cache is not None:
+            return self.cache.Tokens(self, src_program_str)
+        tokens = TokenBuffer(src_program_str)
+        self.ScanIntoBuffer(tokens, 0)
+        return tokens
+
+    def ScanIntoBuffer(self, tokens, src_program_idx, old_tokens=None, resync_idx=0, delta=0):
+        # Lex tokens.src_program_str from src_program_idx onwards into tokens.
+        # With old_tokens given, stop at the first token starting at or after
+        # resync_idx whose offset, shifted back by delta, also started a token
+        # in old_tokens, and return that old token's index. Returns -1 when the
+        # end of the input or a lexical error ends the scan instead.
+        src_program_str = tokens.src_program_str
+        trivia_states = self.trivia_states if self.skip_trivia else ()
+        end = len(src_program_str)
+
+        while src_program_idx < end:
+            if old_tokens is not None and src_program_idx >= resync_idx:
+                # An error token starts at the character that stopped the DFA,
+                # not at a token boundary, so it is never a resync point.
+                old_idx = bisect_left(old_tokens.starts, src_program_idx - delta)
+                if (old_idx < len(old_tokens) and old_tokens.starts[old_idx] == src_program_idx - delta
+                        and old_tokens.kinds[old_idx] != TokenType.void.value):
+                    return old_idx
+            state, last_idx, stop_idx = self.ScanCompiled(src_program_str, src_program_idx)
+            if state == -1:
+                if self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    tokens.diagnostics.append(diagnostic)
+                    continue
+                error_idx = min(stop_idx, end - 1)
+                tokens.append(TokenType.void, error_idx, error_idx + 1)
+                break  # A lexical error was encountered
+            if state in trivia_states:
+                if self.record_trivia:
+                    tokens.append_trivia(src_program_idx, last_idx)
+            else:
+                token_type = self.TokenTypeByFinalState(state, src_program_str[src_program_idx:last_idx])
+                if token_type == TokenType.void and self.recover:
+                    src_program_idx, diagnostic = self.Recover(src_program_str, src_program_idx)
+                    tokens.diagnostics.append(diagnostic)
+                    continue
+                tokens.append(token_type, src_program_idx, last_idx)
+                if token_type == TokenType.void:
+                    break  # A lexical error was encountered
+            src_program_idx = last_idx
+
+        return -1
+
+    def SplitSource(self, src_program_str, parts):
+        # Cut the source into about `parts` pieces right after a newline that
+        # is followed by a non-whitespace character. A newline can only ever
+        # be part of a whitespace token (or the character a lexical error is
+        # reported on), and that whitespace token ends exactly at the cut, so
+        # every cut is a token boundary of the sequential scan and no token's
+        # lookahead crosses it.
+        cuts = [0]
+        step = max(len(src_program_str) // parts, 1)
+        while True:
+            cut = src_program_str.find("\n", cuts[-1] + step)
+            while cut != -1 and (cut + 1 == len(src_program_str) or src_program_str[cut + 1].isspace()):
+                cut = src_program_str.find("\n", cut + 1)
+            if cut == -1:
+                break
+            cuts.append(cut + 1)
+        cuts.append(len(src_program_str))
+        return cuts
+
+    def GenerateTokenBufferParallel(self, src_program_str, workers=4, chunks_per_worker=4):
+        # GenerateTokenBuffer with the source split by SplitSource and the
+        # pieces lexed in a process pool. Each worker returns its arrays with
+        # offsets already rebased onto the whole source; they are concatenated
+        # in order, stopping after the first piece that ends in an error.
+        if workers <= 1:
+            return self.GenerateTokenBuffer(src_program_str)
+
+        cuts = self.SplitSource(src_program_str, workers * chunks_per_worker)
+        chunks = [src_program_str[cuts[i]:cuts[i + 1]] for i in range(len(cuts) - 1)]
+        settings = (self.backend, self.skip_trivia, self.record_trivia, self.recover)
+        tokens = TokenBuffer(src_program_str)
+
+        with ProcessPoolExecutor(workers) as pool:
+            for kinds, starts, ends, trivia_starts, trivia_ends, diagnostics in pool.map(LexChunk, repeat(settings), chunks, cuts):
+                tokens.diagnostics.extend(diagnostics)
+                tokens.kinds.extend(kinds)
+                tokens.starts.extend(starts)
+                tokens.ends.extend(ends)
+                tokens.trivia_starts.extend(trivia_starts)
+                tokens.trivia_ends.extend(trivia_ends)
+                if kinds and kinds[-1] == TokenType.void.value:
+                    pool.shutdown(cancel_futures=True)
+                    break  # A lexical error was encountered
+
+        return tokens
+
+    def RelexTokenBuffer(self, old_tokens, edit_idx, deleted, inserted):
+        # Incrementally update a TokenBuffer made by this lexer for the edit
+        # "replace `deleted` characters at edit_idx with `inserted`". Only the
+        # stretch from the last token boundary the edit cannot affect up to
+        # the first token that starts where an old token started (after the
+        # edit) is lexed again; from there on the DFA sees the same text as
+        # before, so the old tokens are spliced back in with shifted offsets.
+        old_src = old_tokens.src_program_str
+        tokens = TokenBuffer(old_src[:edit_idx] + inserted + old_src[edit_idx + deleted:])
+        delta = len(inserted) - deleted
+
+        # The DFA reads at most one character past the lexeme it accepts
+        # ("1." waiting for a digit) plus the character that stops it, so a
+        # token ending two or more characters before the edit is unaffected.
+        keep = bisect_right(old_tokens.ends, edit_idx - 2)
+        tokens.kinds = old_tokens.kinds[:keep]
+        tokens.starts = old_tokens.starts[:keep]
+        tokens.ends = old_tokens.ends[:keep]
+        src_program_idx = old_tokens.ends[keep - 1] if keep else 0
+        keep_trivia = bisect_right(old_tokens.trivia_ends, src_program_idx)
+        tokens.trivia_starts = old_tokens.trivia_starts[:keep_trivia]
+        tokens.trivia_ends = old_tokens.trivia_ends[:keep_trivia]
+        tokens.diagnostics = [diagnostic for diagnostic in old_tokens.diagnostics if diagnostic.offset < src_program_idx]
+        if keep and old_tokens.kinds[keep - 1] == TokenType.void.value:
+            return tokens  # The lexical error before the edit still ends the scan
+
+        old_idx = self.ScanIntoBuffer(tokens, src_program_idx, old_tokens, edit_idx + len(inserted), delta)
+        if old_idx != -1:
+            old_start = old_tokens.starts[old_idx]
+            old_trivia_idx = bisect_left(old_tokens.trivia_starts, old_start)
+            tokens.kinds.extend(old_tokens.kinds[old_idx:])
+            for offsets, old_offsets, first in [(tokens.starts, old_tokens.starts, old_idx), (tokens.ends, old_tokens.ends, old_idx),
+                                                (tokens.trivia_starts, old_tokens.trivia_starts, old_trivia_idx),
+                                                (tokens.trivia_ends, old_tokens.trivia_ends, old_trivia_idx)]:
+                offsets.extend(map(delta.__add__, old_offsets[first:]) if delta else old_offsets[first:])
+            tokens.diagnostics.extend(Diagnostic(diagnostic.offset + delta, diagnostic.text, diagnostic.message)
+                                      for diagnostic in old_tokens.diagnostics if diagnostic.offset >= old_start)
+
+        return tokens
+
+    def iter_tokens(self, stream, chunk_size=65536):
+        # Lazily lex a text stream (an open file, sys.stdin, ...) read
+        # chunk_size characters at a time, yielding the same tokens as
+        # GenerateTokens. A token is only taken from the buffer once the DFA
+        # has stopped on a character inside it; one that runs into the end of
+        # the buffer ("<" waiting for "=", a "//" comment, a run of spaces) is
+        # rescanned once the next chunk has been appended.
+        self.diagnostics = []
+        trivia_states = self.trivia_states if self.skip_trivia else ()
+        buffer = ""
+        buffer_offset = 0  # offset in the whole stream of buffer[0]
+        src_program_idx = 0
+        at_eof = False
+
+        while True:
+            if src_program_idx == len(buffer):
+                buffer_offset += len(buffer)
+                buffer, src_program_idx = stream.read(chunk_size), 0
+                if not buffer:
+                    return  # The end of the source program
+
+            state, last_idx, stop_idx = self.ScanCompiled(buffer, src_program_idx)
+            if stop_idx == len(buffer) and not at_eof:
+                chunk = stream.read(chunk_size)
+                if chunk:
+                    buffer_offset += src_program_idx
+                    buffer, src_program_idx = buffer[src_program_idx:] + chunk, 0
+                else:
+                    at_eof = True
+                continue
+
+            if self.recover and (state == -1 or (state not in trivia_states and self.TokenTypeByFinalState(
+                    state, buffer[src_program_idx:last_idx]) == TokenType.void)):
+                resume_idx, diagnostic = self.Recover(buffer, src_program_idx, buffer_offset)
+                if resume_idx == len(buffer) and not at_eof:
+                    # The skipped text may go on in the next chunk
+                    chunk = stream.read(chunk_size)
+                    if chunk:
+                        buffer_offset += src_program_idx
+                        buffer, src_program_idx = buffer[src_program_idx:] + chunk, 0
+                    else:
+                        at_eof = True
+                    continue
+                self.diagnostics.append(diagnostic)
+                src_program_idx = resume_idx
+                continue
+
+            if state == -1:
+                error_idx = min(stop_idx, len(buffer) - 1)
+                yield Token(TokenType.void, buffer[error_idx], buffer_offset + error_idx)
+                return  # A lexical error was encountered
+
+            if state not in trivia_states:
+                token = self.GetTokenTypeByFinalState(state, buffer[src_program_idx:last_idx], buffer_offset + src_program_idx)
+                yield token
+                if token.type == TokenType.void:
+                    return  # A lexical error was encountered
+            src_program_idx = last_idx
+
+    def GenerateTokensFromFile(self, file_path):
+        with open(file_path, 'r') as file:
+            src_program_str = file.read()
+        if self.cache is not None:
+            tokens = self.GenerateTokenBuffer(src_program_str)
+            self.diagnostics = tokens.diagnostics
+            return list(tokens)
+        return self.GenerateTokens(src_program_str)
 
+def LexChunk(settings, chunk, offset):
+    # Process pool worker for Lexer.GenerateTokenBufferParallel: lex one piece
+    # of the source and rebase its offsets by where the piece starts.
+    tokens = Lexer(*settings).GenerateTokenBuffer(chunk)
+    for diagnostic in tokens.diagnostics:
+        diagnostic.offset += offset
+    if offset:
+        return (tokens.kinds, array('I', map(offset.__add__, tokens.starts)), array('I', map(offset.__add__, tokens.ends)),
+                array('I', map(offset.__add__, tokens.trivia_starts)), array('I', map(offset.__add__, tokens.trivia_ends)),
+                tokens.diagnostics)
+    return tokens.kinds, tokens.starts, tokens.ends, tokens.trivia_starts, tokens.trivia_ends, tokens.diagnostics
+
+if __name__ == "__main__":
+    lex = Lexer()
+    toks = lex.GenerateTokensFromFile("ExampleForTasks")
+    for t in toks:
+        print(t.type, t.lexeme)
@@ -1,173 +1,461 @@
-import astnodes as ast
+from types import GeneratorType, MethodType
+
+import ASTNodes as ast
 import LexerTask1 as lex
 
+def StatementParser(*keys):
+    # Marks a Parser method as the parser for statements whose first token
+    # matches one of keys: a (TokenType, lexeme) pair or a bare TokenType.
+    def Mark(method):
+        method.statement_keys = keys
+        return method
+    return Mark
+
 class Parser:
-    def __init__(self, src_program_str):
+    # Statement parsers keyed by (TokenType, lexeme) or TokenType, collected
+    # from the @StatementParser methods once per Parser class. Entries are
+    # method names (so subclass overrides apply) or functions added with
+    # RegisterStatement; each Parser binds them once into statement_table.
+    statement_parsers = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.CollectStatementParsers()
+
+    @classmethod
+    def CollectStatementParsers(cls):
+        cls.statement_parsers = dict(cls.statement_parsers)  # a subclass extends a copy
+        for name, method in list(vars(cls).items()):
+            for key in getattr(method, "statement_keys", ()):
+                cls.statement_parsers[key] = name
+
+    @classmethod
+    def RegisterStatement(cls, key, parse):
+        # Hook for statement forms defined outside the class: parse(parser) is
+        # called on the first token of the statement and returns its node (or
+        # a generator, for a statement that contains blocks).
+        if "statement_parsers" not in vars(cls):
+            cls.statement_parsers = dict(cls.statement_parsers)
+        cls.statement_parsers[key] = parse
+
+    def __init__(self, src_program_str, recover=False, store=None, cache=None):
+        # src_program_str is the program text, a token sequence (a list of
+        # Token or a TokenBuffer) which is indexed directly, or any other
+        # iterable of tokens, e.g. Lexer.iter_tokens(stream), which is pulled
+        # from on demand so the full token list is never held in memory.
+        # Token inputs must come from a Lexer with skip_trivia set.
         self.name = "PARSEAR"
-        self.lexer = lex.Lexer()
-        self.tokens = self.lexer.GenerateTokens(src_program_str)
-        self.index = 0
-        self.crtToken = self.tokens[0] if self.tokens else lex.Token(lex.TokenType.end, "END")
+        # Keep parsing after a syntax error instead of raising it: the error
+        # is reported in self.diagnostics, the statement it was found in is
+        # replaced by an ASTErrorNode and parsing resumes after the next ';'
+        # or before the next '}'. Program text is then lexed with recover set
+        # too, and its lexical errors are reported alongside, in source order.
+        self.recover = recover
+        self.diagnostics = []
+        # With a CompileCache, program text is lexed through the cache, and
+        # when node objects are wanted (no store given) an AST cached for the
+        # same text is returned by Parse without lexing or parsing at all. On
+        # a miss the nodes go into a store of our own first, which is saved
+        # to the cache and then turned into node objects.
+        self.cache = cache
+        self.cached_ast = None
+        self.cache_store = None
+        if isinstance(src_program_str, str) and cache is not None and store is None:
+            self.cached_ast = cache.LoadAST(src_program_str)
+            if self.cached_ast is None:
+                store = self.cache_store = ast.ASTStore()
+        # Nodes are built as ASTNodes objects, or with an ASTStore given,
+        # emitted into the store; Parse then returns the program's index.
+        self.nodes = ast if store is None else store
+        self.binary_operators = {operator: (power, getattr(self.nodes, node_class.__name__))
+                                 for operator, (power, node_class) in Parser.binary_operators.items()}
+        self.lexer = lex.Lexer(skip_trivia=True, recover=recover, cache=cache)
+        if self.cached_ast is not None:
+            self.tokens = lex.TokenBuffer(src_program_str)
+            self.source_map = None
+        elif isinstance(src_program_str, str):
+            self.tokens = self.lexer.GenerateTokenBuffer(src_program_str)
+            self.source_map = lex.SourceMap(src_program_str)
+            self.diagnostics.extend(self.tokens.diagnostics)
+        else:
+            self.tokens = src_program_str
+            self.source_map = None
+        self.token_iter = None if isinstance(self.tokens, (list, lex.TokenBuffer)) else iter(self.tokens)
+        self.end_token = lex.Token(lex.TokenType.end, "END", len(src_program_str) if self.source_map else -1)
+        self.statement_table = {key: getattr(self, parse) if isinstance(parse, str) else MethodType(parse, self)
+                                for key, parse in self.statement_parsers.items()}
+        self.index = -1
+        self.NextToken()
 
     def NextToken(self):
-        # Skip whitespace automatically
+        # Whitespace and comments never reach the parser, so advancing is a
+        # plain index increment.
+        self.index += 1
+        if self.token_iter is not None:
+            self.crtToken = next(self.token_iter, self.end_token)
+        elif self.index < len(self.tokens):
+            self.crtToken = self.tokens[self.index]
+        else:
+            self.crtToken = self.end_token
+
+    def Error(self, message):
+        # SyntaxError pointing at the current token, when its position is
+        # known. The token and the bare message are kept as a Diagnostic for
+        # Recover.
+        token = self.crtToken
+        diagnostic = lex.Diagnostic(token.start, token.lexeme, message)
+        if self.source_map is not None and token.start >= 0:
+            line, column = self.source_map.LineColumn(token.start)
+            message = f"{message} at line {line}, column {column}"
+        error = SyntaxError(message)
+        error.diagnostic = diagnostic
+        return error
+
+    def Recover(self, error, closing_type):
+        # Panic mode: report the error and skip to a point where a statement
+        # can start. Skipping stops after a ';', after a '{ ... }' group that
+        # opened while skipping (the end of a compound statement), or before
+        # a '}' that closes the block being parsed.
+        diagnostic = error.diagnostic
+        last = self.diagnostics[-1] if self.diagnostics else None
+        if last is None or (last.offset, last.message) != (diagnostic.offset, diagnostic.message):
+            self.diagnostics.append(diagnostic)  # an unclosed block is reported once, not per level
+        depth = 0
+        while self.crtToken.type != lex.TokenType.end:
+            token_type = self.crtToken.type
+            if token_type == lex.TokenType.open_curly:
+                depth += 1
+            elif token_type == lex.TokenType.close_curly:
+                if depth == 0 and closing_type == lex.TokenType.close_curly:
+                    return
+                depth -= 1
+                if depth <= 0:
+                    self.NextToken()
+                    return
+            elif token_type == lex.TokenType.semicolon and depth == 0:
+                self.NextToken()
+                return
+            self.NextToken()
+
+    # Binding power and AST node class of every binary operator, keyed by
+    # lexeme; a higher power binds tighter. Each Parser copies this with the
+    # classes replaced by its own node builders.
+    binary_operators = {
+        "<": (1, ast.ASTRelationalOpNode), ">": (1, ast.ASTRelationalOpNode),
+        "<=": (1, ast.ASTRelationalOpNode), ">=": (1, ast.ASTRelationalOpNode),
+        "==": (1, ast.ASTRelationalOpNode), "!=": (1, ast.ASTRelationalOpNode),
+        "+": (2, ast.ASTAdditiveOpNode), "-": (2, ast.ASTAdditiveOpNode), "or": (2, ast.ASTAdditiveOpNode),
+        "*": (3, ast.ASTMultiplicativeOpNode), "/": (3, ast.ASTMultiplicativeOpNode), "and": (3, ast.ASTMultiplicativeOpNode),
+    }
+    unary_power = 4  # "-x" and "not x" bind tighter than any binary operator
+    builtin_arity = {"__width": 0, "__height": 0, "__random_int": 1, "__read": 2}
+
+    def ParseExpression(self, min_power=0):
+        # Precedence climbing. Operators of the same level are folded into
+        # the left operand by this loop, and a right operand only recurses
+        # for operators that bind tighter, so the recursion depth is bounded
+        # by the number of precedence levels, never by the length of the
+        # chain: 100k operands parse in one linear pass.
+        left = self.ParseFactor()
+        binary_operators = self.binary_operators
         while True:
-            self.index += 1
-            if self.index < len(self.tokens):
-                self.crtToken = self.tokens[self.index]
-                if self.crtToken.type != lex.TokenType.whitespace:
-                    break
-            else:
-                self.crtToken = lex.Token(lex.TokenType.end, "END")
-                break
+            operator = self.crtToken.lexeme
+            entry = binary_operators.get(operator)
+            if entry is None or entry[0] < min_power:
+                return left
+            power, node_class = entry
+            self.NextToken()  # consume the operator
+            left = node_class(left, operator, self.ParseExpression(power + 1))
 
-    def ParseExpression(self):
-        if self.crtToken.type == lex.TokenType.integer_literal:
-            value = self.crtToken.lexeme
+    def ParseFactor(self):
+        token = self.crtToken
+        if token.type == lex.TokenType.integer_literal:
+            self.NextToken()
+            return self.nodes.ASTIntegerNode(int(token.lexeme))
+        if token.type == lex.TokenType.float_literal:
+            self.NextToken()
+            return self.nodes.ASTFloatLiteralNode(float(token.lexeme))
+        if token.type == lex.TokenType.bool:
             self.NextToken()
-            return ast.ASTIntegerNode(value)
-        # Extend this method to handle more complex expressions
+            return self.nodes.ASTBooleanLiteralNode(token.lexeme == "true")
+        if token.type == lex.TokenType.colour_literal:
+            self.NextToken()
+            return self.nodes.ASTColourLiteralNode(token.lexeme)
+        if token.lexeme == "-" or token.lexeme == "not":
+            self.NextToken()
+            return self.nodes.ASTUnaryNode(token.lexeme, self.ParseExpression(self.unary_power))
+        if token.type == lex.TokenType.open_bracket:
+            self.NextToken()  # consume '('
+            expression = self.ParseExpression()
+            self.Expect(lex.TokenType.close_bracket, "Expected ')' after expression")
+            return self.nodes.ASTSubExpressionNode(expression)
+        if token.type == lex.TokenType.identifier:
+            self.NextToken()
+            if self.crtToken.type == lex.TokenType.open_bracket:
+                self.NextToken()  # consume '('
+                params = [] if self.crtToken.type == lex.TokenType.close_bracket else self.ParseActualParams()
+                self.Expect(lex.TokenType.close_bracket, "Expected ')' after function arguments")
+                return self.nodes.ASTFunctionCallNode(token.lexeme, params)
+            return self.nodes.ASTIdentifierNode(token.lexeme)
+        if token.type == lex.TokenType.Keyword and token.lexeme in self.builtin_arity:
+            return self.ParseBuiltinCall(self.builtin_arity[token.lexeme])
+        raise self.Error(f"Unexpected '{token.lexeme}' in expression")
 
-    def ParseAssignment(self):
-        assignment_lhs = ast.ASTVariableNode(self.crtToken.lexeme)
-        self.NextToken()  # consume the identifier
-        if self.crtToken.type != lex.TokenType.equal:
-            raise SyntaxError("Expected '=' in assignment")
-        self.NextToken()  # consume '='
-        assignment_rhs = self.ParseExpression()  # parse the right-hand side expression
-        return ast.ASTAssignmentNode(assignment_lhs, assignment_rhs)
+    def ParseBuiltinCall(self, arity):
+        # Builtins are function calls with a fixed number of comma separated
+        # arguments and no brackets: __read x, y
+        name = self.crtToken.lexeme
+        self.NextToken()
+        params = []
+        for i in range(arity):
+            if i:
+                self.Expect(lex.TokenType.comma, f"Expected ',' between {name} arguments")
+            params.append(self.ParseExpression())
+        return self.nodes.ASTFunctionCallNode(name, params)
+
+    def ParseActualParams(self):
+        params = [self.ParseExpression()]
+        while self.crtToken.type == lex.TokenType.comma:
+            self.NextToken()  # consume ','
+            params.append(self.ParseExpression())
+        return params
 
-    def ParseTypeDeclaration(self):
-        # Assuming the current token is the type
-        type_name = self.crtToken.lexeme  # 'int', 'float', etc.
-        self.NextToken()  # Move to the next token, which should be the identifier (variable name)
+    def Expect(self, token_type, message):
+        if self.crtToken.type != token_type:
+            raise self.Error(message)
+        self.NextToken()
 
-        if self.crtToken.type != lex.TokenType.identifier:
-            raise SyntaxError("Expected identifier after type name")
+    def ExpectIdentifier(self, message):
+        identifier = self.crtToken.lexeme
+        self.Expect(lex.TokenType.identifier, message)
+        return identifier
 
-        variable_name = self.crtToken.lexeme
-        self.NextToken()  # Move past the variable name
+    def ParseType(self):
+        type_name = self.crtToken.lexeme
+        self.Expect(lex.TokenType.type, "Expected a type")
+        return type_name
 
-        # Check if there is an initialization
-        initializer = None
-        if self.crtToken.type == lex.TokenType.equal:
-            self.NextToken()  # Consume the '='
-            initializer = self.ParseExpression()  # Parse the initialization expression
+    @StatementParser(lex.TokenType.identifier)
+    def ParseAssignment(self):
+        assignment_lhs = self.nodes.ASTVariableNode(self.crtToken.lexeme)
+        self.NextToken()  # consume the identifier
+        self.Expect(lex.TokenType.equal, "Expected '=' in assignment")
+        assignment_rhs = self.ParseExpression()  # parse the right-hand side expression
+        return self.nodes.ASTAssignmentNode(assignment_lhs, assignment_rhs)
 
-        # Create a type declaration node
-        return ast.ASTTypeDeclarationNode(type_name, variable_name, initializer)
+    @StatementParser((lex.TokenType.Keyword, "let"))
+    def ParseVariableDeclaration(self):
+        # let x : int = 1 + 2   (the initializer is kept as the node's suffix)
+        self.NextToken()  # consume 'let'
+        identifier = self.ExpectIdentifier("Expected a variable name after 'let'")
+        self.Expect(lex.TokenType.colon, f"Expected ':' after '{identifier}'")
+        type_name = self.ParseType()
+        self.Expect(lex.TokenType.equal, f"Expected '=' to initialise '{identifier}'")
+        return self.nodes.ASTVariableDeclarationNode(identifier, type_name, self.ParseExpression())
 
+    @StatementParser((lex.TokenType.Keyword, "return"))
+    def ParseReturnStatement(self):
+        self.NextToken()  # consume 'return'
+        return self.nodes.ASTReturnStatementNode(self.ParseExpression())
+
+    # Statements that contain blocks (if, for, while, fun, { ... }) are
+    # generators: they yield the generator parsing each nested block and are
+    # sent back its node. Complete drives them from an explicit stack, so
+    # nesting depth is limited by memory rather than by the interpreter's
+    # recursion limit.
+    @StatementParser((lex.TokenType.Keyword, "if"))
     def ParseIfStatement(self):
         self.NextToken()  # consume 'if'
-        condition = self.ParseExpression()  # Directly parse the condition
-        true_branch = self.ParseStatement()  # Parse the statement that executes if the condition is true
-        return ast.ASTIfNode(condition, true_branch)
+        condition = self.ParseCondition("if")
+        true_block = yield self.ParseBlock()
+        false_block = None
+        if self.crtToken.type == lex.TokenType.Keyword and self.crtToken.lexeme == "else":
+            self.NextToken()  # consume 'else'
+            false_block = yield self.ParseBlock()
+        return self.nodes.ASTIfStatementNode(condition, true_block, false_block)
 
+    @StatementParser((lex.TokenType.Keyword, "while"))
     def ParseWhileStatement(self):
         self.NextToken()  # consume 'while'
-        condition = self.ParseExpression()  # Directly parse the condition
-        body = self.ParseStatement()  # Parse the body of the while loop
-        return ast.ASTWhileNode(condition, body)
+        condition = self.ParseCondition("while")
+        block = yield self.ParseBlock()
+        return self.nodes.ASTWhileStatementNode(condition, block)
 
+    def ParseCondition(self, keyword):
+        self.Expect(lex.TokenType.open_bracket, f"Expected '(' after '{keyword}'")
+        condition = self.ParseExpression()
+        self.Expect(lex.TokenType.close_bracket, f"Expected ')' after the '{keyword}' condition")
+        return condition
+
+    @StatementParser((lex.TokenType.Keyword, "for"))
     def ParseForStatement(self):
+        # for ( [let ...] ; condition ; [assignment] ) { ... }
         self.NextToken()  # consume 'for'
-        condition = self.ParseExpression()  # Directly parse the condition
-        body = self.ParseStatement()  # Parse the body of the loop
-        return ast.ASTForNode(condition, body)
+        self.Expect(lex.TokenType.open_bracket, "Expected '(' after 'for'")
+        initialization = None
+        if self.crtToken.type != lex.TokenType.semicolon:
+            if self.crtToken.lexeme != "let":
+                raise self.Error("Expected a 'let' declaration to start the 'for' loop")
+            initialization = self.ParseVariableDeclaration()
+        self.Expect(lex.TokenType.semicolon, "Expected ';' after the 'for' initialisation")
+        condition = self.ParseExpression()
+        self.Expect(lex.TokenType.semicolon, "Expected ';' after the 'for' condition")
+        increment = None
+        if self.crtToken.type != lex.TokenType.close_bracket:
+            if self.crtToken.type != lex.TokenType.identifier:
+                raise self.Error("Expected an assignment to end the 'for' loop header")
+            increment = self.ParseAssignment()
+        self.Expect(lex.TokenType.close_bracket, "Expected ')' after the 'for' loop header")
+        block = yield self.ParseBlock()
+        return self.nodes.ASTForStatementNode(initialization, condition, increment, block)
 
-    def ParseReturnStatement(self):
-        self.NextToken()  # consume 'return'
-        expression = self.ParseExpression()  # Directly parse the expression to return
-        return ast.ASTReturnNode(expression)
+    @StatementParser((lex.TokenType.Keyword, "fun"))
+    def ParseFunctionDeclaration(self):
+        # fun name ( x : int , c : colour ) -> bool { ... }
+        self.NextToken()  # consume 'fun'
+        identifier = self.ExpectIdentifier("Expected a function name after 'fun'")
+        self.Expect(lex.TokenType.open_bracket, f"Expected '(' after '{identifier}'")
+        params = []
+        if self.crtToken.type != lex.TokenType.close_bracket:
+            params.append(self.ParseFormalParam())
+            while self.crtToken.type == lex.TokenType.comma:
+                self.NextToken()  # consume ','
+                params.append(self.ParseFormalParam())
+        self.Expect(lex.TokenType.close_bracket, "Expected ')' after the parameters")
+        self.Expect(lex.TokenType.arrow, "Expected '->' before the return type")
+        return_type = self.ParseType()
+        block = yield self.ParseBlock()
+        return self.nodes.ASTFunctionDecNode(identifier, self.nodes.ASTFormalParamsNode(params), return_type, block)
 
-    def ParseElseStatement(self):
-        self.NextToken()  # consume 'else'
-        body = self.ParseStatement()  # Directly parse the else body
-        return ast.ASTElseNode(body)
+    def ParseFormalParam(self):
+        # x : int, or x : int [ 8 ] for an array parameter
+        identifier = self.ExpectIdentifier("Expected a parameter name")
+        self.Expect(lex.TokenType.colon, f"Expected ':' after '{identifier}'")
+        type_name = self.ParseType()
+        size = None
+        if self.crtToken.type == lex.TokenType.open_square_bracket:
+            self.NextToken()  # consume '['
+            size = self.crtToken.lexeme
+            self.Expect(lex.TokenType.integer_literal, "Expected an array size")
+            size = int(size)
+            self.Expect(lex.TokenType.close_square_bracket, "Expected ']' after the array size")
+        return self.nodes.ASTFormalParamNode(identifier, type_name, size)
 
-    def ParseLetStatement(self):
-        self.NextToken()  # consume 'let'
-        identifier = self.ParseExpression()  # Assume the first expression is an identifier or similar
-        body = self.ParseStatement()  # Parse the statement to execute
-        return ast.ASTLetNode(identifier, body)
+    builtin_statement_arity = {"__delay": 1, "__write": 3, "__write_box": 5}
+
+    @StatementParser((lex.TokenType.Keyword, "__print"))
+    def ParsePrintStatement(self):
+        self.NextToken()  # consume '__print'
+        return self.nodes.ASTPrintStatementNode(self.ParseExpression())
 
-    def ParseAsStatement(self):
-        self.NextToken()  # consume 'as'
-        identifier = self.ParseExpression()  # Assume the first expression is an identifier or similar
-        body = self.ParseStatement()  # Parse the body that follows
-        return ast.ASTAsNode(identifier, body)
+    @StatementParser(*[(lex.TokenType.Keyword, name) for name in builtin_statement_arity])
+    def ParseBuiltinStatement(self):
+        # __delay, __write and __write_box are calls used as statements
+        return self.ParseBuiltinCall(self.builtin_statement_arity[self.crtToken.lexeme])
 
     def ParseStatement(self):
-        if self.crtToken.type == lex.TokenType.Keyword:
-            if self.crtToken.lexeme == "if":
-                return self.ParseIfStatement()
-            elif self.crtToken.lexeme == "while":
-                return self.ParseWhileStatement()
-            elif self.crtToken.lexeme == "for":
-                return self.ParseForStatement()
-            elif self.crtToken.lexeme == "return":
-                return self.ParseReturnStatement()
-            elif self.crtToken.lexeme == "else":
-                return self.ParseElseStatement()
-            elif self.crtToken.lexeme == "let":
-                return self.ParseLetStatement()
-            elif self.crtToken.lexeme == "as":
-                return self.ParseAsStatement()
-            else:
-                raise SyntaxError(f"Syntax Error: Unrecognized keyword '{self.crtToken.lexeme}'")
-        elif self.crtToken.type == lex.TokenType.open_par:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.close_par:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.open_bracket:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.close_bracket:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.open_square_bracket:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.close_square_bracket:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.open_curly:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.close_curly:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.comma:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.colon:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.semicolon:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.AdditiveOp:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.MultiplicativeOp:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.RelationalOp:
-            return self.ParseAssignment()
-        elif self.crtToken.type == lex.TokenType.identifier:
-            return self.ParseAssignment()
-        else:
-            raise SyntaxError("Syntax Error: Unrecognized statement start")
+        # One dict lookup on the first token picks the statement parser:
+        # keywords by (type, lexeme), everything else by type alone.
+        token = self.crtToken
+        parse = self.statement_table.get((token.type, token.lexeme)) or self.statement_table.get(token.type)
+        if parse is None:
+            if token.type == lex.TokenType.Keyword:
+                raise self.Error(f"Syntax Error: Unrecognized keyword '{token.lexeme}'")
+            raise self.Error("Syntax Error: Unrecognized statement start")
+        return parse()
 
+    @StatementParser(lex.TokenType.open_curly)
     def ParseBlock(self):
-        block = ast.ASTBlockNode()
-        while self.crtToken.type != lex.TokenType.end and self.crtToken.type != lex.TokenType.close_curly:
-            statement = self.ParseStatement()
-            block.add_statement(statement)
-            if self.crtToken.type == lex.TokenType.semicolon:
-                self.NextToken()
+        self.Expect(lex.TokenType.open_curly, "Expected '{' to open a block")
+        statements = yield from self.ParseStatements(lex.TokenType.close_curly)
+        self.NextToken()  # consume '}'
+        return self.nodes.ASTBlockNode(statements)
+
+    def ParseStatements(self, closing_type):
+        # Statements up to (not including) a token of closing_type. Simple
+        # statements end in ';', statements with blocks end in their '}'.
+        statements = []
+        while self.crtToken.type != closing_type:
+            if self.crtToken.type == lex.TokenType.end:
+                error = self.Error("Expected '}' before the end of the program")
+                if not self.recover:
+                    raise error
+                self.Recover(error, closing_type)
+                break  # close every open block at the end of the input
+            statement = None
+            try:
+                statement = self.ParseStatement()
+                if type(statement) is GeneratorType:
+                    statement = yield statement
+                else:
+                    self.Expect(lex.TokenType.semicolon, "Expected ';' after statement")
+            except SyntaxError as error:
+                if not self.recover:
+                    raise
+                self.Recover(error, closing_type)
+                if statement is None or type(statement) is GeneratorType:
+                    statement = self.nodes.ASTErrorNode(error.diagnostic.message)
+            statements.append(statement)
+        return statements
+
+    def Complete(self, parse):
+        # Run a generator parse method to completion: each yielded generator
+        # is pushed and driven in turn, and its result is sent to the one that
+        # yielded it. A SyntaxError is thrown into the one that yielded it
+        # instead, as if the nested parse had been an ordinary call.
+        stack = [parse]
+        result = None
+        error = None
+        while True:
+            try:
+                if error is None:
+                    nested = stack[-1].send(result)
+                else:
+                    nested = stack[-1].throw(error)
+            except StopIteration as done:
+                stack.pop()
+                if not stack:
+                    return done.value
+                result, error = done.value, None
+            except SyntaxError as raised:
+                stack.pop()
+                if not stack:
+                    raise
+                error = raised
             else:
-                raise SyntaxError("Expected ';' after statement")
-        return block
+                stack.append(nested)
+                result, error = None, None
 
     def ParseProgram(self):
-        return self.ParseBlock()
+        return self.nodes.ASTProgramNode(self.Complete(self.ParseStatements(lex.TokenType.end)))
 
     def Parse(self):
-        self.ParseProgram()  # start the parsing process
+        if self.cached_ast is not None:
+            self.ASTroot = self.cached_ast.Tree()
+            return self.ASTroot
+        self.ASTroot = self.ParseProgram()  # start the parsing process
+        self.diagnostics.sort(key=lambda diagnostic: diagnostic.offset)
+        if self.cache_store is not None:
+            if not self.diagnostics:
+                self.cache.SaveAST(self.tokens.src_program_str, self.cache_store)
+            self.ASTroot = self.cache_store.Tree(self.ASTroot)
+        return self.ASTroot
+
+Parser.CollectStatementParsers()
 
-# Assuming the correct setup of lexer and AST nodes
-parser = Parser("int")
-parser.Parse()
+if __name__ == "__main__":
+    parser = Parser("""
+fun max(a : int, b : int) -> int {
+    if (a > b) { return a; } else { return b; }
+}
+let c : colour = #00ff7f;
+for (let i : int = 0; i < 10; i = i + 1) {
+    __write_box i, max(i, 3), 1, 1, c;
+    __delay 16;
+}
+while (not (__random_int 10 == 0)) { __print __read 1, 2 * -__width; }
+""")
+    parser.Parse()
 
-print_visitor = ast.PrintNodesVisitor()
-parser.ASTroot.accept(print_visitor)
+    print_visitor = ast.PrintNodesVisitor()
+    parser.ASTroot.accept(print_visitor)
@@ -0,0 +1,427 @@
+import ASTNodes as ast
+import LexerTask1 as lex
+import ParserTask2 as parser
+
+
+class Symbol:
+    __slots__ = ("name", "type", "level", "slot", "scope")
+
+    def __init__(self, name, type_name, level, slot, scope):
+        self.name = name
+        self.type = type_name
+        self.level = level  # which open frame holds it: 0 is the global frame
+        self.slot = slot
+        self.scope = scope  # how many scopes were open when it was declared
+
+
+class SymbolTable:
+    # Scopes nest, but a lookup never walks them: every name maps to the stack
+    # of symbols declared under it, innermost last, and closing a scope pops
+    # the names it declared. The global code and each function call get a
+    # frame of slots. A block takes further slots of its frame and hands them
+    # back when it closes, so sibling blocks reuse the same slots and a
+    # frame's size is the most slots ever in use at once.
+    def __init__(self):
+        self.bindings = {}
+        self.scopes = []  # per open scope: the names declared in it, and its frame's next slot when it opened
+        self.frames = []  # per open frame: [next free slot, size]
+
+    def OpenFrame(self):
+        self.frames.append([0, 0])
+
+    def CloseFrame(self):
+        return self.frames.pop()[1]
+
+    def OpenScope(self):
+        self.scopes.append(([], self.frames[-1][0]))
+
+    def CloseScope(self):
+        names, first_slot = self.scopes.pop()
+        bindings = self.bindings
+        for name in names:
+            symbols = bindings[name]
+            symbols.pop()
+            if not symbols:
+                del bindings[name]
+        self.frames[-1][0] = first_slot
+
+    def Declare(self, name, type_name):
+        # The new symbol, or None when the innermost scope already has name.
+        symbols = self.bindings.get(name)
+        scope = len(self.scopes)
+        if symbols and symbols[-1].scope == scope:
+            return None
+        frame = self.frames[-1]
+        symbol = Symbol(name, type_name, len(self.frames) - 1, frame[0], scope)
+        frame[0] += 1
+        if frame[0] > frame[1]:
+            frame[1] = frame[0]
+        if symbols is None:
+            self.bindings[name] = [symbol]
+        else:
+            symbols.append(symbol)
+        self.scopes[-1][0].append(name)
+        return symbol
+
+    def Lookup(self, name):
+        symbols = self.bindings.get(name)
+        return symbols[-1] if symbols else None
+
+
+class SemanticVisitor(ast.ASTVisitor, ast.ASTWalker):
+    # Resolves every variable and checks every type in one walk of the tree,
+    # without recursion. Each ASTIdentifierNode and ASTVariableNode gets the
+    # (depth, slot) of its variable: depth is how many frames out from the
+    # current one it lives (0 for the current frame, 1 for a global used in a
+    # function), slot its index in that frame. Declarations get their slot,
+    # functions and the program their frame_size, and calls the
+    # ASTFunctionDecNode they call. Expression types are kept on a stack: a
+    # node's checking step runs after its operands, pops their types and
+    # pushes its own. A type of None stands for an expression that already
+    # failed to check, so one mistake is reported once. Errors are collected
+    # in self.diagnostics; nodes carry no source offsets, so those are -1.
+    # Functions can be called before they are declared, but not before the
+    # globals they use: every call from the program's own code is checked,
+    # once all functions are known, against the globals each function it
+    # can reach uses.
+    base_types = frozenset(["int", "float", "bool", "colour"])
+    # Parameter types and result type of every builtin; the statements return
+    # nothing.
+    builtins = {
+        "__width": ((), "int"), "__height": ((), "int"), "__random_int": (("int",), "int"),
+        "__read": (("int", "int"), "colour"), "__delay": (("int",), None),
+        "__write": (("int", "int", "colour"), None), "__write_box": (("int", "int", "int", "int", "colour"), None),
+    }
+    # Operand types each arithmetic operator accepts; both operands must have
+    # the same type, which is also the result's.
+    arithmetic = {"+": ("int", "float", "colour"), "-": ("int", "float", "colour"), "*": ("int", "float"), "/": ("int", "float")}
+    ordering = frozenset(["<", ">", "<=", ">="])
+
+    def __init__(self):
+        super().__init__()
+        self.name = "Semantic Analysis Visitor"
+        self.symbols = SymbolTable()
+        self.functions = {}  # name -> (ASTFunctionDecNode, parameter types)
+        self.function = None  # the function being checked
+        self.types = []
+        self.diagnostics = []
+        self.global_order = {}  # global Symbol -> how many globals were declared before it
+        self.uses = {}  # function name -> global Symbols it uses
+        self.calls = {}  # function name -> names of the functions it calls
+        self.program_calls = []  # (function name, globals declared so far) per call outside functions
+
+    def Check(self, root):
+        self.walk(root)
+        return self.diagnostics
+
+    def pre_visit(self, node):
+        self.handlers[node.kind](node)
+
+    def Report(self, text, message):
+        if self.function is not None:
+            message = f"{message} in function '{self.function.identifier}'"
+        self.diagnostics.append(lex.Diagnostic(-1, text, message))
+
+    def ParamType(self, param):
+        return f"{param.type}[{param.size}]" if param.size else param.type
+
+    def Resolve(self, node, name):
+        # Point node at the variable name and return its type.
+        symbol = self.symbols.Lookup(name)
+        if symbol is None:
+            self.Report(name, f"Undeclared variable '{name}'")
+            return None
+        node.depth = len(self.symbols.frames) - 1 - symbol.level
+        node.slot = symbol.slot
+        if node.depth and self.function is not None:
+            self.uses.setdefault(self.function.identifier, []).append(symbol)
+        return symbol.type
+
+    def Statement(self, statement):
+        self.Visit(statement)
+        if type(statement) is ast.ASTFunctionCallNode:
+            self.Then(self.types.pop)  # a builtin statement's (empty) result
+
+    def visit_boolean_literal_node(self, node):
+        self.types.append("bool")
+
+    def visit_integer_node(self, node):
+        self.types.append("int")
+
+    def visit_float_literal_node(self, node):
+        self.types.append("float")
+
+    def visit_colour_literal_node(self, node):
+        self.types.append("colour")
+
+    def visit_type_node(self, node):
+        pass
+
+    def visit_error_node(self, node):
+        pass  # already reported by the parser
+
+    def visit_identifier_node(self, node):
+        self.types.append(self.Resolve(node, node.identifier))
+
+    def visit_variable_node(self, node):
+        self.types.append(self.Resolve(node, node.lexeme))
+
+    def visit_sub_expression_node(self, node):
+        self.Visit(node.expression)
+
+    def visit_unary_node(self, node):
+        self.Visit(node.operand)
+        self.Then(self.CheckUnary, node)
+
+    def CheckUnary(self, node):
+        operand = self.types.pop()
+        expected = ("bool",) if node.operator == "not" else ("int", "float")
+        if operand is not None and operand not in expected:
+            self.Report(node.operator, f"Operator '{node.operator}' cannot be applied to {operand}")
+            operand = None
+        self.types.append(operand)
+
+    def visit_binary_op_node(self, node):
+        self.Visit(node.left)
+        self.Visit(node.right)
+        self.Then(self.CheckBinary, node)
+
+    visit_additive_op_node = visit_binary_op_node
+    visit_multiplicative_op_node = visit_binary_op_node
+    visit_relational_op_node = visit_binary_op_node
+
+    def CheckBinary(self, node):
+        types = self.types
+        right = types.pop()
+        left = types.pop()
+        operator = node.operator
+        if operator == "and" or operator == "or":
+            result = "bool"
+            valid = left == right == "bool"
+        elif operator in self.arithmetic:
+            result = left
+            valid = left == right and left in self.arithmetic[operator]
+        else:
+            result = "bool"
+            valid = left == right and (operator not in self.ordering or left in ("int", "float"))
+        if left is None or right is None:
+            valid = True  # reported already
+            if result is left:
+                result = None
+        if not valid:
+            self.Report(operator, f"Operator '{operator}' cannot be applied to {left} and {right}")
+            result = None
+        types.append(result)
+
+    def visit_function_call_node(self, node):
+        for param in node.actual_params:
+            self.Visit(param)
+        self.Then(self.CheckCall, node, node.identifier, len(node.actual_params))
+
+    def visit_function_invocation_node(self, node):
+        for arg in node.arguments:
+            self.Visit(arg)
+        self.Then(self.CheckCall, node, node.function_name, len(node.arguments))
+
+    def CheckCall(self, node, name, count):
+        types = self.types
+        args = types[len(types) - count:]
+        del types[len(types) - count:]
+        if name in self.builtins:
+            params, result = self.builtins[name]
+        elif name in self.functions:
+            declaration, params = self.functions[name]
+            result = declaration.return_type
+            if type(node) is ast.ASTFunctionCallNode:
+                node.declaration = declaration
+            if self.function is not None:
+                self.calls.setdefault(self.function.identifier, set()).add(name)
+            else:
+                self.program_calls.append((name, len(self.global_order)))
+        else:
+            self.Report(name, f"Undeclared function '{name}'")
+            types.append(None)
+            return
+        if len(args) != len(params):
+            self.Report(name, f"'{name}' takes {len(params)} arguments, not {len(args)}")
+        else:
+            for position, (arg, param) in enumerate(zip(args, params), 1):
+                if arg is not None and arg != param:
+                    self.Report(name, f"Argument {position} of '{name}' must be {param}, not {arg}")
+        types.append(result)
+
+    def visit_actual_params_node(self, node):
+        for param in node.parameters:
+            self.Visit(param)
+        self.Then(self.Collapse, len(node.parameters))
+
+    def Collapse(self, count):
+        # A parameter list as one value of no particular type.
+        del self.types[len(self.types) - count:]
+        self.types.append(None)
+
+    def visit_print_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.types.pop)
+
+    def visit_assignment_node(self, node):
+        self.Visit(node.expr)
+        self.Then(self.CheckAssignment, node)
+
+    def CheckAssignment(self, node):
+        value = self.types.pop()
+        target = self.Resolve(node.id, node.id.lexeme)
+        if value is not None and target is not None and value != target:
+            self.Report(node.id.lexeme, f"Cannot assign {value} to '{node.id.lexeme}' of type {target}")
+
+    def visit_variable_declaration_node(self, node):
+        if isinstance(node.suffix, ast.ASTNode):
+            self.Visit(node.suffix)
+            self.Then(self.Declare, node, True)
+        else:
+            self.Declare(node, False)
+
+    def Declare(self, node, initialised):
+        value = self.types.pop() if initialised else node.type
+        if node.type not in self.base_types:
+            self.Report(node.type, f"Unknown type '{node.type}'")
+        elif value is not None and value != node.type:
+            self.Report(node.identifier, f"Cannot initialise '{node.identifier}' of type {node.type} with {value}")
+        symbol = self.symbols.Declare(node.identifier, node.type)
+        if symbol is None:
+            self.Report(node.identifier, f"'{node.identifier}' is already declared in this scope")
+        else:
+            node.slot = symbol.slot
+            if len(self.symbols.frames) == 1:
+                self.global_order[symbol] = len(self.global_order)
+
+    def CheckCondition(self, keyword):
+        condition = self.types.pop()
+        if condition is not None and condition != "bool":
+            self.Report(keyword, f"The '{keyword}' condition must be bool, not {condition}")
+
+    def visit_block_node(self, node):
+        self.symbols.OpenScope()
+        for statement in node.statements:
+            self.Statement(statement)
+        self.Then(self.symbols.CloseScope)
+
+    def visit_if_statement_node(self, node):
+        self.Visit(node.condition)
+        self.Then(self.CheckCondition, "if")
+        self.Visit(node.true_block)
+        if node.false_block:
+            self.Visit(node.false_block)
+
+    def visit_while_statement_node(self, node):
+        self.Visit(node.condition)
+        self.Then(self.CheckCondition, "while")
+        self.Visit(node.block)
+
+    def visit_for_statement_node(self, node):
+        # The loop variable is in a scope of its own around the loop block.
+        self.symbols.OpenScope()
+        if node.initialization:
+            self.Visit(node.initialization)
+        self.Visit(node.condition)
+        self.Then(self.CheckCondition, "for")
+        if node.increment:
+            self.Visit(node.increment)
+        self.Visit(node.block)
+        self.Then(self.symbols.CloseScope)
+
+    def visit_return_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.CheckReturn)
+
+    def CheckReturn(self):
+        value = self.types.pop()
+        if self.function is None:
+            self.Report("return", "'return' outside a function")
+        elif value is not None and value != self.function.return_type:
+            self.Report("return", f"Cannot return {value} from a function returning {self.function.return_type}")
+
+    def visit_formal_params_node(self, node):
+        pass  # declared with their function
+
+    def visit_formal_param_node(self, node):
+        pass
+
+    def visit_function_dec_node(self, node):
+        # Functions are declared at the top level only, so a function's frame
+        # is always one out from its body: depth 1 is the global frame.
+        if self.function is not None or len(self.symbols.scopes) != 1:
+            self.Report(node.identifier, f"Function '{node.identifier}' must be declared at the top level")
+            return
+        if node.return_type not in self.base_types:
+            self.Report(node.return_type, f"Unknown type '{node.return_type}'")
+        self.function = node
+        self.symbols.OpenFrame()
+        self.symbols.OpenScope()
+        for param in node.formal_params.params:
+            if param.type not in self.base_types:
+                self.Report(param.type, f"Unknown type '{param.type}'")
+            if self.symbols.Declare(param.identifier, self.ParamType(param)) is None:
+                self.Report(param.identifier, f"Parameter '{param.identifier}' is declared twice")
+        self.Visit(node.block)
+        self.Then(self.EndFunction, node)
+
+    def EndFunction(self, node):
+        self.symbols.CloseScope()
+        node.frame_size = self.symbols.CloseFrame()
+        self.function = None
+
+    def visit_program_node(self, node):
+        # Functions can be called before (and from above) their declaration,
+        # so their signatures are collected before anything is checked.
+        self.symbols.OpenFrame()
+        self.symbols.OpenScope()
+        for statement in node.blocks:
+            if type(statement) is ast.ASTFunctionDecNode:
+                if statement.identifier in self.functions or statement.identifier in self.builtins:
+                    self.Report(statement.identifier, f"Function '{statement.identifier}' is declared twice")
+                    continue
+                params = tuple(self.ParamType(param) for param in statement.formal_params.params)
+                self.functions[statement.identifier] = (statement, params)
+        for statement in node.blocks:
+            self.Statement(statement)
+        self.Then(self.EndProgram, node)
+
+    def EndProgram(self, node):
+        self.symbols.CloseScope()
+        node.frame_size = self.symbols.CloseFrame()
+        reported = set()
+        for name, declared in self.program_calls:
+            for symbol in self.GlobalsReached(name):
+                if self.global_order[symbol] >= declared and (name, symbol) not in reported:
+                    reported.add((name, symbol))
+                    self.Report(name, f"Function '{name}' is called before global '{symbol.name}' it uses is declared")
+
+    def GlobalsReached(self, name):
+        # The globals used by function name and every function it can call.
+        seen = {name}
+        stack = [name]
+        while stack:
+            function = stack.pop()
+            yield from self.uses.get(function, ())
+            for callee in self.calls.get(function, ()):
+                if callee not in seen:
+                    seen.add(callee)
+                    stack.append(callee)
+
+
+if __name__ == "__main__":
+    program = parser.Parser("""
+fun max(a : int, b : int) -> int {
+    if (a > b) { return a; } else { return b; }
+}
+let c : colour = #00ff7f;
+for (let i : int = 0; i < 10; i = i + 1) {
+    __write_box i, max(i, 3), 1, 1, c;
+    let c : bool = (i > 4) and true;
+    __print max(c, 2.5);
+}
+__print undefined + 1;
+""").Parse()
+    for diagnostic in SemanticVisitor().Check(program):
+        print(diagnostic.message)
@@ -0,0 +1,303 @@
+import hashlib
+import math
+import sys
+
+import ASTNodes as ast
+import BytecodeTask4 as bytecode
+import ConstantFolding as folding
+import SemanticTask3 as semantic
+
+# How the builtins are spelled in generated code; each is a local of
+# program() bound to the display it runs on.
+BUILTIN_NAMES = {"__width": "_width", "__height": "_height", "__random_int": "_random_int", "__read": "_read",
+                 "__delay": "_delay", "__write": "_write", "__write_box": "_write_box"}
+# and and or evaluate both operands in PArL, as & and | do on bools.
+PYTHON_OPERATORS = {"+": "+", "-": "-", "*": "*", "<": "<", ">": ">", "<=": "<=", ">=": ">=",
+                    "==": "==", "!=": "!=", "and": "&", "or": "|"}
+PROLOGUE = [
+    "def program(display):",
+    "    _divide = divide",
+    "    _width = display.width",
+    "    _height = display.height",
+    "    _print = display.Print",
+    "    _random_int = display.RandomInt",
+    "    _read = display.Read",
+    "    _write = display.Write",
+    "    _write_box = display.WriteBox",
+    "    _delay = display.Delay",
+]
+MAX_CODE_OBJECTS = 256
+
+
+def BackendFingerprint():
+    # Hash of the passes between the AST and the code object, for naming
+    # cached code; CompileCache's own fingerprint covers the front end.
+    # BytecodeTask4 is among them for CheckedTree and the default values.
+    # The sources are read once per process.
+    global backend_fingerprint
+    if backend_fingerprint is None:
+        digest = hashlib.sha256()
+        for module in (semantic, folding, bytecode, sys.modules[__name__]):
+            with open(module.__file__, "rb") as file:
+                digest.update(file.read())
+        backend_fingerprint = digest.hexdigest()
+    return backend_fingerprint
+
+
+backend_fingerprint = None
+
+
+class PythonTranspiler(ast.ASTVisitor, ast.ASTWalker):
+    # Lowers a tree that SemanticVisitor has checked to the source of one
+    # Python function, program(display):
+    # - the program's variables are locals of program(), named by their
+    #   global slot, and each PArL function is a def nested in it, whose
+    #   parameters and variables are its own locals named by their slot;
+    #   a function reads globals through its closure and assigns them after
+    #   declaring them nonlocal
+    # - blocks only scope names, which the slots have already resolved, so
+    #   their statements are emitted inline; for loops become while loops
+    # - / is the runtime's divide() unless an operand is a float literal
+    # Expressions are built on a stack of source strings as the ASTWalker
+    # leaves their operands, and fully bracketed.
+    def __init__(self):
+        super().__init__()
+        self.name = "Python Transpiler"
+
+    def Transpile(self, root):
+        if root.frame_size is None:
+            raise ValueError("transpile a tree after SemanticVisitor has checked it")
+        self.lines = list(PROLOGUE)
+        self.depth = 1
+        self.parts = []
+        self.opened = []
+        self.in_function = False
+        self.walk(root)
+        return "\n".join(self.lines) + "\n"
+
+    def pre_visit(self, node):
+        self.handlers[node.kind](node)
+
+    def Line(self, text):
+        self.lines.append("    " * self.depth + text)
+
+    def Statement(self, prefix, suffix=""):
+        # A line around the expression just built.
+        self.Line(prefix + self.parts.pop() + suffix)
+
+    def Open(self, header=None, operand=False):
+        # A compound statement's header line, then its body one level in.
+        if header is not None:
+            self.Line(header + self.parts.pop() + ":" if operand else header)
+        self.opened.append(len(self.lines))
+        self.depth += 1
+
+    def Close(self):
+        if len(self.lines) == self.opened.pop():
+            self.Line("pass")
+        self.depth -= 1
+
+    def Name(self, identifier, depth, slot):
+        if depth == 0 and self.in_function:
+            return f"l{slot}_{identifier}"
+        return f"g{slot}_{identifier}"
+
+    def Statements(self, statements):
+        for statement in statements:
+            self.Visit(statement)
+            if type(statement) is ast.ASTFunctionCallNode:
+                self.Then(self.Statement, "")
+
+    def visit_program_node(self, node):
+        for statement in node.blocks:
+            if type(statement) is ast.ASTFunctionDecNode:
+                self.Visit(statement)
+        self.Statements([statement for statement in node.blocks if type(statement) is not ast.ASTFunctionDecNode])
+        self.Then(self.Line, "return display")
+
+    def visit_function_dec_node(self, node):
+        self.Then(self.Enter, node)
+        self.Visit(node.block)
+        self.Then(self.Line, f"return {self.Literal(bytecode.DEFAULT_VALUES[node.return_type])}")
+        self.Then(self.Leave)
+
+    def Enter(self, node):
+        self.in_function = True
+        params = ", ".join(f"l{slot}_{param.identifier}" for slot, param in enumerate(node.formal_params.params))
+        self.Open(f"def f_{node.identifier}({params}):")
+        assigned = sorted(set(self.GlobalsAssigned(node.block)))
+        if assigned:
+            self.Line("nonlocal " + ", ".join(assigned))
+
+    def Leave(self):
+        self.Close()
+        self.in_function = False
+
+    def GlobalsAssigned(self, block):
+        stack = [block]
+        while stack:
+            node = stack.pop()
+            if type(node) is ast.ASTAssignmentNode and node.id.depth == 1:
+                yield f"g{node.id.slot}_{node.id.lexeme}"
+            stack.extend(node.children())
+
+    def visit_block_node(self, node):
+        self.Statements(node.statements)
+
+    def visit_variable_declaration_node(self, node):
+        self.Visit(node.suffix)
+        self.Then(self.Statement, f"{self.Name(node.identifier, 0, node.slot)} = ")
+
+    def visit_assignment_node(self, node):
+        self.Visit(node.expr)
+        self.Then(self.Statement, f"{self.Name(node.id.lexeme, node.id.depth, node.id.slot)} = ")
+
+    def visit_print_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.Statement, "_print(", ")")
+
+    def visit_return_statement_node(self, node):
+        self.Visit(node.expression)
+        self.Then(self.Statement, "return ")
+
+    def visit_if_statement_node(self, node):
+        self.Visit(node.condition)
+        self.Then(self.Open, "if ", True)
+        self.Visit(node.true_block)
+        self.Then(self.Close)
+        if node.false_block:
+            self.Then(self.Open, "else:")
+            self.Visit(node.false_block)
+            self.Then(self.Close)
+
+    def visit_while_statement_node(self, node):
+        self.Visit(node.condition)
+        self.Then(self.Open, "while ", True)
+        self.Visit(node.block)
+        self.Then(self.Close)
+
+    def visit_for_statement_node(self, node):
+        if node.initialization:
+            self.Visit(node.initialization)
+        self.Visit(node.condition)
+        self.Then(self.Open, "while ", True)
+        self.Visit(node.block)
+        if node.increment:
+            self.Visit(node.increment)
+        self.Then(self.Close)
+
+    def Literal(self, value):
+        if type(value) is float and not math.isfinite(value):
+            return f"float('{value}')"
+        return repr(value)
+
+    def visit_boolean_literal_node(self, node):
+        self.parts.append(self.Literal(node.value))
+
+    visit_integer_node = visit_boolean_literal_node
+    visit_float_literal_node = visit_boolean_literal_node
+
+    def visit_colour_literal_node(self, node):
+        self.parts.append(f"0x{node.value[1:].lower()}")
+
+    def visit_identifier_node(self, node):
+        self.parts.append(self.Name(node.identifier, node.depth, node.slot))
+
+    def visit_variable_node(self, node):
+        self.parts.append(self.Name(node.lexeme, node.depth, node.slot))
+
+    def visit_sub_expression_node(self, node):
+        self.Visit(node.expression)
+
+    def visit_unary_node(self, node):
+        self.Visit(node.operand)
+        self.Then(self.Unary, "-" if node.operator == "-" else "not ")
+
+    def Unary(self, operator):
+        self.parts.append(f"({operator}{self.parts.pop()})")
+
+    def visit_binary_op_node(self, node):
+        self.Visit(node.left)
+        self.Visit(node.right)
+        if node.operator != "/":
+            self.Then(self.Binary, f" {PYTHON_OPERATORS[node.operator]} ")
+        elif ast.ASTFloatLiteralNode in (type(node.left), type(node.right)):
+            self.Then(self.Binary, " / ")
+        else:
+            self.Then(self.Call, "_divide", 2)
+
+    visit_additive_op_node = visit_binary_op_node
+    visit_multiplicative_op_node = visit_binary_op_node
+    visit_relational_op_node = visit_binary_op_node
+
+    def Binary(self, operator):
+        right = self.parts.pop()
+        self.parts[-1] = f"({self.parts[-1]}{operator}{right})"
+
+    def visit_function_call_node(self, node):
+        for param in node.actual_params:
+            self.Visit(param)
+        name = BUILTIN_NAMES.get(node.identifier)
+        if name in ("_width", "_height"):
+            self.parts.append(name)
+        else:
+            self.Then(self.Call, name or f"f_{node.identifier}", len(node.actual_params))
+
+    def Call(self, function, count):
+        arguments = self.parts[len(self.parts) - count:]
+        del self.parts[len(self.parts) - count:]
+        self.parts.append(f"{function}({', '.join(arguments)})")
+
+    def visit_error_node(self, node):
+        raise ValueError("cannot transpile a tree with syntax errors")
+
+
+code_objects = {}  # most recently used last
+
+
+def CompileProgram(src_program_str, fold=True, cache=None):
+    # The code object defining program(display) for a PArL source, from
+    # memory, from cache (a CompileCache) or compiled now. Code is keyed by
+    # the hash of the source and the settings, so an edited program simply
+    # misses. Programs nested deeper than CPython's compiler allows raise
+    # ValueError; run those on the bytecode VM.
+    settings = (fold, BackendFingerprint() if cache is not None else None)
+    key = hashlib.sha256(f"{fold}\0{src_program_str}".encode("utf-8", "surrogatepass")).digest()
+    code = code_objects.pop(key, None)
+    if code is None and cache is not None:
+        code = cache.LoadCode(src_program_str, *settings)
+    if code is None:
+        source = PythonTranspiler().Transpile(bytecode.CheckedTree(src_program_str, fold))
+        try:
+            code = compile(source, "<PArL program>", "exec")
+        except (SyntaxError, RecursionError, MemoryError) as error:
+            raise ValueError(f"program is too deeply nested for Python: {error}") from error
+        if cache is not None:
+            cache.SaveCode(src_program_str, code, *settings)
+    code_objects[key] = code
+    if len(code_objects) > MAX_CODE_OBJECTS:
+        del code_objects[next(iter(code_objects))]
+    return code
+
+
+def Run(code, display):
+    namespace = {"divide": folding.Divide}
+    exec(code, namespace)
+    return namespace["program"](display)
+
+
+if __name__ == "__main__":
+    src = """
+fun max(a : int, b : int) -> int {
+    if (a > b) { return a; } else { return b; }
+}
+let c : colour = #00ff7f;
+for (let i : int = 0; i < 10; i = i + 1) {
+    __write_box i, max(i, 3), 1, 1, c;
+    __delay 16;
+}
+__print max(__width, 7 * 6);
+"""
+    print(PythonTranspiler().Transpile(bytecode.CheckedTree(src)))
+    display = Run(CompileProgram(src), bytecode.Display(stream=sys.stdout))
+    print(f"delayed {display.delayed} ms")